@@ -0,0 +1,14 @@
+"""Benchmarks for tap-redshift and target-pendo.
+
+Runs against the installed tap_redshift and target_pendo packages and the
+local Pendo mock (target_pendo.mock_server), so nothing reaches Redshift
+or app.pendo.io:
+
+    python -m benchmarks synthetic --rows 100000 -o bench.jsonl
+    python -m benchmarks throughput --rows 10000 1000000 5000000 [-- target-pendo args]
+    python -m benchmarks micro
+    python -m benchmarks compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+Every throughput and micro run is saved as JSON under benchmarks/results,
+named by time and commit, so runs can be compared across commits.
+"""
@@ -0,0 +1,90 @@
+import os
+import sys
+import argparse
+from benchmarks import results, synthetic
+
+
+def handle_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('synthetic', help='Write synthetic tap output')
+    gen.add_argument('--rows', type=int, default=10000, help='Total # of rows across both streams')
+    gen.add_argument('--visitor_share', type=float, default=0.5, help='Share of rows in the visitor stream')
+    gen.add_argument('--seed', type=int, default=0)
+    gen.add_argument('-o', '--output', required=True, help='File to write the NDJSON lines to')
+
+    e2e = commands.add_parser('throughput', help='Run target-pendo against the local Pendo mock')
+    e2e.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                     help='Row counts to benchmark, e.g. 10000 1000000 5000000')
+    e2e.add_argument('--visitor_share', type=float, default=0.5, help='Share of rows in the visitor stream')
+    e2e.add_argument('--seed', type=int, default=0)
+    e2e.add_argument('--mock_args', default='', help='Args for the mock, e.g. "--latency 0.2 --rate_429 0.01"')
+    e2e.add_argument('--no_save', action='store_true', help='Print results without saving them')
+
+    tap = commands.add_parser('tap', help='Run tap-redshift discovery and sync on a fake connection')
+    tap.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                     help='Row counts to benchmark, e.g. 10000 1000000')
+    tap.add_argument('--rate', type=float, help='Max rows/s the fake connection serves')
+    tap.add_argument('--latency', type=float, default=0.0,
+                     help='Sec per query and per named cursor round trip')
+    tap.add_argument('--visitor_share', type=float, default=0.5, help='Share of rows in the visitor table')
+    tap.add_argument('--seed', type=int, default=0)
+    tap.add_argument('--mock_args', default='', help='Args for the mock serving fetch_uuids')
+    tap.add_argument('--no_save', action='store_true', help='Print results without saving them')
+
+    micro = commands.add_parser('micro', help='Time the per-record hot paths')
+    micro.add_argument('--calls', type=int, default=10000, help='# of calls per timing')
+    micro.add_argument('--no_save', action='store_true', help='Print results without saving them')
+
+    cmp = commands.add_parser('compare', help='Compare two saved runs of a suite')
+    cmp.add_argument('base', help='Results JSON of the earlier run')
+    cmp.add_argument('head', help='Results JSON of the later run')
+
+    # everything after '--' is passed to target-pendo, or the tap for 'tap',
+    # as in redshift-pendo
+    target_args = []
+    if '--' in argv:
+        idx = argv.index('--')
+        argv, target_args = argv[:idx], argv[idx + 1:]
+    args = parser.parse_args(argv)
+    args.target_args = target_args
+    return args
+
+
+def main(argv=None):
+    args = handle_args(sys.argv[1:] if argv is None else argv)
+    if args.command == 'synthetic':
+        written = synthetic.write_lines(args.output, args.rows, args.visitor_share, args.seed)
+        print(f"WROTE {written} LINES TO {args.output}")
+    elif args.command == 'throughput':
+        from benchmarks import throughput
+        run = throughput.run(args.rows, args.mock_args.split(), args.target_args, args.visitor_share, args.seed)
+        params = {'rows': args.rows, 'mock_args': args.mock_args, 'target_args': args.target_args}
+        if not args.no_save:
+            print(f"SAVED {results.save('throughput', params, run)}")
+    elif args.command == 'tap':
+        from benchmarks import tap_sync
+        run = tap_sync.run(
+            args.rows, args.rate, args.latency, args.mock_args.split(), args.target_args,
+            args.visitor_share, args.seed
+        )
+        params = {
+            'rows': args.rows, 'rate': args.rate, 'latency': args.latency,
+            'mock_args': args.mock_args, 'tap_args': args.target_args
+        }
+        if not args.no_save:
+            print(f"SAVED {results.save('tap', params, run)}")
+    elif args.command == 'micro':
+        # target_pendo's logger writes to ./logs, like the target itself
+        os.makedirs('logs', exist_ok=True)
+        from benchmarks import micro
+        run = micro.run(args.calls)
+        if not args.no_save:
+            print(f"SAVED {results.save('micro', {'calls': args.calls}, run)}")
+    elif args.command == 'compare':
+        results.compare(args.base, args.head)
+
+
+if __name__ == '__main__':
+    main()
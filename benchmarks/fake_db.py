@@ -0,0 +1,287 @@
+"""Fake psycopg2 connection serving synthetic Redshift tables.
+
+Lets tap-redshift's discovery and sync run without a cluster. A
+FakeConnection answers the INFORMATION_SCHEMA queries of discover_catalog
+from the table definitions it is given. It answers COUNT(*) and plain column
+SELECTs from sync_table with typed rows: timestamps, Decimals, ints, bools
+and varchar UUIDs. Statements it does not recognize, e.g. snapshot DDL,
+return no rows. WHERE, ORDER BY and LIMIT clauses are ignored, so every
+row of the table is served.
+
+Each execute() waits out the query latency. Rows are then paced at the
+given rate as they are fetched. Named (server-side) cursors also pay the
+latency once per round trip of itersize rows, like psycopg2's.
+"""
+import re
+import time
+import uuid
+import random
+import datetime
+from decimal import Decimal
+
+SELECT_LIST = re.compile(r'^\s*SELECT\s+(.*?)\s+FROM\s', re.IGNORECASE | re.DOTALL)
+QUOTED = re.compile(r'"([^"]+)"')
+
+
+class FakeTable:
+    """ * name: table name
+        * columns: (column name, udt_name) pairs, in ordinal order
+        * primary_key: primary key column, if any
+        * rows: # of rows served by a SELECT
+        """
+
+    def __init__(self, name=None, columns=None, primary_key=None, rows=0, seed=0):
+        self.name = name
+        self.columns = columns
+        self.primary_key = primary_key
+        self.rows = rows
+        self.seed = seed
+        self.udt = dict(columns)
+
+    def value(self, column=None, rng=None, row_num=0):
+        udt = self.udt[column]
+        if udt in ('timestamp', 'timestamptz'):
+            return datetime.datetime(2021, 1, 1) + datetime.timedelta(seconds=row_num)
+        elif udt == 'numeric':
+            return Decimal(rng.randrange(0, 10000)).scaleb(-2)
+        elif udt in ('int2', 'int4', 'int8'):
+            return 100000 + row_num if column == self.primary_key else int(rng.expovariate(1 / 40))
+        elif udt == 'bool':
+            return rng.random() < 0.2
+        elif column.endswith('_public_id'):
+            return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        return f'{column}_{rng.randrange(1000)}'
+
+    def select(self, columns=None):
+        """Yields the table's rows as tuples of the given columns"""
+
+        rng = random.Random(self.seed)
+        for row_num in range(1, self.rows + 1):
+            yield tuple(self.value(column, rng, row_num) for column in columns)
+
+
+def pendo_tables(rows=0, visitor_share=0.5, seed=0):
+    """Tables shaped like the Pendo integration sources, rows split between them"""
+
+    visitors = int(rows * visitor_share)
+    return [
+        FakeTable('pendo_integration_account', [
+            ('platform_account_public_id', 'varchar'),
+            ('platform_account_id', 'int8'),
+            ('studio_id', 'int8'),  # unmapped, pruned from the SELECT w/ --project_columns
+            ('sg_account_status', 'varchar'),
+            ('sg_photo_plan_used_percentage', 'numeric'),
+            ('sg_lab_price_sheet_created_count', 'int4'),
+            ('sg_galleries_lab_price_sheet_assigned_count', 'int4'),
+            ('sg_lab_fulfilled_orders_approved_count', 'int4'),
+            ('sg_self_fulfilled_orders_received_count', 'int4'),
+            ('sg_account_country', 'varchar'),
+            ('sg_trust_tier', 'varchar'),
+            ('sg_is_free', 'bool'),
+            ('sg_is_in_trial', 'bool'),
+            ('sg_legacy_payments_12mo', 'numeric'),
+            ('last_updated', 'timestamp')
+        ], 'platform_account_public_id', rows - visitors, seed),
+        FakeTable('pendo_integration_visitor', [
+            ('platform_user_public_id', 'varchar'),
+            ('platform_account_id', 'int8'),
+            ('sg_account_owner', 'bool'),
+            ('last_updated', 'timestamp')
+        ], 'platform_user_public_id', visitors, seed + 1)
+    ]
+
+
+def adapt(val=None):
+    """Renders a parameter the way psycopg2 would in mogrify()"""
+
+    if val is None:
+        return 'NULL'
+    elif isinstance(val, bool):
+        return 'true' if val else 'false'
+    elif isinstance(val, (int, float, Decimal)):
+        return str(val)
+    elif isinstance(val, (datetime.date, datetime.datetime)):
+        return f"'{val.isoformat()}'::timestamp"
+    elif isinstance(val, tuple):
+        return '(' + ', '.join(adapt(elem) for elem in val) + ')'
+    elif isinstance(val, list):
+        return 'ARRAY[' + ', '.join(adapt(elem) for elem in val) + ']'
+    return "'" + str(val).replace("'", "''") + "'"
+
+
+class FakeCursor:
+    """ * name: set for named (server-side) cursors
+        * itersize: rows per round trip of a named cursor
+        * description: (column name,) tuples of the last SELECT
+        """
+
+    def __init__(self, connection=None, name=None):
+        self.connection = connection
+        self.name = name
+        self.itersize = 2000
+        self.arraysize = 1
+        self.description = None
+        self.rowcount = -1
+        self.rows = iter(())
+        self.buffered = 0  # rows left before the next round trip
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def mogrify(self, query=None, params=None):
+        if params is None:
+            return query.encode('utf-8')
+        if isinstance(params, dict):
+            return (query % {key: adapt(val) for key, val in params.items()}).encode('utf-8')
+        return (query % tuple(adapt(val) for val in params)).encode('utf-8')
+
+    def execute(self, query=None, params=None):
+        connection = self.connection
+        connection.queries += 1
+        time.sleep(connection.latency)
+        self.buffered = self.itersize if self.name else -1
+        result, columns = connection.answer(query)
+        self.description = [(column,) for column in columns] if columns else None
+        self.rows = iter(result)
+        connection.started = time.monotonic()
+        connection.paced = 0
+
+    def fetchone(self):
+        if self.buffered == 0:
+            # named cursors fetch itersize rows per round trip
+            time.sleep(self.connection.latency)
+            self.buffered = self.itersize
+        row = next(self.rows, None)
+        if row is not None:
+            self.buffered -= 1
+            self.connection.pace()
+        return row
+
+    def fetchmany(self, size=None):
+        rows = []
+        for _ in range(size or self.arraysize):
+            row = self.fetchone()
+            if row is None:
+                break
+            rows.append(row)
+        return rows
+
+    def fetchall(self):
+        return list(iter(self.fetchone, None))
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    """ * tables: FakeTables served, by name
+        * latency: sec waited per query and per named cursor round trip
+        * rate: max # of rows served per sec, if any
+        * rows_served: # of rows fetched across every cursor
+        """
+
+    def __init__(self, tables=None, schema='public', dbname='dev', latency=0.0, rate=None):
+        self.tables = {table.name: table for table in tables}
+        self.schema = schema
+        self.dbname = dbname
+        self.latency = latency
+        self.rate = rate
+        self.rows_served = 0
+        self.queries = 0
+        self.started = time.monotonic()
+        self.paced = 0
+        self.autocommit = False
+        self.closed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.commit()
+
+    def cursor(self, name=None, **kwargs):
+        return FakeCursor(self, name)
+
+    def get_dsn_parameters(self):
+        return {'dbname': self.dbname, 'host': 'fake-redshift', 'port': '5439', 'user': 'benchmark'}
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+    def pace(self):
+        self.rows_served += 1
+        self.paced += 1
+        if self.rate:
+            ahead = self.started + self.paced / self.rate - time.monotonic()
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def table_in(self, query=None):
+        for name, table in self.tables.items():
+            if f'"{name}"' in query or f'.{name}' in query:
+                return table
+        return None
+
+    def answer(self, query=None):
+        """Returns (rows, column names) for the query"""
+
+        lowered = query.lower()
+        # the primary key query also orders by ordinal_position, so it goes first
+        if 'table_constraints' in lowered:
+            return [
+                (table.name, table.primary_key) for table in self.tables.values() if table.primary_key
+            ], None
+        elif 'ordinal_position' in lowered:
+            return [
+                (table.name, pos, column, udt, 'NO' if column == table.primary_key else 'YES')
+                for table in sorted(self.tables.values(), key=lambda table: table.name)
+                for pos, (column, udt) in enumerate(table.columns, 1)
+            ], None
+        elif 'information_schema.tables' in lowered:
+            return [(table.name, 'BASE TABLE') for table in self.tables.values()], None
+        elif not lowered.lstrip().startswith('select'):
+            return [], None  # DDL and DML, e.g. snapshot staging
+        table = self.table_in(query)
+        if table is None:
+            raise NotImplementedError(f"FAKE CONNECTION HAS NO TABLE FOR QUERY: {query}")
+        if 'count(*)' in lowered:
+            return [(table.rows,)], ['count']
+        columns = QUOTED.findall(SELECT_LIST.match(query).group(1))
+        if not columns or any(column not in table.udt for column in columns):
+            raise NotImplementedError(
+                f"FAKE CONNECTION ONLY SERVES PLAIN COLUMN SELECTS, NOT: {query}"
+            )
+        return table.select(columns), columns
+
+
+class FakePool:
+    """Stands in for psycopg2's ThreadedConnectionPool, for --parallel_streams"""
+
+    def __init__(self, connect=None):
+        self.connect = connect
+        self.connections = []
+
+    def getconn(self):
+        conn = self.connect()
+        self.connections.append(conn)
+        return conn
+
+    def putconn(self, conn=None):
+        pass
+
+    def closeall(self):
+        for conn in self.connections:
+            conn.close()
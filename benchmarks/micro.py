@@ -0,0 +1,63 @@
+"""Micro-benchmarks of the per-record hot paths.
+
+Times the tap's row_to_record and the target's flatten, field-mapping
+(transform_record) and check_batch on synthetic account rows, reporting
+the best per-call time over several repeats.
+"""
+import json
+import timeit
+import datetime
+from types import SimpleNamespace
+from benchmarks import synthetic, tap_sync
+
+STREAM = 'pendo_integration_account'
+REPEATS = 5
+CALLS = 10000
+
+
+def best_per_call(func=None, calls=CALLS, repeats=REPEATS):
+    """Best time per call, in microseconds"""
+
+    return round(min(timeit.repeat(func, number=calls, repeat=repeats)) / calls * 1e6, 3)
+
+
+def run(calls=CALLS, repeats=REPEATS):
+    import target_pendo
+    messages = tap_sync.import_tap('messages')
+    config = synthetic.target_config()[STREAM]
+    lines = synthetic.stream_lines(STREAM, 1)
+    for _ in range(3):
+        next(lines)  # SCHEMA, ACTIVATE_VERSION and VOLUME
+    record = json.loads(next(lines))['record']
+    columns = list(record)
+    # the tap reads replication keys from Redshift as datetimes
+    replication_key = synthetic.STREAMS[STREAM]['replication_key']
+    row = [
+        datetime.datetime.fromisoformat(val.rstrip('Z')) if col in replication_key else val
+        for col, val in zip(columns, record.values())
+    ]
+    catalog_entry = SimpleNamespace(stream=STREAM)
+    extracted = datetime.datetime.now(datetime.timezone.utc)
+    transformed = target_pendo.transform_record(dict(record), [config['primary_key']], config['field_mappings'])
+    batch = [transformed] * 500
+    # limits above the batch, as check_batch logs each limit it hits
+    batch_lims = SimpleNamespace(max_bytes=50000000, max_records=1000)
+    stream_dict = SimpleNamespace(total_records=1000000, record_count=1)
+    nested = {'record': record, 'meta': {'source': {'table': STREAM, 'version': 1}}}
+    results = {
+        'row_to_record_us': best_per_call(
+            lambda: messages.row_to_record(catalog_entry, 1, row, columns, extracted), calls, repeats
+        ),
+        'flatten_us': best_per_call(lambda: target_pendo.flatten(nested), calls, repeats),
+        'transform_record_us': best_per_call(
+            lambda: target_pendo.transform_record(
+                dict(record), [config['primary_key']], config['field_mappings']
+            ), calls, repeats
+        ),
+        # check_batch runs after every append, so a full batch is its worst case
+        'check_batch_500_us': best_per_call(
+            lambda: target_pendo.check_batch(batch, batch_lims, stream_dict), calls // 10, repeats
+        )
+    }
+    print(json.dumps(results))
+    return results
@@ -0,0 +1,70 @@
+"""Benchmark results stored as JSON, for comparing runs across commits."""
+import os
+import sys
+import json
+import platform
+import datetime
+import subprocess
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(RESULTS_DIR)
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save(suite=None, params=None, results=None, results_dir=RESULTS_DIR):
+    """Writes a run's results with the commit and environment it ran on, returning the path"""
+
+    commit = git_commit()
+    run_at = datetime.datetime.now(datetime.timezone.utc)
+    doc = {
+        'suite': suite,
+        'commit': commit,
+        'run_at': run_at.isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': params,
+        'results': results
+    }
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{run_at.strftime('%Y%m%dT%H%M%S')}-{commit}-{suite}.json")
+    with open(path, 'w') as out:
+        json.dump(doc, out, indent=2)
+    return path
+
+
+def load(path=None):
+    with open(path) as doc:
+        return json.load(doc)
+
+
+def numeric_items(results=None, prefix=''):
+    """Flattens results into (name, value) pairs, keying throughput runs by row count"""
+
+    if isinstance(results, list):
+        for result in results:
+            yield from numeric_items(result, f"{prefix}rows={result.get('rows')}.")
+    elif isinstance(results, dict):
+        for key, val in results.items():
+            if isinstance(val, (int, float)) and not isinstance(val, bool) and key != 'rows':
+                yield f'{prefix}{key}', val
+
+
+def compare(base_path=None, head_path=None, out=sys.stdout):
+    """Prints each metric of two runs of a suite w/ its % change"""
+
+    base, head = load(base_path), load(head_path)
+    base_items = dict(numeric_items(base['results']))
+    out.write(f"{base['suite']}: {base['commit']} -> {head['commit']}\n")
+    for name, val in numeric_items(head['results']):
+        old = base_items.get(name)
+        change = f'{(val - old) / old * 100:+.1f}%' if old else 'n/a'
+        out.write(f'  {name:<48} {old!s:>12} -> {val!s:>12}  {change}\n')
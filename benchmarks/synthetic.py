@@ -0,0 +1,162 @@
+"""Synthetic tap-redshift output shaped like the Pendo integration streams.
+
+Streams carry the columns named in the tap's stream field mappings, so the
+target config built from the same mappings transforms them as it would in
+production. Lines are generated lazily, so runs of millions of rows are
+written without holding them in memory.
+"""
+import json
+import uuid
+import random
+import datetime
+
+STATE_EVERY = 10000  # rows between STATE messages, like --checkpoint_rows
+VERSION = 1
+COUNTRIES = ['US', 'CA', 'GB', 'AU', 'DE', 'FR', 'NZ', 'IE']
+STATUSES = ['active', 'trial', 'canceled', 'suspended']
+TIERS = ['tier_1', 'tier_2', 'tier_3']
+# mirrors tap_redshift.streams.STREAMS, as importing the tap parses its CLI args
+STREAMS = {
+    'pendo_integration_account': {
+        'key_properties': ['platform_account_public_id'],
+        'primary_key': 'accountId',
+        'replication_key': ['last_updated'],
+        'field_mappings': {
+            'accountId': 'platform_account_public_id',
+            'platform_account_id': 'platform_account_id',
+            'sgaccountstatus': 'sg_account_status',
+            'sgphotoplanusedpercentage': 'sg_photo_plan_used_percentage',
+            'sglabpricesheetcreatedcount': 'sg_lab_price_sheet_created_count',
+            'sggallerieslabpricesheetassignedcount': 'sg_galleries_lab_price_sheet_assigned_count',
+            'sglabfulfilledordersapprovedcount': 'sg_lab_fulfilled_orders_approved_count',
+            'sgselffulfilledordersreceivedcount': 'sg_self_fulfilled_orders_received_count',
+            'sg_account_country': 'sg_account_country',
+            'sgtrusttier': 'sg_trust_tier',
+            'sgisfree': 'sg_is_free',
+            'sgisintrial': 'sg_is_in_trial',
+            'sglegacypaymentsmo': 'sg_legacy_payments_12mo'
+        }
+    },
+    'pendo_integration_visitor': {
+        'key_properties': ['platform_user_public_id'],
+        'primary_key': 'visitorId',
+        'replication_key': ['last_updated'],
+        'field_mappings': {
+            'visitorId': 'platform_user_public_id',
+            'platform_account_id': 'platform_account_id',
+            'sgaccountowner': 'sg_account_owner'
+        }
+    }
+}
+
+
+def column_value(column=None, rng=None, row_num=0):
+    """Draws a realistic value for a column, by its name"""
+
+    if column.endswith('_public_id'):
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+    elif column.endswith('_id'):
+        return 100000 + row_num
+    elif column.endswith('_percentage'):
+        return round(rng.random() * 100, 2)
+    elif column.endswith('_count') or column.endswith('_12mo'):
+        return int(rng.expovariate(1 / 40))
+    elif column.startswith('sg_is_') or column.endswith('_owner'):
+        return rng.random() < 0.2
+    elif column.endswith('_country'):
+        return rng.choice(COUNTRIES)
+    elif column.endswith('_status'):
+        return rng.choice(STATUSES)
+    elif column.endswith('_tier'):
+        return rng.choice(TIERS)
+    return f'{column}_{rng.randrange(1000)}'
+
+
+def json_type(val=None):
+    if isinstance(val, bool):
+        return 'boolean'
+    elif isinstance(val, int):
+        return 'integer'
+    elif isinstance(val, float):
+        return 'number'
+    return 'string'
+
+
+def stream_columns(stream=None):
+    mappings = STREAMS[stream]['field_mappings']
+    columns = list(dict.fromkeys(mappings.values()))
+    return columns + STREAMS[stream]['replication_key']
+
+
+def schema_message(stream=None, rng=None):
+    sample = {column: column_value(column, rng) for column in stream_columns(stream)}
+    properties = {
+        column: {'type': ['null', json_type(val)]} for column, val in sample.items()
+    }
+    for column in STREAMS[stream]['replication_key']:
+        properties[column] = {'type': ['null', 'string'], 'format': 'date-time'}
+    return {
+        'type': 'SCHEMA',
+        'stream': stream,
+        'schema': {'type': 'object', 'properties': properties},
+        'key_properties': STREAMS[stream]['key_properties']
+    }
+
+
+def stream_lines(stream=None, rows=0, seed=0, state_every=STATE_EVERY):
+    """Yields the serialized messages of one stream's full-table sync"""
+
+    rng = random.Random(seed)
+    columns = stream_columns(stream)
+    started = datetime.datetime(2021, 1, 1)
+    yield json.dumps(schema_message(stream, rng))
+    yield json.dumps({'type': 'ACTIVATE_VERSION', 'stream': stream, 'version': VERSION})
+    yield json.dumps({'type': 'VOLUME', 'stream': stream, 'count': rows})
+    for row_num in range(1, rows + 1):
+        record = {column: column_value(column, rng, row_num) for column in columns[:-1]}
+        last_updated = (started + datetime.timedelta(seconds=row_num)).isoformat() + 'Z'
+        record[columns[-1]] = last_updated
+        yield json.dumps({'type': 'RECORD', 'stream': stream, 'version': VERSION, 'record': record})
+        if row_num % state_every == 0 or row_num == rows:
+            yield json.dumps({
+                'type': 'STATE',
+                'value': {'bookmarks': {stream: {'replication_key_value': last_updated, 'version': VERSION}}}
+            })
+
+
+def split_rows(rows=0, visitor_share=0.5):
+    visitors = int(rows * visitor_share)
+    return {'pendo_integration_account': rows - visitors, 'pendo_integration_visitor': visitors}
+
+
+def synthetic_lines(rows=0, visitor_share=0.5, seed=0):
+    """Yields tap output for both streams, rows split between them"""
+
+    for idx, (stream, stream_rows) in enumerate(split_rows(rows, visitor_share).items()):
+        if stream_rows:
+            yield from stream_lines(stream, stream_rows, seed + idx)
+
+
+def write_lines(path=None, rows=0, visitor_share=0.5, seed=0):
+    """Writes synthetic tap output to path, returning the # of lines written"""
+
+    written = 0
+    with open(path, 'w') as out:
+        for line in synthetic_lines(rows, visitor_share, seed):
+            out.write(line + '\n')
+            written += 1
+    return written
+
+
+def target_config(int_key='benchmark-key'):
+    """target-pendo config matching the synthetic streams"""
+
+    config = {'integration_key': int_key}
+    for stream, props in STREAMS.items():
+        config[stream] = {
+            'stream': stream,
+            'key_properties': props['key_properties'],
+            'primary_key': props['primary_key'],
+            'field_mappings': props['field_mappings']
+        }
+    return config
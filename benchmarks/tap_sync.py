@@ -0,0 +1,134 @@
+"""tap-redshift extraction throughput against a fake Redshift connection.
+
+Runs the tap's discover_catalog and do_sync in process, on a
+fake_db.FakeConnection serving synthetic Pendo integration tables. The sync
+also calls fetch_uuids, so a pendo-mock process stands in for the Pendo
+API. The Singer output goes to a counting sink. The following are reported
+for each run:
+
+- discover_catalog's wall time
+- rows/s and bytes/s of Singer output over do_sync's wall time
+- the # of messages and queries
+"""
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+from benchmarks import fake_db, throughput
+
+SCHEMA = 'public'
+
+
+def import_tap(module=None, tap_args=()):
+    """Imports a tap_redshift module, which parses the tap's CLI args on import"""
+
+    name = f'tap_redshift.{module}'
+    if name in sys.modules:
+        return sys.modules[name]
+    config = {key: '' for key in ('host', 'dbname', 'user', 'password')}
+    config['schema'] = SCHEMA
+    # sent w/ fetch_uuids, which the Pendo mock rejects without one
+    config['target_integration_key'] = 'benchmark-key'
+    config['start_date'] = '2000-01-01T00:00:00Z'
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as config_file:
+        json.dump(config, config_file)
+    argv = sys.argv
+    sys.argv = ['tap-redshift', '-c', config_file.name, *tap_args]
+    try:
+        __import__(name)
+    finally:
+        sys.argv = argv
+        os.remove(config_file.name)
+    return sys.modules[name]
+
+
+class CountingSink(io.RawIOBase):
+    """Binary stdout stand-in that counts what it's given and drops it"""
+
+    def __init__(self):
+        super().__init__()
+        self.bytes = 0
+        self.lines = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data=None):
+        self.bytes += len(data)
+        self.lines += bytes(data).count(b'\n')
+        return len(data)
+
+
+def select_all_streams(catalog=None):
+    """Marks every discovered stream selected, as a catalog.json would"""
+
+    from singer import metadata
+    for catalog_entry in catalog.streams:
+        mdata = metadata.write(metadata.to_map(catalog_entry.metadata), (), 'selected', True)
+        catalog_entry.metadata = metadata.to_list(mdata)
+    return catalog
+
+
+def sync_to_sink(sync=None, conn=None, catalog=None, state=None):
+    """Runs do_sync w/ stdout swapped for a CountingSink, returning (wall sec, sink)"""
+
+    sink = CountingSink()
+    stdout = sys.stdout
+    sys.stdout = io.TextIOWrapper(io.BufferedWriter(sink), encoding='utf-8', write_through=True)
+    try:
+        started = time.monotonic()
+        sync.do_sync(conn, SCHEMA, catalog, state)
+        sys.stdout.flush()
+        wall = time.monotonic() - started
+    finally:
+        sys.stdout = stdout
+    return wall, sink
+
+
+def run(rows=None, rate=None, latency=0.0, mock_args=(), tap_args=(), visitor_share=0.5, seed=0):
+    """Benchmarks tap-redshift at each row count, returning a result per run"""
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='tap-bench-') as work_dir:
+        os.makedirs(os.path.join(work_dir, 'logs'))
+        port = throughput.free_port()
+        mock = throughput.start_mock(port, mock_args, work_dir)
+        try:
+            tap_args = ['--pendo_url', f'http://127.0.0.1:{port}', *tap_args]
+            connect = import_tap('connect', tap_args)
+            discover = import_tap('discover', tap_args)
+            sync = import_tap('sync', tap_args)
+            for row_count in rows:
+                tables = fake_db.pendo_tables(row_count, visitor_share, seed)
+
+                def open_fake():
+                    return fake_db.FakeConnection(tables, SCHEMA, latency=latency, rate=rate)
+
+                # --parallel_streams opens a pool of its own connections
+                connect.open_pool = lambda config, size: fake_db.FakePool(open_fake)
+                conn = open_fake()
+                started = time.monotonic()
+                catalog = discover.discover_catalog(conn, SCHEMA)
+                discover_wall = time.monotonic() - started
+                # discovery only selects tables named like a stream
+                select_all_streams(catalog)
+                state = sync.build_state({}, catalog)
+                wall, sink = sync_to_sink(sync, conn, catalog, state)
+                result = {
+                    'rows': row_count,
+                    'discover_seconds': round(discover_wall, 3),
+                    'sync_seconds': round(wall, 3),
+                    'rows_per_second': round(row_count / wall, 1),
+                    'bytes_per_second': round(sink.bytes / wall, 1),
+                    'output_bytes': sink.bytes,
+                    'messages': sink.lines,
+                    'queries': conn.queries
+                }
+                print(json.dumps(result))
+                results.append(result)
+        finally:
+            mock.terminate()
+            mock.wait()
+    return results
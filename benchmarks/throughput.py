@@ -0,0 +1,176 @@
+"""End-to-end target-pendo throughput against the local Pendo mock.
+
+For each row count, synthetic tap output is written to a file and piped to
+a target-pendo process pointed at a pendo-mock process. The following are
+reported for each run:
+
+- records/s over the target's wall time
+- the target's p50/p95/p99 batch latency, from the target_pendo_batch_latency_seconds
+  histogram it writes with --metrics_file, merged across shards
+- peak RSS, summed over the target and its shard workers, and their CPU seconds
+"""
+import os
+import re
+import sys
+import glob
+import json
+import time
+import socket
+import resource
+import tempfile
+import subprocess
+import urllib.request
+import pendo_telemetry as telemetry
+from benchmarks import synthetic
+
+MOCK_STARTUP_SECONDS = 10.0
+RSS_POLL_SECONDS = 0.05
+TARGET_CMD = 'from target_pendo import main; main()'
+LATENCY_BUCKET = re.compile(r'^target_pendo_batch_latency_seconds_bucket\{.*le="([^"]+)"\} (\d+)$')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_mock(port=None, mock_args=(), work_dir=None):
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'target_pendo.mock_server', '--port', str(port), *mock_args],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=work_dir
+    )
+    deadline = time.monotonic() + MOCK_STARTUP_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"PENDO MOCK DID NOT START ON PORT {port}")
+
+
+def mock_stats(port=None):
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/stats') as response:
+        return json.loads(response.read())
+
+
+def tree_rss_kib(root=None):
+    """Sums the RSS of a process and its descendants, from /proc, or returns None w/o /proc"""
+
+    page_kib = os.sysconf('SC_PAGE_SIZE') // 1024
+    children, rss = {}, {}
+    try:
+        pids = [int(entry) for entry in os.listdir('/proc') if entry.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as stat:
+                # fields after the parenthesized command: state, ppid, ..., rss (22nd)
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss[pid] = int(fields[21]) * page_kib
+    total, tree = 0, [root]
+    while tree:
+        pid = tree.pop()
+        total += rss.get(pid, 0)
+        tree.extend(children.get(pid, ()))
+    return total
+
+
+def run_target(input_path=None, config_path=None, url=None, work_dir=None, target_args=()):
+    """Runs target-pendo on the input, returning (wall sec, CPU rusage, peak RSS KiB, # of STATE lines).
+    CPU covers the target and the shard workers it waited on; RSS is sampled over the process tree
+    """
+
+    with open(input_path, 'rb') as stdin, open(os.path.join(work_dir, 'state.out'), 'wb') as stdout:
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        started = time.monotonic()
+        proc = subprocess.Popen(
+            [sys.executable, '-c', TARGET_CMD, '-c', config_path, '--pendo_url', url, '-q',
+             '--metrics_file', os.path.join(work_dir, 'metrics.prom'), *target_args],
+            stdin=stdin, stdout=stdout, stderr=subprocess.DEVNULL, cwd=work_dir
+        )
+        peak_kib = 0
+        while proc.poll() is None:
+            peak_kib = max(peak_kib, tree_rss_kib(proc.pid) or 0)
+            time.sleep(RSS_POLL_SECONDS)
+        wall = time.monotonic() - started
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if proc.returncode:
+        raise RuntimeError(f"TARGET-PENDO EXITED W/ CODE {proc.returncode}, SEE {work_dir}/logs")
+    if not peak_kib:
+        # w/o /proc, the largest single process reaped so far
+        peak_kib = after.ru_maxrss / (1024 if sys.platform == 'darwin' else 1)
+    cpu = {'user': after.ru_utime - before.ru_utime, 'system': after.ru_stime - before.ru_stime}
+    with open(os.path.join(work_dir, 'state.out')) as states:
+        return wall, cpu, peak_kib, sum(1 for _ in states)
+
+
+def target_latency(work_dir=None):
+    """Merges the batch latency histograms the target and its shards wrote, returning p50/p95/p99"""
+
+    cumulative = {}  # le bound -> # of observations at or under it
+    paths = glob.glob(os.path.join(work_dir, 'metrics.prom')) + glob.glob(os.path.join(work_dir, 'metrics.prom.shard-*'))
+    for path in paths:
+        with open(path) as metrics_file:
+            for line in metrics_file:
+                match = LATENCY_BUCKET.match(line.strip())
+                if match:
+                    # summed over streams and shards, which share bucket bounds
+                    bound = float(match.group(1))
+                    cumulative[bound] = cumulative.get(bound, 0) + int(match.group(2))
+    if not cumulative:
+        return {}
+    bounds = sorted(cumulative)
+    counts = [cumulative[bound] for bound in bounds]
+    in_bucket = [count - prev for count, prev in zip(counts, [0] + counts[:-1])]
+    # the last bound is +Inf, which the histogram keeps implicitly
+    histogram = telemetry.Histogram(buckets=bounds[:-1])
+    return {pct: histogram.estimate(in_bucket, counts[-1], pct) for pct in telemetry.QUANTILES}
+
+
+def run(rows=None, mock_args=(), target_args=(), visitor_share=0.5, seed=0):
+    """Benchmarks target-pendo at each row count, returning a result per run"""
+
+    results = []
+    for row_count in rows:
+        with tempfile.TemporaryDirectory(prefix='pendo-bench-') as work_dir:
+            os.makedirs(os.path.join(work_dir, 'logs'))
+            input_path = os.path.join(work_dir, 'input.jsonl')
+            config_path = os.path.join(work_dir, 'target_config.json')
+            synthetic.write_lines(input_path, row_count, visitor_share, seed)
+            with open(config_path, 'w') as config_file:
+                json.dump(synthetic.target_config(), config_file)
+            port = free_port()
+            mock = start_mock(port, mock_args, work_dir)
+            try:
+                wall, cpu, peak_kib, states = run_target(
+                    input_path, config_path, f'http://127.0.0.1:{port}', work_dir, target_args
+                )
+                stats = mock_stats(port)
+                latency = target_latency(work_dir)
+            finally:
+                mock.terminate()
+                mock.wait()
+        result = {
+            'rows': row_count,
+            'wall_seconds': round(wall, 3),
+            'records_per_second': round(row_count / wall, 1),
+            'batch_latency_p50': latency.get(50),
+            'batch_latency_p95': latency.get(95),
+            'batch_latency_p99': latency.get(99),
+            'requests': stats.get('requests', 0),
+            'records_sent': stats.get('records', 0),
+            'peak_rss_mb': round(peak_kib / 1024, 1),
+            'cpu_user_seconds': round(cpu['user'], 3),
+            'cpu_system_seconds': round(cpu['system'], 3),
+            'states_emitted': states
+        }
+        print(json.dumps(result))
+        results.append(result)
+    return results
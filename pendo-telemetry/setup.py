@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+
+from setuptools import setup
+
+setup(name='pendo-telemetry',
+      version='0.1.0',
+      description='Fixed-memory Prometheus metrics shared by tap-redshift and target-pendo',
+      author='ShootProof',
+      url='',
+      classifiers=['Programming Language :: Python :: 3 :: Only'],
+      packages=['pendo_telemetry'],
+      package_dir={'pendo_telemetry': 'src'}
+)
@@ -0,0 +1,266 @@
+"""Fixed-memory metrics, exposed in the Prometheus text format.
+
+Shared by tap-redshift and target-pendo, so the in-process pipeline keeps
+both sides' metrics in one REGISTRY.
+
+Counters, gauges and histograms are kept per label set in a Registry.
+Histograms count observations into fixed buckets, so their memory stays flat
+however many observations are made, and quantiles are estimated from the
+buckets. A Registry is served at /metrics with serve(), e.g.:
+
+    curl http://127.0.0.1:9108/metrics
+
+written to a file with write(), e.g. for node_exporter's textfile collector,
+and logged as a summary at exit with log_summary().
+"""
+import os
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+QUANTILES = (50, 95, 99)
+
+
+def escape(val=None):
+    return str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(pairs=None):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(val)}"' for name, val in pairs) + '}'
+
+
+class Metric:
+    """ * name: metric name, as exposed
+        * doc: HELP text
+        * labelnames: names of the labels each value is kept per
+        * values: value per tuple of label values
+        """
+
+    kind = None
+
+    def __init__(self, name=None, doc=None, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels=None):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def labels_of(self, key=None, extra=()):
+        return format_labels(list(zip(self.labelnames, key)) + list(extra))
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, val in items:
+            yield f'{self.name}{self.labels_of(key)} {val}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+    def summary(self):
+        with self.lock:
+            return {self.labels_of(key) or 'all': val for key, val in sorted(self.values.items())}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, val=0, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = val
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+
+class Histogram(Metric):
+    """Counts observations into fixed buckets, each value being
+    [count per bucket (the last unbounded), sum, count]
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name=None, doc=None, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, val=0.0, **labels):
+        key = self.key(labels)
+        idx = bisect_left(self.buckets, val)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts[0][idx] += 1
+            counts[1] += val
+            counts[2] += 1
+
+    def quantile(self, pct=95, **labels):
+        """Estimates the pct-th percentile, interpolating within its bucket"""
+
+        with self.lock:
+            counts = self.values.get(self.key(labels))
+            if counts is None:
+                return None
+            bucket_counts, count = list(counts[0]), counts[2]
+        return self.estimate(bucket_counts, count, pct)
+
+    def estimate(self, bucket_counts=None, count=0, pct=95):
+        if not count:
+            return None
+        rank = pct / 100 * count
+        seen = 0
+        for idx, in_bucket in enumerate(bucket_counts):
+            if in_bucket and seen + in_bucket >= rank:
+                if idx == len(self.buckets):
+                    return self.buckets[-1]  # past the last bound, so only a lower bound is known
+                lower = self.buckets[idx - 1] if idx else 0.0
+                return round(lower + (self.buckets[idx] - lower) * (rank - seen) / in_bucket, 4)
+            seen += in_bucket
+        return self.buckets[-1]
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, (list(counts[0]), counts[1], counts[2])) for key, counts in self.values.items())
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, in_bucket in zip(self.buckets + ('+Inf',), bucket_counts):
+                cumulative += in_bucket
+                yield f'{self.name}_bucket{self.labels_of(key, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{self.labels_of(key)} {round(total, 6)}'
+            yield f'{self.name}_count{self.labels_of(key)} {count}'
+
+    def stats(self, **labels):
+        """Returns the count, sum and estimated percentiles of a label set's observations"""
+
+        with self.lock:
+            counts = self.values.get(self.key(labels))
+            if counts is None:
+                return {'count': 0, 'sum': 0.0}
+            bucket_counts, total, count = list(counts[0]), counts[1], counts[2]
+        stats = {'count': count, 'sum': round(total, 4)}
+        for pct in QUANTILES:
+            stats[f'p{pct}'] = self.estimate(bucket_counts, count, pct)
+        return stats
+
+    def summary(self):
+        with self.lock:
+            keys = sorted(self.values)
+        return {
+            self.labels_of(key) or 'all': self.stats(**dict(zip(self.labelnames, key))) for key in keys
+        }
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        payload = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class Registry:
+    """Metrics of a process, by name"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def register(self, metric=None):
+        with self.lock:
+            # re-registering a name returns the metric already kept under it
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name=None, doc=None, labelnames=()):
+        return self.register(Counter(name, doc, labelnames))
+
+    def gauge(self, name=None, doc=None, labelnames=()):
+        return self.register(Gauge(name, doc, labelnames))
+
+    def histogram(self, name=None, doc=None, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, doc, labelnames, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+    def summary(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.summary() for metric in metrics if metric.values}
+
+    def serve(self, port=None, host='127.0.0.1'):
+        """Serves /metrics on a daemon thread, returning the server"""
+
+        handler = type('MetricsHandler', (MetricsHandler,), {'registry': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        return self.server
+
+    def write(self, path=None):
+        """Writes the metrics to a file in the text format, replacing it whole"""
+
+        with open(f'{path}.tmp', 'w') as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(f'{path}.tmp', path)
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def log_summary(self, logger=None):
+        """Logs each metric w/ a value, a line per label set"""
+
+        lines = ["METRICS SUMMARY:"]
+        for name, values in self.summary().items():
+            for labels, val in values.items():
+                lines.append(f"  {name}{'' if labels == 'all' else labels}: {val}")
+        logger.info('\n'.join(lines))
+
+
+REGISTRY = Registry()
@@ -34,6 +34,7 @@ setup(
         'singer-python==5.0.4',
         'backoff==1.3.2',
         'psycopg2-binary==2.8.6',
+        'pendo-telemetry',
       ],
       setup_requires=[
         'pytest-runner>=2.11,<3.0a',
@@ -1,4 +1,5 @@
 import arrow
+import pendo_telemetry as telemetry
 from singer import utils, logger
 from singer.catalog import Catalog, CatalogEntry
 from tap_redshift import connect, discover, messages, parsed_args, sync
@@ -9,6 +10,8 @@ CONFIG = parsed_args.args_config
 CATALOG = parsed_args.catalog
 SCHEMA = parsed_args.db_schema
 STATE = parsed_args.state
+DISCOVER = parsed_args.discover
+METRICS_PORT = parsed_args.metrics_port
 RUN_START = arrow.get().format("YYYY-MM-DD HH:mm:ss.SSSSZZ")
 NL = "\n"  # adding newline constant for easier multiline logging
 
@@ -18,17 +21,25 @@ def main_impl():
         f"INVOKING TAP-REDSHIFT @ {RUN_START}{NL}" +
         f"TAP-REDSHIFT ARGS: {ARGS}"
     )
+    if METRICS_PORT:
+        telemetry.REGISTRY.serve(METRICS_PORT)
+        LOGGER.info(f"SERVING METRICS @ http://127.0.0.1:{METRICS_PORT}/metrics")
     connection = connect.open_connection(CONFIG)  # Establish connection with db
     # If discover option in execution, discover db's schema/metadata for catalog
     # If catalog arg given w/o discover option, set state & sync using catalog config
-    if DISCOVER:
-        discover.do_discover(connection, SCHEMA)
-    elif CATALOG:
-        LOGGER.debug(f"CATALOG: {CATALOG}, CONNECTION: {connection}")
-        state = sync.build_state(STATE, CATALOG)
-        sync.do_sync(connection, SCHEMA, CATALOG, state)
-    else:
-        LOGGER.info("Missing required arguments")
+    try:
+        if DISCOVER:
+            discover.do_discover(connection, SCHEMA)
+        elif CATALOG:
+            LOGGER.debug(f"CATALOG: {CATALOG}, CONNECTION: {connection}")
+            state = sync.build_state(STATE, CATALOG)
+            sync.do_sync(connection, SCHEMA, CATALOG, state)
+        else:
+            LOGGER.info("Missing required arguments")
+    finally:
+        # logged to stderr, as stdout carries the Singer messages
+        telemetry.REGISTRY.log_summary(LOGGER)
+        telemetry.REGISTRY.close()
 
 
 @utils.handle_top_exception(LOGGER)
@@ -0,0 +1,82 @@
+"""Copy-on-write state checkpoints for streams being synced.
+
+The bookmark of the stream being synced lives in a small mutable slot;
+a state snapshot is only assembled when a STATE message is due, and the
+bookmarks of every other stream are shared with the previous snapshot
+instead of being deep-copied.
+"""
+import time
+from singer.logger import get_logger
+
+LOGGER = get_logger()
+
+
+def snapshot_state(state=None, tap_stream_id=None, bookmark=None):
+    """Returns a new state dict that shares all unchanged branches with state.
+    Only the top-level dict and the 'bookmarks' dict are rebuilt; the bookmark
+    for tap_stream_id is replaced with a copy of bookmark when given.
+    Branches in state must never be mutated in place after this is called.
+    """
+    snapshot = dict(state or {})
+    bookmarks = dict(snapshot.get('bookmarks') or {})
+    if tap_stream_id is not None and bookmark is not None:
+        bookmarks[tap_stream_id] = dict(bookmark)
+    snapshot['bookmarks'] = bookmarks
+    return snapshot
+
+
+class CheckpointManager:
+    """Tracks the active stream's bookmark and decides when a STATE is due.
+    * state: the live state document shared by all streams of the sync
+    * tap_stream_id: the stream whose bookmark is held in the slot
+    * every_rows: emit a checkpoint after this many rows
+    * every_seconds: emit a checkpoint after this many seconds, if any rows were read
+    """
+
+    def __init__(self, state=None, tap_stream_id=None, every_rows=1000, every_seconds=None):
+        self.state = state if state is not None else {}
+        self.tap_stream_id = tap_stream_id
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        branch = self.state.get('bookmarks', {}).get(tap_stream_id) or {}
+        self.slot = dict(branch)
+        self.rows_since = 0
+        self.last_emitted = time.monotonic()
+        self.checkpoints = 0
+
+    def write_bookmark(self, key, val):
+        self.slot[key] = val
+        return self.slot
+
+    def get_bookmark(self, key):
+        return self.slot.get(key)
+
+    def add_rows(self, count=1):
+        self.rows_since += count
+        return self.rows_since
+
+    def is_due(self):
+        """True when enough rows or time have passed since the last checkpoint"""
+        if not self.rows_since:
+            return False
+        if self.every_rows and self.rows_since >= self.every_rows:
+            return True
+        if self.every_seconds:
+            return time.monotonic() - self.last_emitted >= self.every_seconds
+        return False
+
+    def commit(self):
+        """Publishes the slot into the live state by replacing the stream's branch"""
+        bookmarks = self.state.get('bookmarks')
+        if bookmarks is None:
+            bookmarks = self.state['bookmarks'] = {}
+        bookmarks[self.tap_stream_id] = dict(self.slot)
+        return self.state
+
+    def snapshot(self):
+        """Builds the value for a STATE message and resets the emission counters"""
+        self.commit()
+        self.rows_since = 0
+        self.last_emitted = time.monotonic()
+        self.checkpoints += 1
+        return snapshot_state(self.state)
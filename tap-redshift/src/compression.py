@@ -0,0 +1,89 @@
+"""Compressed framing for the serialized Singer stream written to stdout.
+
+Output is compressed as one gzip member or one zstd frame; the compressor is
+flushed on every STATE message so a checkpoint is never held back in the
+compressor's buffer, and the reader can decode everything before it.
+"""
+import time
+import zlib
+from singer.logger import get_logger
+
+try:
+    import zstandard
+except ImportError:  # zstd framing is optional, gzip is always available
+    zstandard = None
+
+LOGGER = get_logger()
+NL = "\n"  # adding newline constant for easier multiline logging
+METHODS = ['gzip', 'zstd']
+GZIP_WBITS = 31  # zlib window bits for a gzip header and trailer
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+class CompressedWriter:
+    """Wraps a binary output stream with a gzip or zstd compressor
+    * raw: binary stream written to, e.g. sys.stdout.buffer
+    * method: 'gzip' or 'zstd'
+    """
+
+    def __init__(self, raw=None, method='gzip'):
+        self.raw = raw
+        self.method = method
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_time = 0.0
+        if method == 'gzip':
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+            self.sync_flush = zlib.Z_SYNC_FLUSH
+            self.finish = zlib.Z_FINISH
+        elif method == 'zstd':
+            if zstandard is None:
+                raise Exception(
+                    "zstd compression requires the 'zstandard' package"
+                )
+            self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self.sync_flush = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            self.finish = zstandard.COMPRESSOBJ_FLUSH_FINISH
+        else:
+            raise Exception(
+                f"Compression method {method} is not supported, use one of {METHODS}"
+            )
+
+    def _write_raw(self, data):
+        if data:
+            self.bytes_out += len(data)
+            self.raw.write(data)
+
+    def write(self, data):
+        start = time.perf_counter()
+        compressed = self.compressor.compress(data)
+        self.compress_time += time.perf_counter() - start
+        self.bytes_in += len(data)
+        self._write_raw(compressed)
+
+    def flush(self):
+        """Emits everything written so far as a decodable block"""
+        start = time.perf_counter()
+        compressed = self.compressor.flush(self.sync_flush)
+        self.compress_time += time.perf_counter() - start
+        self._write_raw(compressed)
+        self.raw.flush()
+
+    def close(self):
+        start = time.perf_counter()
+        compressed = self.compressor.flush(self.finish)
+        self.compress_time += time.perf_counter() - start
+        self._write_raw(compressed)
+        self.raw.flush()
+        self.log_stats()
+
+    def ratio(self):
+        return round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None
+
+    def log_stats(self):
+        LOGGER.info(
+            f"{self.method.upper()} COMPRESSED {self.bytes_in} BYTES TO {self.bytes_out} BYTES{NL}"
+            + f"COMPRESSION RATIO: {self.ratio()}{NL}"
+            + f"TIME SPENT COMPRESSING: {round(self.compress_time, 3)} SECONDS"
+        )
@@ -1,5 +1,6 @@
 """This module establishes the connection with our Redshift Warehouse"""
 import psycopg2
+import psycopg2.pool
 from singer.logger import get_logger
 
 LOGGER = get_logger()
@@ -29,3 +30,16 @@ def open_connection(config):
         password=password)
     LOGGER.info("Connected to Redshift via psycopg2")
     return connection
+
+
+def open_pool(config, size):
+    """opens a pool of up to size connections, for syncing streams in parallel"""
+    pool = psycopg2.pool.ThreadedConnectionPool(
+        1, size,
+        host=config.get('host'),
+        port=config.get('port'),
+        dbname=config.get('dbname'),
+        user=config.get('user'),
+        password=config.get('password'))
+    LOGGER.info(f"Opened pool of up to {size} Redshift connections via psycopg2")
+    return pool
@@ -1,5 +1,4 @@
 import sys
-import copy
 import datetime
 import dateutil
 import pytz
@@ -9,9 +8,15 @@ from tap_redshift import resolve
 from tap_redshift import discover
 from tap_redshift import sync
 from tap_redshift import bookmarks
+from tap_redshift import checkpoints
+from tap_redshift import payload
+from tap_redshift import parallel
+from tap_redshift import connect
+from tap_redshift import parsed_args
 
 
 LOGGER = logger.get_logger()
+PARALLEL_STREAMS = parsed_args.parallel_streams
 
 
 class Message(object):
@@ -70,6 +75,45 @@ class RecordMessage(Message):
         return str(self.asdict())
 
 
+class RecordBatchMessage(Message):
+    """The RECORD_BATCH message is a columnar batch of RECORDs with these fields:
+      * stream (string) - The name of the stream the records belong to.
+      * columns (list of strings) - The column names, in row order.
+      * rows (list of lists) - The raw data for each record, one list per row.
+      * version (optional, int) - For versioned streams, the version number
+    >>> msg = RecordBatchMessage(
+    >>>     stream='users',
+    >>>     columns=['id', 'name'],
+    >>>     rows=[[1, 'Mary'], [2, 'Mike']])
+    """
+
+    def __init__(self, stream, columns, rows, version=None, time_extracted=None):
+        self.stream = stream
+        self.columns = columns
+        self.rows = rows
+        self.version = version
+        self.time_extracted = time_extracted
+        if time_extracted and not time_extracted.tzinfo:
+            raise ValueError(
+                "'time_extracted' must be either None " +
+                "or an aware datetime (with a time zone)"
+            )
+
+    def asdict(self):
+        result = {
+            'type': 'RECORD_BATCH',
+            'stream': self.stream,
+            'columns': self.columns,
+            'rows': self.rows,
+        }
+        if self.version is not None:
+            result['version'] = self.version
+        if self.time_extracted:
+            as_utc = self.time_extracted.astimezone(pytz.utc)
+            result['time_extracted'] = as_utc.strftime(utils.DATETIME_FMT)
+        return result
+
+
 class SchemaMessage(Message):
     """The SCHEMA message has these fields:
       * stream (string) - The name of the stream this schema describes.
@@ -201,6 +245,17 @@ def parse_message(msg):
             version=obj.get('version'),
             time_extracted=time_extracted
         )
+    elif msg_type == 'RECORD_BATCH':
+        time_extracted = obj.get('time_extracted')
+        if time_extracted:
+            time_extracted = dateutil.parser.parse(time_extracted)
+        return RecordBatchMessage(
+            stream=_required_key(obj, 'stream'),
+            columns=_required_key(obj, 'columns'),
+            rows=_required_key(obj, 'rows'),
+            version=obj.get('version'),
+            time_extracted=time_extracted
+        )
     elif msg_type == 'SCHEMA':
         return SchemaMessage(
             stream=_required_key(obj, 'stream'),
@@ -310,49 +365,95 @@ def write_version(stream_name, version):
     )
 
 
+def stream_messages(conn, catalog_entry, state):
+    """Generates the SCHEMA, RECORD and STATE Messages of a single stream"""
+    catalog_md = metadata.to_map(catalog_entry.metadata)
+    if catalog_md.get((), {}).get('is-view'):
+        key_properties = catalog_md.get((), {}).get('view-key-properties')
+    else:
+        key_properties = catalog_md.get((), {}).get('table-key-properties')
+    bookmark_properties = catalog_md.get((), {}).get('replication-key')
+    schema = catalog_entry.schema.to_dict()
+    if payload.is_shaped(catalog_entry.stream):
+        schema = payload.shaped_schema(catalog_entry.stream, list(catalog_entry.schema.properties))
+    # Emit a SCHEMA message before we sync any records
+    yield SchemaMessage(
+        stream=catalog_entry.stream,
+        schema=schema,
+        key_properties=key_properties,
+        bookmark_properties=bookmark_properties)
+    # Emit a RECORD message for each record in the result set
+    with metrics.job_timer('sync_table') as timer:
+        timer.tags['database'] = catalog_entry.database
+        timer.tags['table'] = catalog_entry.table
+        for message in sync.sync_table(conn, catalog_entry, state):
+            yield message
+
+
 def generate_messages(conn, db_schema, catalog, state):
     """Controls generation of State and Schema Messages
         for 'Selected' tables in catalog.json"""
     catalog = resolve.resolve_catalog(discover.discover_catalog(conn, db_schema),
                                       catalog, state)
+    if PARALLEL_STREAMS > 1 and len(catalog.streams) > 1:
+        yield from generate_parallel(catalog, state)
+        return
     for catalog_entry in catalog.streams:
         state = bookmarks.set_currently_syncing(state, catalog_entry.tap_stream_id)
-        catalog_md = metadata.to_map(catalog_entry.metadata)
-        if catalog_md.get((), {}).get('is-view'):
-            key_properties = catalog_md.get((), {}).get('view-key-properties')
-        else:
-            key_properties = catalog_md.get((), {}).get('table-key-properties')
-        bookmark_properties = catalog_md.get((), {}).get('replication-key')
         # Emit a state message to indicate that we've started this stream
-        yield StateMessage(value=copy.deepcopy(state))
-        # Emit a SCHEMA message before we sync any records
-        yield SchemaMessage(
-            stream=catalog_entry.stream,
-            schema=catalog_entry.schema.to_dict(),
-            key_properties=key_properties,
-            bookmark_properties=bookmark_properties)
-        # Emit a RECORD message for each record in the result set
-        with metrics.job_timer('sync_table') as timer:
-            timer.tags['database'] = catalog_entry.database
-            timer.tags['table'] = catalog_entry.table
-            for message in sync.sync_table(conn, catalog_entry, state):
-                yield message
+        yield StateMessage(value=checkpoints.snapshot_state(state))
+        for message in stream_messages(conn, catalog_entry, state):
+            yield message
     # finished processing all streams, so clear
     # currently_syncing from the state and emit a state message.
     state = bookmarks.set_currently_syncing(state, None)
-    yield StateMessage(value=copy.deepcopy(state))
+    yield StateMessage(value=checkpoints.snapshot_state(state))
 
 
-def row_to_record(catalog_entry, version, row, columns, time_extracted):
-    """Function for writing table rows to stream Record Messages"""
-    row_to_persist = ()
-    for idx, elem in enumerate(row):
+def generate_parallel(catalog, state):
+    """Syncs the selected streams at once, each on a pooled connection"""
+    # currently_syncing names a single stream, so it
+    # stays unset while several streams sync at once
+    state = bookmarks.set_currently_syncing(state, None)
+    workers = min(PARALLEL_STREAMS, len(catalog.streams))
+    pool = connect.open_pool(parsed_args.args_config, workers)
+    parallel_messages = parallel.generate_parallel_messages(
+        pool, catalog.streams, state, workers, stream_messages)
+    try:
+        yield StateMessage(value=checkpoints.snapshot_state(state))
+        yield from parallel_messages
+    finally:
+        # stops the stream workers before their connections are closed
+        parallel_messages.close()
+        pool.closeall()
+
+
+def row_to_values(row):
+    """Returns the table row as a list of serializable column values"""
+    row_to_persist = []
+    for elem in row:
         if isinstance(elem, datetime.date):
             elem = elem.isoformat('T') + 'Z'
-        row_to_persist += (elem,)
+        row_to_persist.append(elem)
+    return row_to_persist
+
+
+def row_to_record(catalog_entry, version, row, columns, time_extracted):
+    """Function for writing table rows to stream Record Messages"""
     return RecordMessage(
         stream=catalog_entry.stream,
-        record=dict(zip(columns, row_to_persist)),
+        record=dict(zip(columns, row_to_values(row))),
+        version=version,
+        time_extracted=time_extracted
+    )
+
+
+def rows_to_batch(catalog_entry, version, rows, columns, time_extracted):
+    """Function for writing a list of converted table rows to a Record Batch Message"""
+    return RecordBatchMessage(
+        stream=catalog_entry.stream,
+        columns=columns,
+        rows=rows,
         version=version,
         time_extracted=time_extracted
     )
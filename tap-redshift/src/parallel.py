@@ -0,0 +1,148 @@
+"""Parallel sync of the selected streams, multiplexed into one message sequence.
+
+Each selected stream is synced on a worker thread with its own connection
+from a small pool, and its messages are put on a shared bounded queue in
+the order the stream produced them, so each stream's SCHEMA,
+ACTIVATE_VERSION, RECORD and STATE order is preserved. Every stream syncs
+against its own copy of the state document. When one of its STATE
+messages is taken off the queue, only that stream's bookmark is merged into
+the shared document, and a snapshot of the merged document is emitted.
+
+If a stream fails or the consumer stops reading, the other workers are
+stopped: their running queries are cancelled and the queue is drained, so
+none stays blocked on a full queue while holding a pooled connection.
+"""
+import queue
+import threading
+import pendo_telemetry as telemetry
+from singer.logger import get_logger
+from tap_redshift import checkpoints, messages
+
+LOGGER = get_logger()
+NL = "\n"  # adding newline constant for easier multiline logging
+QUEUE_SIZE = 10000  # max # of messages buffered ahead of the writer
+POLL_SECONDS = 1.0  # how often a worker blocked on a full queue checks for a stop
+JOIN_SECONDS = 10.0  # how long stopped workers are waited on
+STREAM_DONE = object()  # put on the queue after a stream's last message
+QUEUE_DEPTH = telemetry.REGISTRY.gauge(
+    'tap_redshift_parallel_queue_depth', 'Messages buffered ahead of the writer by stream workers')
+
+
+class StreamWorker(threading.Thread):
+    """Syncs streams taken from the work queue until it is empty
+    * pool: connection pool the worker borrows its connection from
+    * work: queue of catalog entries left to sync
+    * out: queue of (tap_stream_id, message) the worker writes to
+    * stop: event set once the sync is abandoned
+    """
+
+    def __init__(self, pool=None, work=None, out=None, state=None, stream_messages=None, stop=None):
+        super().__init__(name='tap-redshift-stream', daemon=True)
+        self.pool = pool
+        self.work = work
+        self.out = out
+        self.state = state
+        self.stream_messages = stream_messages
+        self.stop = stop
+        self.conn = None
+
+    def run(self):
+        conn = self.conn = self.pool.getconn()
+        try:
+            while not self.stop.is_set():
+                try:
+                    catalog_entry = self.work.get_nowait()
+                except queue.Empty:
+                    return
+                tap_stream_id = catalog_entry.tap_stream_id
+                try:
+                    # branches are never mutated in place, so a shallow
+                    # snapshot keeps other streams' bookmarks out of reach
+                    stream_state = checkpoints.snapshot_state(self.state)
+                    for message in self.stream_messages(conn, catalog_entry, stream_state):
+                        if not self.put((tap_stream_id, message)):
+                            return
+                except Exception as exc:
+                    self.put((tap_stream_id, exc))
+                    return
+                finally:
+                    self.put((tap_stream_id, STREAM_DONE))
+        finally:
+            self.conn = None
+            self.pool.putconn(conn)
+
+    def put(self, item=None):
+        """Puts the item on the out queue, returning False if the sync stopped first"""
+        while not self.stop.is_set():
+            try:
+                self.out.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def cancel(self):
+        """Cancels the query the worker's connection is running, if any"""
+        conn = self.conn
+        if conn is not None:
+            conn.cancel()
+
+
+def stop_workers(stream_workers=None, out=None, stop=None):
+    """Stops the workers, cancelling their queries and draining the queue they may block on"""
+    stop.set()
+    for worker in stream_workers:
+        if worker.is_alive():
+            worker.cancel()
+    while True:
+        try:
+            out.get_nowait()
+        except queue.Empty:
+            break
+    for worker in stream_workers:
+        worker.join(JOIN_SECONDS)
+        if worker.is_alive():
+            LOGGER.warning(f"STREAM WORKER {worker.name} DID NOT STOP IN {JOIN_SECONDS} SECONDS")
+    QUEUE_DEPTH.set(0)
+
+
+def generate_parallel_messages(pool=None, catalog_entries=None, state=None, workers=None, stream_messages=None):
+    """Yields the messages of every stream as they are produced,
+    with STATE messages carrying the merged bookmarks of all streams
+    """
+    work = queue.Queue()
+    for catalog_entry in catalog_entries:
+        work.put(catalog_entry)
+    out = queue.Queue(maxsize=QUEUE_SIZE)
+    LOGGER.info(
+        f"SYNCING {len(catalog_entries)} STREAMS ON {workers} CONNECTIONS{NL}"
+        + f"STREAMS: {[catalog_entry.tap_stream_id for catalog_entry in catalog_entries]}"
+    )
+    stop = threading.Event()
+    stream_workers = [StreamWorker(pool, work, out, state, stream_messages, stop) for _ in range(workers)]
+    for worker in stream_workers:
+        worker.start()
+    merged = checkpoints.snapshot_state(state)
+    remaining = len(catalog_entries)
+    try:
+        while remaining:
+            tap_stream_id, message = out.get()
+            QUEUE_DEPTH.set(out.qsize())
+            if message is STREAM_DONE:
+                remaining -= 1
+                LOGGER.info(f"FINISHED STREAM {tap_stream_id}, {remaining} STREAMS REMAINING")
+                continue
+            if isinstance(message, Exception):
+                LOGGER.critical(f"STREAM {tap_stream_id} FAILED: {message!r}")
+                raise message
+            if isinstance(message, messages.StateMessage):
+                bookmark = (message.value.get('bookmarks') or {}).get(tap_stream_id)
+                if bookmark is not None:
+                    merged = checkpoints.snapshot_state(merged, tap_stream_id, bookmark)
+                message = messages.StateMessage(value=checkpoints.snapshot_state(merged))
+            yield message
+    finally:
+        # a no-op once every stream is done; otherwise frees the other workers
+        stop_workers(stream_workers, out, stop)
+    # every stream is done, so emit the fully merged bookmarks
+    yield messages.StateMessage(value=checkpoints.snapshot_state(merged))
@@ -24,6 +24,13 @@ def parse_args(required_config_keys=None):
     -d,--discover   Run in discover mode
     -l,--limit      Query Limit
     --catalog       Catalog file
+    --checkpoint_rows       Rows between STATE checkpoints
+    --checkpoint_seconds    Seconds between STATE checkpoints
+    --record_batch_size     Rows per columnar RECORD_BATCH message
+    --compress              Compress output with gzip (default) or zstd
+    --shape_payload         Shape Pendo payloads in the SELECT (columns or json)
+    --project_columns       Target config; SELECT only the columns its field_mappings map
+    --metrics_port          Local port to serve Prometheus /metrics on
     Returns the parsed args object from argparse. For each argument that
     point to JSON files (config, state, properties), we will automatically
     load and parse the JSON file.
@@ -52,6 +59,54 @@ def parse_args(required_config_keys=None):
         '--catalog',
         help='Catalog file')
 
+    parser.add_argument(
+        '--checkpoint_rows',
+        type=int,
+        help='Max # of rows between STATE checkpoints')
+
+    parser.add_argument(
+        '--checkpoint_seconds',
+        type=float,
+        help='Max # of seconds between STATE checkpoints')
+
+    parser.add_argument(
+        '--record_batch_size',
+        type=int,
+        help='Emit columnar RECORD_BATCH messages of up to this many rows')
+
+    parser.add_argument(
+        '--compress',
+        nargs='?',
+        const='gzip',
+        choices=['gzip', 'zstd'],
+        help='Compress output, flushed at every STATE message')
+
+    parser.add_argument(
+        '--shape_payload',
+        nargs='?',
+        const='columns',
+        choices=['columns', 'json'],
+        help='Build Pendo {primary_key, values} payloads in the SELECT')
+
+    parser.add_argument(
+        '--parallel_streams',
+        type=int,
+        help='Sync up to this many streams at once, each on its own connection')
+
+    parser.add_argument(
+        '--pendo_url',
+        help='Base URL of the Pendo API, e.g. a local mock server')
+
+    parser.add_argument(
+        '--project_columns',
+        help='Target config file; SELECT only the columns its field_mappings '
+             'map to Pendo attributes')
+
+    parser.add_argument(
+        '--metrics_port',
+        type=int,
+        help='Local port to serve Prometheus /metrics on')
+
     args = parser.parse_args()
     # sets schema in config file if given, otherwise default to 'public' if not provided
     # parse required config args from tap config file
@@ -68,6 +123,9 @@ def parse_args(required_config_keys=None):
     if args.catalog:
         setattr(args, 'catalog_path', args.catalog)
         args.catalog = Catalog.load(args.catalog)
+    if args.project_columns:
+        setattr(args, 'target_config_path', args.project_columns)
+        args.project_columns = load_json(args.project_columns)
 
     check_config(args.config, required_config_keys)
     return args
@@ -90,6 +148,17 @@ args = parse_args(required_config_keys=REQUIRED_CONFIG_KEYS)
 start_date = args.config.get('start_date')
 target_int_key = args.config.get('target_integration_key')
 catalog = args.catalog
+state = args.state  # {} when no state file is given
+discover = args.discover
 args_config = dict(args.config)
 db_schema = args_config.get('schema', 'public')  # Sets schema if given, default 'public'
 query_limit = args.limit if args.limit else 1000000
+checkpoint_rows = args.checkpoint_rows if args.checkpoint_rows else 1000
+checkpoint_seconds = args.checkpoint_seconds if args.checkpoint_seconds else 60.0
+record_batch_size = args.record_batch_size if args.record_batch_size else 0  # 0 emits plain RECORDs
+compress = args.compress  # None writes uncompressed NDJSON
+shape_payload = args.shape_payload  # None leaves payload shaping to the target
+parallel_streams = args.parallel_streams if args.parallel_streams else 1  # 1 syncs streams one after another
+pendo_url = args.pendo_url.rstrip('/') if args.pendo_url else 'https://app.pendo.io'
+metrics_port = args.metrics_port  # None serves no /metrics endpoint
+project_columns = args.project_columns  # target config, None SELECTs every selected column
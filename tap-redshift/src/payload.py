@@ -0,0 +1,114 @@
+"""Shapes Pendo request payloads in the SELECT instead of in target-pendo.
+
+With --shape_payload, the SELECT for a Pendo stream is generated from its
+field_mappings, so rows come back as {primary_key: id, 'values': {...}}:
+  * columns - mapped columns are aliased to Pendo attribute names and the
+    primary key is cast to VARCHAR; the tap zips them into 'values'
+  * json - 'values' is built in Redshift with JSON_SERIALIZE(OBJECT(...))
+    and passed through to the output without being re-encoded
+The shaped SCHEMA carries the mappings it was built from under
+x-pendo-payload, so target-pendo can check them against its own config.
+"""
+import simplejson as json
+from singer.logger import get_logger
+from tap_redshift import messages, parsed_args
+from tap_redshift.streams import STREAMS
+
+LOGGER = get_logger()
+NL = "\n"  # adding newline constant for easier multiline logging
+SHAPE_PAYLOAD = parsed_args.shape_payload
+VALUES_KEY = 'values'
+PAYLOAD_SCHEMA_KEY = 'x-pendo-payload'  # marks a shaped SCHEMA for target-pendo
+
+
+def is_shaped(stream=None):
+    """True when rows of the stream are shaped into Pendo payloads in the SELECT"""
+    return bool(SHAPE_PAYLOAD and STREAMS.get(stream, {}).get('field_mappings'))
+
+
+def value_attrs(stream=None, columns=None):
+    """(Pendo attribute, column) pairs shaped into 'values', for the given columns"""
+    stream_props = STREAMS[stream]
+    return [
+        (targ_attr, tap_attr) for targ_attr, tap_attr in stream_props['field_mappings'].items()
+        if targ_attr != stream_props['primary_key'] and tap_attr in columns
+    ]
+
+
+def shaped_schema(stream=None, columns=None):
+    """JSON schema for records shaped as Pendo request payloads"""
+    primary_key = STREAMS[stream]['primary_key']
+    return {
+        'type': 'object',
+        PAYLOAD_SCHEMA_KEY: {
+            'primary_key': primary_key,
+            'field_mappings': {
+                primary_key: STREAMS[stream]['field_mappings'][primary_key],
+                **dict(value_attrs(stream, columns))
+            }
+        },
+        'properties': {
+            primary_key: {'type': ['null', 'string']},
+            VALUES_KEY: {'type': 'object'}
+        }
+    }
+
+
+def quote(identifier):
+    return f'"{identifier}"'
+
+
+def literal(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+class PayloadShape:
+    """Builds the shaped select list for a stream and converts its rows
+    * stream: the Pendo stream, a key of streams.STREAMS
+    * columns: the resolved (selected and projected) columns of the stream
+    * replication_key: appended to the select list for bookmarking only
+    * mode: 'columns' or 'json'
+    """
+
+    def __init__(self, stream=None, columns=None, replication_key=None, mode=None):
+        stream_props = STREAMS[stream]
+        field_mappings = stream_props['field_mappings']
+        self.stream = stream
+        self.mode = mode or SHAPE_PAYLOAD
+        self.primary_key = stream_props['primary_key']
+        self.tap_pkey = field_mappings[self.primary_key]
+        self.value_attrs = value_attrs(stream, columns)
+        self.replication_key = replication_key
+        LOGGER.info(
+            f"SHAPING {stream} PAYLOADS IN SQL ({self.mode}){NL}"
+            + f"PRIMARY KEY: {self.tap_pkey} AS {self.primary_key}{NL}"
+            + f"VALUES: {dict(self.value_attrs)}"
+        )
+
+    def output_columns(self):
+        return [self.primary_key, VALUES_KEY]
+
+    def select_list(self):
+        selected = [f'CAST({quote(self.tap_pkey)} AS VARCHAR) AS {quote(self.primary_key)}']
+        if self.mode == 'json':
+            pairs = ', '.join(
+                f'{literal(targ_attr)}, {quote(tap_attr)}' for targ_attr, tap_attr in self.value_attrs
+            )
+            selected.append(f'JSON_SERIALIZE(OBJECT({pairs})) AS {quote(VALUES_KEY)}')
+        else:
+            selected.extend(
+                f'{quote(tap_attr)} AS {quote(targ_attr)}' for targ_attr, tap_attr in self.value_attrs
+            )
+        if self.replication_key:
+            selected.append(quote(self.replication_key))
+        return ','.join(selected)
+
+    def row_to_values(self, row):
+        """Returns ([id, values], replication key value) for a shaped row"""
+        row = messages.row_to_values(row)
+        replication_key_value = row.pop() if self.replication_key else None
+        if self.mode == 'json':
+            values = json.RawJSON(row[1]) if row[1] is not None else {}
+        else:
+            values = dict(zip((targ_attr for targ_attr, _ in self.value_attrs), row[1:]))
+        return [row[0], values], replication_key_value
@@ -3,6 +3,8 @@ import singer
 from singer import logger, metadata
 from singer.catalog import Catalog, CatalogEntry
 from singer.schema import Schema
+from tap_redshift import parsed_args
+from tap_redshift.streams import STREAMS
 
 LOGGER = logger.get_logger()
 
@@ -44,6 +46,46 @@ def desired_columns(selected, table_schema):
     return selected.intersection(available).union(automatic)
 
 
+def mapped_columns(catalog_entry, target_config):
+    """Return the set of tap-side columns the target needs for a Pendo stream:
+    the values of the target config's field_mappings plus the stream's key
+    and replication columns, or None when the target config has no
+    field_mappings for the stream to project on."""
+    stream_props = STREAMS.get(catalog_entry.stream, {})
+    field_mappings = (target_config.get(catalog_entry.stream) or {}).get('field_mappings')
+    if not field_mappings:
+        return None
+    mdata = metadata.to_map(catalog_entry.metadata or [])
+    replication_key = metadata.get(mdata, (), 'replication-key')
+    needed = set(field_mappings.values())
+    needed.update(stream_props.get('key_properties') or [])
+    needed.update(stream_props.get('replication_key') or [])
+    if replication_key:
+        needed.add(replication_key)
+    return needed
+
+
+def project_columns(catalog_entry, columns):
+    """Intersect the columns to SELECT with the columns mapped to Pendo
+    attributes, so unmapped columns are never read or serialized.
+    Returns the projected columns and the set of pruned columns.
+    Only with --project_columns, which names the target config whose
+    field_mappings the target will apply."""
+    if not parsed_args.project_columns:
+        return columns, set()
+    needed = mapped_columns(catalog_entry, parsed_args.project_columns)
+    if needed is None:
+        return columns, set()
+    projected = columns.intersection(needed)
+    pruned = columns.difference(projected)
+    if pruned:
+        LOGGER.info(
+            f"Columns {sorted(pruned)} of {catalog_entry.tap_stream_id} are not " +
+            "mapped to Pendo attributes. Pruning them from the SELECT"
+        )
+    return projected, pruned
+
+
 def entry_is_selected(catalog_entry):
     mdata = metadata.new()
     if catalog_entry.metadata is not None:
@@ -90,6 +132,7 @@ def resolve_catalog(discovered, catalog, state):
 
         # These are the columns we need to select
         columns = desired_columns(selected, discovered_table.schema)
+        columns, _ = project_columns(catalog_entry, columns)
 
         schema = Schema(
             type='object',
@@ -0,0 +1,147 @@
+"""SNAPSHOT_DIFF replication: incremental syncs without a replication key.
+
+Each run stages the stream's rows, with an MD5 of the mapped columns, in a
+versioned table next to the source table, and only the rows that are new or
+whose hash differs from the last committed snapshot are extracted. The
+staged table becomes the committed snapshot on the next run, once the state
+handed back by the target carries its version, so an interrupted run never
+advances the snapshot past rows Pendo has not received.
+
+Snapshot tables for <table> live in the same schema:
+  * <table>_pendo_snapshot            - the committed snapshot
+  * <table>_pendo_snapshot_<version>  - a staged snapshot awaiting commit
+"""
+import time
+from singer.logger import get_logger
+from tap_redshift.connect import select_all
+
+LOGGER = get_logger()
+NL = "\n"  # adding newline constant for easier multiline logging
+SNAPSHOT_SUFFIX = '_pendo_snapshot'
+HASH_COLUMN = 'pendo_row_hash'
+NULL_TOKEN = '\\N'  # stands in for NULLs so they hash differently from ''
+
+
+def quote(identifier):
+    return f'"{identifier}"'
+
+
+def row_hash_expr(columns):
+    """MD5 over the text of each column, NULL-safe and delimited"""
+    parts = " || '|' || ".join(
+        f"NVL(CAST({quote(col)} AS VARCHAR), '{NULL_TOKEN}')" for col in columns
+    )
+    return f'MD5({parts})'
+
+
+class SnapshotDiff:
+    """ * connection: psycopg2 connection used for the DDL and its commits
+        * schema, table: the source table of the stream
+        * columns: the resolved columns staged in the snapshot
+        * key_column: Redshift primary key used to match rows across snapshots
+        * hash_columns: the columns whose changes should be sent to Pendo
+        * source: FROM source to stage rows from, the source table by default
+        """
+
+    def __init__(self, connection=None, schema=None, table=None, columns=None,
+                 key_column=None, hash_columns=None, source=None):
+        self.connection = connection
+        self.schema = schema
+        self.table = table
+        self.columns = columns
+        self.key_column = key_column
+        self.hash_columns = hash_columns or columns
+        self.source = source or f'{quote(schema)}.{quote(table)}'
+        self.version = int(time.time() * 1000)
+        self.committed = f'{quote(schema)}.{quote(table + SNAPSHOT_SUFFIX)}'
+        self.staged = f'{quote(schema)}.{quote(self.staged_name(self.version))}'
+
+    def staged_name(self, version):
+        return f'{self.table}{SNAPSHOT_SUFFIX}_{version}'
+
+    def execute(self, statements, params=None):
+        """Runs the statements in a single transaction"""
+        with self.connection.cursor() as cursor:
+            for statement in statements:
+                LOGGER.debug(f"EXECUTING: {statement}")
+                cursor.execute(statement, params)
+        self.connection.commit()
+
+    def staged_versions(self):
+        prefix = f'{self.table}{SNAPSHOT_SUFFIX}_'
+        tables = select_all(
+            self.connection,
+            """
+            SELECT table_name
+            FROM INFORMATION_SCHEMA.Tables
+            WHERE table_schema = '{}'
+            """.format(self.schema))
+        return [
+            int(name[len(prefix):]) for (name,) in tables
+            if name.startswith(prefix) and name[len(prefix):].isdigit()
+        ]
+
+    def promote(self, committed_version=None):
+        """Swaps in the staged snapshot of the last run whose state was committed,
+        and drops staged snapshots of earlier runs that never completed.
+        Snapshots staged after it are kept, as their run's state may still be committed
+        """
+        statements = []
+        for version in sorted(self.staged_versions()):
+            staged = f'{quote(self.schema)}.{quote(self.staged_name(version))}'
+            if committed_version is None or version > committed_version:
+                LOGGER.info(
+                    f"KEEPING SNAPSHOT {version} OF {self.schema}.{self.table}, "
+                    + f"STAGED AFTER COMMITTED SNAPSHOT {committed_version}"
+                )
+            elif version == committed_version:
+                LOGGER.info(
+                    f"COMMITTING SNAPSHOT {version} OF {self.schema}.{self.table}"
+                )
+                statements.append(f'DROP TABLE IF EXISTS {self.committed}')
+                statements.append(
+                    f'ALTER TABLE {staged} RENAME TO {quote(self.table + SNAPSHOT_SUFFIX)}'
+                )
+            else:
+                LOGGER.info(
+                    f"DROPPING UNCOMMITTED SNAPSHOT {version} OF {self.schema}.{self.table}"
+                )
+                statements.append(f'DROP TABLE {staged}')
+        if statements:
+            self.execute(statements)
+
+    def stage(self, where=None, params=None):
+        """Stages this run's rows and their hashes, creating an empty
+        committed snapshot on the first run
+        """
+        select_list = ','.join(quote(col) for col in self.columns)
+        statement = (
+            f'CREATE TABLE {self.staged} AS '
+            f'SELECT {select_list}, {row_hash_expr(self.hash_columns)} AS {quote(HASH_COLUMN)} '
+            f'FROM {self.source}'
+        )
+        if where:
+            statement += f' WHERE {where}'
+        self.execute([
+            statement,
+            f'CREATE TABLE IF NOT EXISTS {self.committed} (LIKE {self.staged})'
+        ], params)
+        LOGGER.info(
+            f"STAGED SNAPSHOT {self.version} OF {self.schema}.{self.table}{NL}"
+            + f"HASHED COLUMNS: {self.hash_columns}"
+        )
+
+    def delta_filter(self):
+        key = quote(self.key_column)
+        return (
+            f'FROM {self.staged} n WHERE NOT EXISTS ('
+            f'SELECT 1 FROM {self.committed} c '
+            f'WHERE c.{key} = n.{key} AND c.{quote(HASH_COLUMN)} = n.{quote(HASH_COLUMN)})'
+        )
+
+    def delta_query(self, select_list=None):
+        """SELECT of the staged rows that are new or changed since the committed snapshot"""
+        return f'SELECT {select_list} {self.delta_filter()} ORDER BY {quote(self.key_column)} ASC'
+
+    def count_query(self):
+        return f'SELECT COUNT(*) {self.delta_filter()}'
@@ -4,9 +4,10 @@ import simplejson as json
 LOGGER = get_logger()
 """STREAMS:
 key_properties: Primary key fields for identifying an endpoint record.
-replication_method: INCREMENTAL or FULL_TABLE
+replication_method: INCREMENTAL, FULL_TABLE or SNAPSHOT_DIFF (delta against the last committed snapshot in Redshift)
 replication_keys: bookmark_field(s), typically a date-time, used for filtering the results and setting the state
 bookmark_type: Data type for bookmark, integer or datetime
+dedupe_latest (optional): extract only the newest row per key_properties, ranked by replication_key
 """
 
 STREAMS = {
@@ -27,7 +28,7 @@ STREAMS = {
             "sggallerieslabpricesheetassignedcount": "sg_galleries_lab_price_sheet_assigned_count",
             "sglabfulfilledordersapprovedcount": "sg_lab_fulfilled_orders_approved_count",
             "sgselffulfilledordersreceivedcount": "sg_self_fulfilled_orders_received_count",
-            "sgaccountcountry": "sg_account_country",
+            "sg_account_country": "sg_account_country",
             "sgtrusttier": "sg_trust_tier",
             "sgisfree": "sg_is_free",
             "sgisintrial": "sg_is_in_trial",
@@ -44,6 +45,7 @@ STREAMS = {
         "bookmark_type": "datetime",
         "field_mappings": {
             "visitorId": "platform_user_public_id",
+            "platform_account_id": "platform_account_id",
             "sgaccountowner": "sg_account_owner"
         }
     }
@@ -1,13 +1,13 @@
 import sys
-import copy
 import time
 import datetime
 import pendulum
 import simplejson as json
 import httpx
 import asyncio
+import pendo_telemetry as telemetry
 from validators import uuid
-from tap_redshift import bookmarks, messages, parsed_args
+from tap_redshift import bookmarks, checkpoints, compression, messages, parsed_args, payload, snapshots
 from tap_redshift.streams import STREAMS
 from singer import logger, metadata, metrics, utils
 
@@ -16,8 +16,26 @@ NL = "\n"  # adding newline constant for easier multiline logging
 QUERY_LIMIT = parsed_args.query_limit
 START_DATE = parsed_args.start_date
 INT_KEY = parsed_args.target_int_key
+CHECKPOINT_ROWS = parsed_args.checkpoint_rows
+CHECKPOINT_SECONDS = parsed_args.checkpoint_seconds
+RECORD_BATCH_SIZE = parsed_args.record_batch_size
+COMPRESS = parsed_args.compress
+PENDO_URL = parsed_args.pendo_url
+SNAPSHOT_DIFF = 'SNAPSHOT_DIFF'  # replication method diffing rows against the last committed snapshot
 TIMEOUT = httpx.Timeout(connect=None, read=None, write=None, pool=None)
 LIMITS = httpx.Limits(max_keepalive_connections=1, max_connections=5, keepalive_expiry=300.0)
+ROWS_READ = telemetry.REGISTRY.counter(
+    'tap_redshift_rows_read_total', 'Rows fetched from Redshift', ['stream'])
+FETCH_SECONDS = telemetry.REGISTRY.counter(
+    'tap_redshift_fetch_seconds_total', 'Time spent fetching rows from Redshift cursors', ['stream'])
+QUERY_SECONDS = telemetry.REGISTRY.histogram(
+    'tap_redshift_query_seconds', 'Redshift query execution time', ['stream', 'query'])
+UUID_FETCH_SECONDS = telemetry.REGISTRY.histogram(
+    'tap_redshift_uuid_fetch_seconds', 'Time to fetch a stream\'s Pendo UUIDs', ['stream'])
+MESSAGES = telemetry.REGISTRY.counter(
+    'tap_redshift_messages_total', 'Singer messages written to stdout', ['type'])
+OUTPUT_BYTES = telemetry.REGISTRY.counter(
+    'tap_redshift_output_bytes_total', 'Serialized Singer message bytes, before compression')
 HEADERS = {
     'User-Agent': 'Singer-ShootProof',
     'Accept-Encoding': 'gzip, deflate',
@@ -35,7 +53,7 @@ async def fetch_uuids(stream=None):
         stream_target_entity = STREAMS[stream]['target_entity']
         stream_target_pkey = STREAMS[stream]['primary_key']
         pendo_uuids = []
-        aggr_url = 'https://app.pendo.io/api/v1/aggregation'  # Pendo Aggregation API endpoint
+        aggr_url = f'{PENDO_URL}/api/v1/aggregation'  # Pendo Aggregation API endpoint
         # Building query for Aggregation Endpoint
         data = "{\"response\":{\"mimeType\":\"application/json\"},"
         data += "\"request\":{\"pipeline\":[{\"source\":{\"%s\":null}}," % stream_target_entity
@@ -57,21 +75,47 @@ async def fetch_uuids(stream=None):
 def do_sync(conn=None, db_schema=None, catalog=None, state=None):
     """Writes all Singer messages to stdout and flushes"""
     LOGGER.info("STARTING REDSHIFT SYNC")
+    if COMPRESS:
+        return do_compressed_sync(conn, db_schema, catalog, state)
     for message in messages.generate_messages(conn, db_schema, catalog, state):
         if message is not None:
-            sys.stdout.write(
-                json.dumps(
-                    message.asdict(),
-                    default=coerce_datetime,
-                    use_decimal=True
-                ) + NL
-            )
+            message_dict = message.asdict()
+            line = json.dumps(
+                message_dict,
+                default=coerce_datetime,
+                use_decimal=True
+            ) + NL
+            sys.stdout.write(line)
             sys.stdout.flush()
+            MESSAGES.inc(type=message_dict.get('type'))
+            OUTPUT_BYTES.inc(len(line))  # ASCII-escaped JSON, so chars are bytes
         else:
             pass
     LOGGER.info("COMPLETED SYNC")
 
 
+def do_compressed_sync(conn=None, db_schema=None, catalog=None, state=None):
+    """Writes all Singer messages to stdout through a compressor,
+    flushing a decodable block at every STATE message
+    """
+    output = compression.CompressedWriter(sys.stdout.buffer, COMPRESS)
+    for message in messages.generate_messages(conn, db_schema, catalog, state):
+        if message is not None:
+            message_dict = message.asdict()
+            data = (json.dumps(
+                message_dict,
+                default=coerce_datetime,
+                use_decimal=True
+            ) + NL).encode('utf-8')
+            output.write(data)
+            MESSAGES.inc(type=message_dict.get('type'))
+            OUTPUT_BYTES.inc(len(data))
+            if isinstance(message, messages.StateMessage):
+                output.flush()
+    output.close()
+    LOGGER.info("COMPLETED SYNC")
+
+
 def coerce_datetime(dt_time=None):
     if isinstance(dt_time, (datetime.datetime, datetime.date)):
         return dt_time.isoformat()
@@ -92,9 +136,11 @@ def sync_table(connection=None, catalog_entry=None, state=None):
     stream, tap_stream_id = catalog_entry.stream, catalog_entry.tap_stream_id
     redshift_pkey = STREAMS[stream]['key_properties'][0]
     # Runner statement for fetch_uuids async function
+    started = time.monotonic()
     pendo_uuids = asyncio.run(
         fetch_uuids(stream)
     )
+    UUID_FETCH_SECONDS.observe(time.monotonic() - started, stream=stream)
     LOGGER.info(
         f"CATALOG_ENTRY: {catalog_entry}{NL}"
         + f"REDSHIFT_PKEY: {redshift_pkey}{NL}"
@@ -104,11 +150,25 @@ def sync_table(connection=None, catalog_entry=None, state=None):
     with connection.cursor() as cursor:
         schema, table = catalog_entry.table.split('.')
         params = {}
-        select = 'SELECT {} FROM {}.{}'.format(','.join((f'"{col}"' for col in columns)), f'"{schema}"', f'"{table}"')
         if START_DATE is not None:
             formatted_start_date = datetime.datetime.strptime(
                 START_DATE, '%Y-%m-%dT%H:%M:%SZ').astimezone()
         replication_key = metadata.to_map(catalog_entry.metadata).get((), {}).get('replication-key')
+        replication_method = metadata.to_map(catalog_entry.metadata).get((), {}).get('replication-method')
+        snapshot_diff = SNAPSHOT_DIFF in (replication_method, STREAMS[stream].get('replication_method'))
+        if snapshot_diff:
+            replication_key = None  # rows are diffed against the committed snapshot instead
+        shape = None
+        select_list = ','.join((f'"{col}"' for col in columns))
+        output_columns = columns
+        if payload.is_shaped(stream):
+            shape = payload.PayloadShape(stream, columns, replication_key)
+            select_list = shape.select_list()
+            output_columns = shape.output_columns()
+        source = '{}.{}'.format(f'"{schema}"', f'"{table}"')
+        if STREAMS[stream].get('dedupe_latest'):
+            source = latest_row_source(stream, schema, table, columns)
+        select = 'SELECT {} FROM {}'.format(select_list, source)
         replication_key_value = None
         bookmark_is_empty = state.get('bookmarks', {}).get(tap_stream_id) is None
         stream_version = get_stream_version(tap_stream_id, state)
@@ -116,9 +176,10 @@ def sync_table(connection=None, catalog_entry=None, state=None):
             stream=catalog_entry.stream,
             version=stream_version
         )
-        state = bookmarks.write_bookmark(
-            state, tap_stream_id, 'version', stream_version
+        checkpoint = checkpoints.CheckpointManager(
+            state, tap_stream_id, CHECKPOINT_ROWS, CHECKPOINT_SECONDS
         )
+        checkpoint.write_bookmark('version', stream_version)
         LOGGER.debug(
             f"BOOKMARK_IS_EMPTY: {bookmark_is_empty}"
         )
@@ -132,8 +193,8 @@ def sync_table(connection=None, catalog_entry=None, state=None):
         if replication_key or bookmark_is_empty:
             yield activate_version_message
         if replication_key:
-            replication_key_value = bookmarks.get_bookmark(
-                state, tap_stream_id, 'replication_key_value'
+            replication_key_value = checkpoint.get_bookmark(
+                'replication_key_value'
             ) or formatted_start_date.isoformat()
         if replication_key_value is not None:
             entry_schema = catalog_entry.schema
@@ -150,12 +211,30 @@ def sync_table(connection=None, catalog_entry=None, state=None):
             select += ' WHERE {} IN %(pendo_uuids)s'.format(redshift_pkey)
             select += ' ORDER BY {} ASC'.format(replication_key)
             params['pendo_uuids'] = (pendo_uuids,)
-        select_all = f'SELECT COUNT(*) FROM {schema}.{table}'
-        select_all += ' WHERE {} = ANY %(pendo_uuids)s'.format(redshift_pkey)
-        select_all += ' LIMIT {}'.format(QUERY_LIMIT)
+        snapshot = None
+        if snapshot_diff:
+            mapped = set(STREAMS[stream].get('field_mappings', {}).values())
+            snapshot = snapshots.SnapshotDiff(
+                connection, schema, table, columns, redshift_pkey,
+                [col for col in columns if col in mapped], source
+            )
+            snapshot.promote(checkpoint.get_bookmark('snapshot_version'))
+            snapshot.stage(
+                '"{}" = ANY %(pendo_uuids)s'.format(redshift_pkey),
+                {'pendo_uuids': (pendo_uuids,)}
+            )
+            # no LIMIT, rows left out of the delta would be committed unsent
+            select = snapshot.delta_query(select_list)
+            select_all = snapshot.count_query()
+        else:
+            select_all = f'SELECT COUNT(*) FROM {source}'
+            select_all += ' WHERE {} = ANY %(pendo_uuids)s'.format(redshift_pkey)
+            select_all += ' LIMIT {}'.format(QUERY_LIMIT)
         params['pendo_uuids'] = (pendo_uuids,)
         query_string_all = cursor.mogrify(select_all)
+        started = time.monotonic()
         cursor.execute(select_all, params)
+        QUERY_SECONDS.observe(time.monotonic() - started, stream=stream, query='count')
         total_rows = cursor.fetchone()[0]
         volume_message = messages.VolumeMessage(
             stream=catalog_entry.stream,
@@ -169,41 +248,116 @@ def sync_table(connection=None, catalog_entry=None, state=None):
         )
         time_extracted = utils.now()
         query_string = cursor.mogrify(select, params)
+        started = time.monotonic()
         cursor.execute(select, params)
+        QUERY_SECONDS.observe(time.monotonic() - started, stream=stream, query='select')
         LOGGER.info(
             f"EXECUTED QUERY: {query_string}"
         )
+        started = time.perf_counter()
         row = cursor.fetchone()
+        FETCH_SECONDS.inc(time.perf_counter() - started, stream=stream)
         rows_saved = 0
+        batch_rows = []  # rows held for the next RECORD_BATCH, if enabled
+        replication_key_idx = columns.index(replication_key) if replication_key in columns else None
         with metrics.record_counter(None) as counter:
             counter.tags['database'] = catalog_entry.database
             counter.tags['table'] = catalog_entry.table
             while row:
                 counter.increment()
+                ROWS_READ.inc(stream=stream)
                 rows_saved += 1
-                record_message = messages.row_to_record(
-                    catalog_entry, stream_version, row, columns, time_extracted
-                )
-                yield record_message
-                if replication_key is not None:
-                    state = bookmarks.write_bookmark(
-                        state,
-                        tap_stream_id,
-                        'replication_key_value',
-                        record_message.record[replication_key]
+                if shape is not None:
+                    values, replication_key_value = shape.row_to_values(row)
+                    if RECORD_BATCH_SIZE:
+                        batch_rows.append(values)
+                    else:
+                        yield messages.RecordMessage(
+                            stream=catalog_entry.stream,
+                            record=dict(zip(output_columns, values)),
+                            version=stream_version,
+                            time_extracted=time_extracted
+                        )
+                    if replication_key is not None:
+                        checkpoint.write_bookmark(
+                            'replication_key_value', replication_key_value
+                        )
+                elif RECORD_BATCH_SIZE:
+                    values = messages.row_to_values(row)
+                    batch_rows.append(values)
+                    if replication_key is not None:
+                        checkpoint.write_bookmark(
+                            'replication_key_value',
+                            values[replication_key_idx]
+                        )
+                else:
+                    record_message = messages.row_to_record(
+                        catalog_entry, stream_version, row, columns, time_extracted
+                    )
+                    yield record_message
+                    if replication_key is not None:
+                        checkpoint.write_bookmark(
+                            'replication_key_value',
+                            record_message.record[replication_key]
+                        )
+                checkpoint.add_rows()
+                state_due = checkpoint.is_due()
+                # records in a batch must always precede the STATE that covers them
+                if batch_rows and (state_due or len(batch_rows) >= RECORD_BATCH_SIZE):
+                    yield messages.rows_to_batch(
+                        catalog_entry, stream_version, batch_rows, output_columns, time_extracted
                     )
-                if rows_saved % 1000 == 0:
+                    batch_rows = []
+                if state_due:
                     yield messages.StateMessage(
-                        value=(copy.deepcopy(state)))
+                        value=checkpoint.snapshot())
+                started = time.perf_counter()
                 row = cursor.fetchone()
+                FETCH_SECONDS.inc(time.perf_counter() - started, stream=stream)
+            if batch_rows:
+                yield messages.rows_to_batch(
+                    catalog_entry, stream_version, batch_rows, output_columns, time_extracted
+                )
         if not replication_key:
             yield activate_version_message
             yield
-            state = bookmarks.write_bookmark(
-                state, catalog_entry.tap_stream_id, 'version', None
-            )
+            checkpoint.write_bookmark('version', None)
+        if snapshot is not None:
+            # committed on the next run, once the target hands this state back
+            checkpoint.write_bookmark('snapshot_version', snapshot.version)
         yield messages.StateMessage(
-            value=(copy.deepcopy(state)))
+            value=checkpoint.snapshot())
+        LOGGER.info(
+            f"EMITTED {checkpoint.checkpoints} STATE CHECKPOINTS FOR {tap_stream_id}"
+        )
+
+
+def latest_row_source(stream=None, schema=None, table=None, columns=()):
+    """Returns a FROM source keeping only the newest row per key of the stream,
+    ranked by its replication key, so duplicates never leave Redshift.
+    NULL replication keys rank last, and ties are broken on the other columns
+    so reruns keep the same row
+    """
+    key_column = STREAMS[stream]['key_properties'][0]
+    order_column = (STREAMS[stream].get('replication_key') or [None])[0]
+    if order_column is None:
+        LOGGER.warning(
+            f"NO REPLICATION KEY TO RANK ROWS OF {stream} BY,{NL}"
+            + "SKIPPING LATEST-ROW DEDUPLICATION"
+        )
+        return f'"{schema}"."{table}"'
+    LOGGER.info(
+        f"KEEPING LATEST ROW PER {key_column} BY {order_column} FOR {stream}"
+    )
+    tie_breakers = ''.join(
+        f', "{col}"' for col in columns if col not in (key_column, order_column)
+    )
+    return (
+        '(SELECT * FROM (SELECT *, ROW_NUMBER() OVER ('
+        f'PARTITION BY "{key_column}" ORDER BY "{order_column}" DESC NULLS LAST{tie_breakers}) '
+        'AS "pendo_row_number" '
+        f'FROM "{schema}"."{table}") AS "ranked" WHERE "pendo_row_number" = 1) AS "{table}"'
+    )
 
 
 def get_stream_version(tap_stream_id=None, state=None):
@@ -254,4 +408,11 @@ def build_state(raw_state=None, catalog=None):
             state = bookmarks.write_bookmark(
                 state, tap_stream_id, 'version', raw_stream_version
             )
+        raw_snapshot_version = bookmarks.get_bookmark(
+            raw_state, tap_stream_id, 'snapshot_version'
+        )
+        if raw_snapshot_version is not None:
+            state = bookmarks.write_bookmark(
+                state, tap_stream_id, 'snapshot_version', raw_snapshot_version
+            )
     return state
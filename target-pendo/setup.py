@@ -12,14 +12,20 @@ setup(name='target-pendo',
       py_modules=['target_pendo'],
       install_requires=[
           'jsonschema>=2.6.0',
-          'singer-python>=5.0.4'
+          'singer-python>=5.0.4',
+          'pendo-telemetry'
       ],
+      extras_require={
+          # the in-process pipeline imports the tap itself
+          'pipeline': ['tap-redshift']
+      },
       packages=find_packages(),
       include_package_data=True,
       entry_points= {
               'console_scripts': [
-                  'target-pendo=target_pendo.__init__:main'
-                  
+                  'target-pendo=target_pendo.__init__:main',
+                  'redshift-pendo=target_pendo.pipeline:main [pipeline]',
+                  'pendo-mock=target_pendo.mock_server:main'
               ]
           }
 )
@@ -1,26 +1,30 @@
 #!/usr/bin/env python3
-import io
 import sys
 import json
 import asyncio
+import logging
 import argparse
 from math import ceil
-from itertools import tee
 from collections import Counter
 from collections.abc import MutableMapping
 import httpx
 import backoff
+import pendo_telemetry as telemetry
 from backoff import on_exception, expo
-from ratelimit import limits, RateLimitException
 from jsonschema.validators import Draft4Validator
+from target_pendo import change_index, coalesce, compression, dispatch, hedging, limiter, retry, sizing, spool, watermark
+from target_pendo import sharding, workqueue
+from target_pendo.batches import Batch
 from target_pendo.logger import SyncLogger
 from target_pendo.exceptions import PendoClientResponseError, TargetPendoException, WriteError
 
 LOGGER = SyncLogger(__name__).logger
 MAX_ATTEMPTS = 5
-FIVE_MINUTES = 300.0  # Necessary for passing 'period' arg to @limits decorator
+FIVE_MINUTES = 300.0
 R_MAX = 100000  # Default for max recursion depth to avoid sys error
 NL = "\n"  # Newline constant for easier multiline logging
+PAYLOAD_SCHEMA_KEY = 'x-pendo-payload'  # SCHEMA marker for records shaped by the tap
+NO_RESPONSE = 0  # status of a request that failed in transport, w/o a response
 
 # should help resolve the WriteError/Errno 32:Broken Pipe
 # failures from overloading Pendo Client
@@ -35,6 +39,24 @@ LIMITS = httpx.Limits(
     max_connections=40,
     keepalive_expiry=FIVE_MINUTES
 )
+RECORDS_READ = telemetry.REGISTRY.counter(
+    'target_pendo_records_read_total', 'Records read from the tap', ['stream'])
+RECORDS_SENT = telemetry.REGISTRY.counter(
+    'target_pendo_records_sent_total', 'Records sent to Pendo, counting each attempt', ['stream'])
+RECORDS_FAILED = telemetry.REGISTRY.counter(
+    'target_pendo_records_failed_total', 'Records failed by Pendo or in a failed request', ['stream'])
+REQUESTS = telemetry.REGISTRY.counter(
+    'target_pendo_requests_total', 'Requests sent to Pendo, by response status', ['stream', 'status'])
+REQUEST_BYTES = telemetry.REGISTRY.counter(
+    'target_pendo_request_bytes_total', 'Request body bytes sent to Pendo', ['stream'])
+BATCH_LATENCY = telemetry.REGISTRY.histogram(
+    'target_pendo_batch_latency_seconds', 'Pendo response time per batch request', ['stream'])
+IN_FLIGHT = telemetry.REGISTRY.gauge(
+    'target_pendo_requests_in_flight', 'Requests awaiting a Pendo response', ['kind'])
+BATCHES_UNACKED = telemetry.REGISTRY.gauge(
+    'target_pendo_batches_unacked', 'Built batches not yet acknowledged', ['stream'])
+RETRIES_WAITING = telemetry.REGISTRY.gauge(
+    'target_pendo_retry_records_waiting', 'Failed records waiting on the next retry round', ['stream'])
 
 
 class Endpoints:
@@ -44,10 +66,11 @@ class Endpoints:
         """
 
     path = '/api/v1/metadata/{}/{}/value'
+    base = 'https://app.pendo.io'  # overridden w/ --pendo_url, e.g. for the mock server
 
     def __init__(self, stream):
         self.stream = stream
-        self.base = 'https://app.pendo.io'
+        self.base = Endpoints.base
         self.kinds = ['account', 'visitor']
         self.group = 'custom'
         self.kind = self.get_kind()
@@ -80,6 +103,10 @@ class BatchArgs:
         self.request_delay = args.request_delay or defaults.request_delay
         self.rate_limit = args.rate_limit or defaults.rate_limit
         self.max_attempts = args.attempts or defaults.attempts
+        self.min_batch_records = args.min_batch_records or defaults.min_batch_records
+        self.max_batch_records = args.max_batch_records or defaults.max_batch_records
+        self.latency_target = args.latency_target or defaults.latency_target
+        self.max_outstanding = args.max_outstanding or defaults.max_outstanding
 
     def to_dict(self):
         """Create batch_options dict from class object"""
@@ -89,7 +116,11 @@ class BatchArgs:
             'records': self.max_records,
             'request_delay': self.request_delay,
             'rate_limit': self.rate_limit,
-            'retries': self.max_attempts
+            'retries': self.max_attempts,
+            'min_batch_records': self.min_batch_records,
+            'max_batch_records': self.max_batch_records,
+            'latency_target': self.latency_target,
+            'max_outstanding': self.max_outstanding
         }
         LOGGER.info(
             f"BATCH OPTIONS: {batch_options}"
@@ -104,8 +135,12 @@ class DefaultArgs:
         self.bytes = 5000000
         self.records = 500
         self.request_delay = 0.00
-        self.rate_limit = 10
+        self.rate_limit = 6  # 1800 requests per five minutes, the ceiling Pendo has been sent at
         self.attempts = 5
+        self.min_batch_records = 50  # bounds on adaptive batch sizing
+        self.max_batch_records = 5000
+        self.latency_target = 30.00
+        self.max_outstanding = 20  # batches handed over but not yet sent before reading blocks
 
 
 class Headers:
@@ -143,21 +178,44 @@ class StreamProps:
     int_key = None
     all_streams = None
     completed_streams = []
+    change_index = None
+    coalesce_window = None
+    spool = None
+    limiters = {}  # RequestLimiter per Pendo kind, so each endpoint has its own rate budget
+    rate_limit = None
+    rate_budget = None  # SQLite file of a rate budget shared with other processes
+    dispatcher = None
+    dead_letter = None
+    sizer = None
+    hedger = None
+    work_queue = None  # set when batches are sent by worker processes
+    metrics_file = None  # file the metrics are written to at exit
+    state_sink = None  # called with states to emit instead of writing them to stdout
+    run_totals = {}  # Pendo result counts per finished stream
+    last_seq = 0  # seq of the last batch built, across all streams
+    records_received = 0  # ordinal of the last record received, across all streams
+    watermark = None
 
     def __init__(self):
         self.stream = None
         self.version = None
         self.primary_key = None
         self.field_mappings = None
+        self.shaped = False
+        self.kind = None
+        self.batch = None  # batch being assembled from the stream's records
+        self.coalescer = None
+        self.batch_floor = None  # ordinal of the oldest record in the partial batch
         self.total_batches = None
         self.batches_built = 0
         self.batches_completed = 0
         self.total_records = None
         self.record_count = 0
         self.pending_requests = []
-        self.failed_requests = []
+        self.retries = None
+        self.sending = []  # tasks sending the stream's built batches
+        self.done = None  # future of the stream's completion
         self.stream_totals = Counter()
-        self.batch_times = [0.000]
         self.progress = None
         self.state = None
 
@@ -166,15 +224,42 @@ class StreamProps:
         return self.record_count
 
     def add_pending(self, batch):
+        StreamProps.last_seq += 1
+        if not isinstance(batch, Batch):
+            batch = Batch(batch)
+        batch.seq, batch.stream = StreamProps.last_seq, self.stream
+        if StreamProps.spool is not None:
+            # written ahead of sending, may be held on disk only until its turn
+            batch = StreamProps.spool.append(batch)
         self.pending_requests.append(batch)
         self.batches_built += 1
         return self.batches_built
 
+    def unbatched(self):
+        """Returns the ordinal of the oldest received record not yet in a built batch"""
+
+        held = self.coalescer.oldest() if self.coalescer is not None else None
+        floors = [ordinal for ordinal in (self.batch_floor, held) if ordinal is not None]
+        return min(floors) if floors else None
+
     def drop_pending(self):
         self.batches_completed += 1
         self.pending_requests = self.pending_requests[self.batches_completed:]
         return self.pending_requests
 
+    @classmethod
+    def limiter_for(cls, kind=None):
+        if kind not in cls.limiters:
+            if cls.rate_budget:
+                # drawn on by every process sending with the same integration key
+                bucket = limiter.SharedTokenBucket(
+                    cls.rate_budget, limiter.budget_key(cls.int_key, kind), cls.rate_limit
+                )
+            else:
+                bucket = limiter.TokenBucket(cls.rate_limit)
+            cls.limiters[kind] = limiter.RequestLimiter(limiter.MAX_CONCURRENCY, bucket)
+        return cls.limiters[kind]
+
     @classmethod
     def update_streams(cls, stream):
         if stream not in cls.completed_streams:
@@ -183,26 +268,14 @@ class StreamProps:
         cls.all_streams.sort()
         return cls.completed_streams
 
-    def log_request_time(self, req_time):
-        if req_time:
-            self.batch_times.append(req_time)
-            self.batch_times.sort(key=float)
-        return self.batch_times
-
     def update_stream_totals(self, batch_result):
         if batch_result:
-            self.stream_totals += batch_result
+            # only counts, as 'errors' lists the failed records
+            self.stream_totals.update(
+                {key: val for key, val in batch_result.items() if isinstance(val, int)}
+            )
         return self.stream_totals
 
-    def get_request_times(self):
-        t1, t2 = tee(self.batch_times)
-        next(t2, None)
-        pairs = list(zip(t1, t2))
-        time_deltas = [(round(pair[1] - pair[0], 3)) for pair in pairs]
-        batch_keys = [f"BATCH{ct}" for ct in range(1, len(self.batch_times))]
-        request_times = dict(zip(batch_keys, time_deltas))
-        return request_times
-
     def get_sync_progress(self):
         """Returns completion % for stream sync"""
 
@@ -216,29 +289,24 @@ class StreamProps:
 
 async def finish_requests(session=None, stream_dict=None):
     stream = stream_dict.stream
-    state = stream_dict.state
-    emit_state(state)
     stream_totals = stream_dict.stream_totals
-    failed = stream_dict.failed_requests
-    num_fails = len(failed)
-    failures = bool(num_fails > 0)
-    if failures:
-        retried = 0
-        retrying = bool(retried <= num_fails)
-        while retrying:
-            batch = failed[retried]
-            tasks = asyncio.ensure_future(post_request(session, batch, stream_dict))
-            await asyncio.gather(*tasks, return_exceptions=True)
-            retried += 1
-            retrying = bool(retried <= num_fails)
-    request_times = stream_dict.get_request_times()
-    agg_time = round(sum(request_times.values()), 4)
+    if stream_dict.retries is not None:
+        stream_dict.retries.log_stats()
+    if StreamProps.sizer is not None:
+        StreamProps.sizer.log_stats()
+    if StreamProps.hedger is not None:
+        StreamProps.hedger.log_stats()
+    if StreamProps.change_index is not None:
+        StreamProps.change_index.log_stats(stream)
+    latency = BATCH_LATENCY.stats(stream=stream)
     LOGGER.info(
-        f"REQUEST TIMES: {request_times}{NL}"
+        f"REQUEST LATENCY OVER {latency['count']} REQUESTS: P50 {latency.get('p50')}, "
+        + f"P95 {latency.get('p95')}, P99 {latency.get('p99')} SECONDS{NL}"
         + f"{stream_totals['updated']} OF {stream_totals['total']} RECORDS SUCCEEDED{NL}"
-        + f"TOTAL REQUEST TIME: {agg_time} SECONDS{NL}"
+        + f"TOTAL REQUEST TIME: {latency['sum']} SECONDS{NL}"
         + f"REQUESTS COMPLETE FOR {stream}"
     )
+    StreamProps.run_totals.setdefault(stream, Counter()).update(stream_totals)
     # We add the stream to completed_streams
     # so we know what streams remain in sync
     StreamProps.update_streams(stream)
@@ -250,35 +318,51 @@ async def finish_requests(session=None, stream_dict=None):
 
     synced_all_streams = bool(StreamProps.completed_streams == StreamProps.all_streams)
     if synced_all_streams:
+        # keep reading so the STATE following the last
+        # record is emitted once its batches are acknowledged
         LOGGER.info(
             f"ALL STREAMS COMPLETE,{NL}"
             "CLOSING CONNECTION WITH PENDO CLIENT"
         )
-        sys.exit()
-    else:
-        return
+    return
 
 
 def emit_state(state=None):
     """Write state to stdout"""
 
-    if state:
+    if state and StreamProps.state_sink is not None:
+        StreamProps.state_sink(state)
+    elif state:
         line = json.dumps(state)
         LOGGER.info(f"EMITTING STATE: {line}")
-        sys.stdout.write(line)
+        sys.stdout.write(line + NL)
         sys.stdout.flush()
 
 
 def handle_failures(batch_response=None, batch=None, stream_dict=None):
-    failed = stream_dict.failed_requests
-    for error in batch_response.get('errors'):
-        failed_id = error.get('id')
-        failed_key = list(batch[0].keys())[0]
-        failed_record = list(filter(lambda x: x[failed_key] == failed_id, batch))[0]
-        failed.append(failed_record)
-        # batch included in failures so the specific records
-        # that failed in batch may be set aside for retries
-    return failed
+    """Maps the position of each record Pendo failed in the batch to its error"""
+
+    failures = {}
+    failed_key = stream_dict.primary_key[0]
+    for error in batch_response.get('errors') or []:
+        # failed records are set aside by position
+        # to be regrouped into retry batches
+        for pos in batch.positions_of(error.get('id'), failed_key):
+            failures[pos] = error
+    return failures
+
+
+def acknowledge(seq=None, stream_dict=None):
+    """Marks a built batch delivered once each of its records is resolved"""
+
+    if StreamProps.spool is not None:
+        StreamProps.spool.ack(seq)
+    stream_dict.drop_pending()
+    BATCHES_UNACKED.dec(stream=stream_dict.stream)
+    LOGGER.info(
+        f"BATCH #{seq} RESOLVED, {stream_dict.batches_completed} OF {stream_dict.total_batches} COMPLETE"
+    )
+    emit_state(StreamProps.watermark.ack(seq))
 
 
 def exception_is_4xx(exc):
@@ -292,11 +376,6 @@ def log_backoff(details):
         f"Sleeping {details['wait']} seconds before trying again: {exc}"
     )
 
-# TODO: replacement solution for ratelimit decorator,
-# TODO: not working after switch to async Client
-# Limit maximum number of concurrent tasks/request
-# rate to not overload the server
-
 
 @backoff.on_exception(
     backoff.expo,
@@ -305,41 +384,71 @@ def log_backoff(details):
     giveup=exception_is_4xx,
     on_backoff=log_backoff
 )
-@limits(
-    calls=1800,
-    period=FIVE_MINUTES
-)
 async def post_request(session=None, batch=None, batch_idx=0, batch_lims=None, stream_dict=None):
-    url = StreamProps.url = Endpoints(stream_dict.stream).url
-    total_batches = stream_dict.total_batches
+    """Sends a batch through the shared limiter, returning it with Pendo's result and status"""
+
+    endpoint = Endpoints(stream_dict.stream)
+    url = StreamProps.url = endpoint.url
+    request_limiter = StreamProps.limiter_for(endpoint.kind)
     request_delay = batch_lims.request_delay
     std_headers = Headers(StreamProps.int_key).standard
-    LOGGER.debug(
-        f"SENDING BATCH {batch_idx + 1} TO PENDO CLIENT @ {url}{NL}" +
-        f"REQUEST BODY: {batch}"
-    )
     try:
-        response = await session.post(
-            url=url, json=batch, headers=std_headers, timeout=TIMEOUT)
-        await asyncio.sleep(request_delay)
-        batch_result = response.json()
+        async with request_limiter:
+            # spooled batches are read back from disk once a slot is free
+            if StreamProps.spool is not None:
+                batch = StreamProps.spool.resolve(batch)
+            LOGGER.debug(
+                f"SENDING BATCH {batch_idx + 1} TO PENDO CLIENT @ {url}{NL}" +
+                f"REQUEST BODY: {batch}"
+            )
+            def request():
+                return session.post(url=url, json=batch, headers=std_headers, timeout=TIMEOUT)
+            IN_FLIGHT.inc(kind=endpoint.kind)
+            try:
+                if StreamProps.hedger is not None:
+                    # value updates are idempotent, so a slow request may be duplicated
+                    response = await StreamProps.hedger.send(request, request_limiter.throttle)
+                else:
+                    response = await request()
+            finally:
+                IN_FLIGHT.dec(kind=endpoint.kind)
+            await asyncio.sleep(request_delay)
         status = response.status_code
+        stream = stream_dict.stream
+        REQUESTS.inc(stream=stream, status=status)
+        RECORDS_SENT.inc(len(batch), stream=stream)
+        REQUEST_BYTES.inc(len(response.request.content), stream=stream)
+        BATCH_LATENCY.observe(response.elapsed.total_seconds(), stream=stream)
+        if StreamProps.sizer is not None:
+            StreamProps.sizer.observe(response.elapsed.total_seconds(), status)
         req_succeeded = bool(status // 100 == 2)  # floor div to check response status range
-        failures = bool(batch_result.get('failed') > 0)
         # HTTP response status flow control
-        if req_succeeded:
-            stream_dict.log_request_time(response.elapsed.total_seconds())
-            stream_dict.update_stream_totals(batch_result)
-            stream_dict.drop_pending()
-            batches_completed = stream_dict.batches_completed
-            LOGGER.info(
-                f"REQUEST {batches_completed} OF {total_batches} SUCCEEDED W/ STATUS {status}{NL}" +
-                f"BATCH #{batches_completed} RESULTS: {batch_result}"
+        if not req_succeeded:
+            LOGGER.warning(
+                f"REQUEST FOR BATCH {batch_idx + 1} FAILED W/ STATUS {status}: {response.text}"
+            )
+            return batch, {}, status
+        batch_result = response.json()
+        if StreamProps.change_index is not None:
+            failed_ids = [error.get('id') for error in batch_result.get('errors') or []]
+            # SQLite commits block, so they run off the dispatch loop
+            await asyncio.to_thread(
+                StreamProps.change_index.commit,
+                Endpoints(stream_dict.stream).kind, batch, stream_dict.primary_key[0], failed_ids
             )
-            if batches_completed == total_batches:
-                return await finish_requests(session, stream_dict)
-        if failures:
-            return handle_failures(batch_result, batch, stream_dict)
+        stream_dict.update_stream_totals(batch_result)
+        LOGGER.info(
+            f"REQUEST FOR BATCH {batch_idx + 1} SUCCEEDED W/ STATUS {status}{NL}" +
+            f"BATCH #{batch_idx + 1} RESULTS: {batch_result}"
+        )
+        return batch, batch_result, status
+    except httpx.HTTPError as exc:
+        # e.g. connect or read errors, retried like a 5xx for the whole batch
+        LOGGER.warning(
+            f"REQUEST FOR BATCH {batch_idx + 1} FAILED W/O A RESPONSE: {exc!r}"
+        )
+        REQUESTS.inc(stream=stream_dict.stream, status=NO_RESPONSE)
+        return batch, {'error': repr(exc)}, NO_RESPONSE
     except PendoClientResponseError as exc:
         msg = f"{exc.status}, {exc.response_body}"
         # PendoClientResponseError means we received > 2xx response
@@ -348,24 +457,126 @@ async def post_request(session=None, batch=None, batch_idx=0, batch_lims=None, s
         )  # Parse the msg from Client
 
 
-async def concurrent_requests(task=None):
-    semaphore = asyncio.Semaphore(10)
-    async with semaphore:
-        return await task
+async def send_batch(session=None, batch=None, batch_idx=0, batch_lims=None, stream_dict=None):
+    """Sends a batch, queueing its failed records for retry"""
+
+    if StreamProps.spool is not None:
+        # written ahead on the loop, fsynced off it before the batch goes out
+        await StreamProps.spool.flush(batch.seq)
+    batch, batch_result, status = await post_request(session, batch, batch_idx, batch_lims, stream_dict)
+    if status // 100 == 2:
+        failures = handle_failures(batch_result, batch, stream_dict)
+    else:
+        # the whole batch failed, so every record is retried
+        failures = {pos: dict(batch_result, status=status) for pos in range(len(batch))}
+    RECORDS_FAILED.inc(len(failures), stream=stream_dict.stream)
+    resolved = stream_dict.retries.settle(batch, failures)
+    # dead-lettered records are on disk before their batches are acknowledged
+    await stream_dict.retries.dead_letter.flush()
+    for seq in resolved:
+        acknowledge(seq, stream_dict)
+
+
+def log_undelivered(results=None, stream_dict=None):
+    for result in results:
+        if isinstance(result, Exception):
+            LOGGER.error(
+                f"BATCH FOR {stream_dict.stream} NOT DELIVERED: {result!r}"
+            )
+    return results
+
+
+async def send_batches(session=None, batches=None, batch_lims=None, stream_dict=None):
+    results = await asyncio.gather(
+        *(send_batch(session, batch, batch_idx, batch_lims, stream_dict)
+          for batch_idx, batch in enumerate(batches)),
+        return_exceptions=True
+    )
+    return log_undelivered(results, stream_dict)
+
+
+def ensure_retries(batch_lims=None, stream_dict=None):
+    if stream_dict.retries is None:
+        stream_dict.retries = retry.RetryQueue(
+            stream_dict.stream, batch_lims.max_attempts, batch_lims.max_records, StreamProps.dead_letter
+        )
+    return stream_dict.retries
+
+
+async def retry_failed(session=None, batch_lims=None, stream_dict=None):
+    """Retries the stream's failed records in rounds until none are waiting"""
+
+    retries = ensure_retries(batch_lims, stream_dict)
+    while retries.waiting:
+        delay = retry.retry_delay(retries.rounds)
+        retries.max_records = batch_lims.max_records
+        retry_batches = retries.regroup()
+        RETRIES_WAITING.set(sum(len(batch) for batch in retry_batches), stream=stream_dict.stream)
+        LOGGER.info(
+            f"RETRY ROUND {retries.rounds} FOR {stream_dict.stream}: "
+            + f"{sum(len(batch) for batch in retry_batches)} RECORDS IN {len(retry_batches)} BATCHES{NL}"
+            + f"SLEEPING {round(delay, 2)} SECONDS"
+        )
+        await asyncio.sleep(delay)
+        await send_batches(session, retry_batches, batch_lims, stream_dict)
+    RETRIES_WAITING.set(0, stream=stream_dict.stream)
 
 
 async def handle_requests(batch_lims=None, stream_dict=None):
-    """Send built batches to Pendo Client, retry on exception"""
+    """Send built batches to Pendo Client, then retry failed records in rounds"""
+
+    ensure_retries(batch_lims, stream_dict)
+    session = StreamProps.dispatcher.session
+    await send_batches(session, stream_dict.pending_requests, batch_lims, stream_dict)
+    await retry_failed(session, batch_lims, stream_dict)
+
+
+def dispatch_batch(batch=None, batch_lims=None, stream_dict=None):
+    """Builds the batch and starts sending it, on the dispatch loop.
+    Its slot is freed once the first attempt is over, as failed records wait on the retry queue
+    """
+
+    batches_built = build_batch(batch, stream_dict)
+    ensure_retries(batch_lims, stream_dict)
+    if StreamProps.work_queue is not None:
+        sent = deliver_batch(stream_dict.pending_requests[-1], stream_dict)
+    else:
+        sent = send_batch(
+            StreamProps.dispatcher.session, stream_dict.pending_requests[-1], batches_built - 1, batch_lims, stream_dict
+        )
+    sending = asyncio.ensure_future(sent)
+    sending.add_done_callback(StreamProps.dispatcher.release)
+    stream_dict.sending.append(sending)
+
+
+async def deliver_batch(batch=None, stream_dict=None):
+    """Hands the batch to worker processes, acknowledging it once one of them has"""
+
+    if StreamProps.spool is not None:
+        await StreamProps.spool.flush(batch.seq)
+        batch = StreamProps.spool.resolve(batch)
+    batch_totals = await StreamProps.work_queue.deliver(batch, stream_dict.primary_key[0])
+    stream_dict.update_stream_totals(batch_totals)
+    acknowledge(batch.seq, stream_dict)
+
+
+async def complete_stream(batch_lims=None, stream_dict=None):
+    """Waits on the stream's batches and their retries, then finishes the stream"""
 
-    pending = stream_dict.pending_requests
-    async with httpx.AsyncClient() as session:
-        batch_idxs = [pending.index(batch) for batch in pending]
-        tasks = [
-            asyncio.ensure_future(
-                post_request(session, batch, batch_idx, batch_lims, stream_dict)
-            ) for batch, batch_idx in zip(pending, batch_idxs)
-        ]
-        return await asyncio.gather(*(concurrent_requests(task) for task in tasks), return_exceptions=True)
+    results = await asyncio.gather(*stream_dict.sending, return_exceptions=True)
+    log_undelivered(results, stream_dict)
+    await retry_failed(StreamProps.dispatcher.session, batch_lims, stream_dict)
+    await finish_requests(StreamProps.dispatcher.session, stream_dict)
+
+
+def hold_state(state=None, ordinal=None):
+    StreamProps.watermark.hold(state, ordinal)
+
+
+def bind_states(unbatched=None):
+    # runs after every batch handed over before it was built,
+    # so StreamProps.last_seq covers each of them
+    emit_state(StreamProps.watermark.bind(unbatched, StreamProps.last_seq))
 
 
 def check_batch(batch=None, batch_lims=None, stream_dict=None):
@@ -405,6 +616,19 @@ def check_batch(batch=None, batch_lims=None, stream_dict=None):
     return batch_limiters
 
 
+def build_batch(batch=None, stream_dict=None):
+    """Moves a completed batch to the stream's pending requests"""
+
+    batch_bytes = sum(sys.getsizeof(record) for record in batch)
+    batches_built = stream_dict.add_pending(batch)
+    BATCHES_UNACKED.inc(stream=stream_dict.stream)
+    LOGGER.info(
+        f"BATCH BUILD {batches_built} OF {stream_dict.total_batches} COMPLETE{NL}" +
+        f"BYTES: {batch_bytes}, RECORDS: {len(batch)}"
+    )
+    return batches_built
+
+
 def flatten(nested, parent_key='', sep='__'):
     items = []
     for key, val in nested.items():
@@ -418,21 +642,186 @@ def flatten(nested, parent_key='', sep='__'):
     return dict(items)
 
 
-def persist_records(incoming_stream=None, config=None, batch_lims=None):
-    batch, schemas, validators = [], {}, {}
-    max_records = batch_lims.max_records
-    stream_dict = StreamProps()
+def parse_lines(incoming_stream=None):
+    """Yields each serialized Singer message line as a dict"""
+
     for line in incoming_stream:
         try:
             obj = json.loads(line)
-            LOGGER.info(
-                f"LINE: {obj}"
-            )
         except json.decoder.JSONDecodeError:
             LOGGER.error(
                 f"UNABLE TO PARSE: {line}"
             )
             raise
+        yield obj
+
+
+def expand_record_batches(messages=None):
+    """Yields columnar RECORD_BATCH messages as the RECORD messages they contain,
+    passing every other message through unchanged
+    """
+
+    for obj in messages:
+        if obj.get('type') != 'RECORD_BATCH':
+            yield obj
+            continue
+        columns = obj.get('columns')
+        envelope = {
+            'type': 'RECORD',
+            'stream': obj.get('stream'),
+            'version': obj.get('version'),
+            'time_extracted': obj.get('time_extracted')
+        }
+        LOGGER.info(
+            f"RECORD_BATCH OF {len(obj.get('rows'))} ROWS FOR STREAM {obj.get('stream')}"
+        )
+        for row in obj.get('rows'):
+            record_obj = dict(envelope)
+            record_obj['record'] = dict(zip(columns, row))
+            yield record_obj
+
+
+def check_payload_schema(stream=None, schema=None, stream_config=None):
+    """Raises unless a SCHEMA shaped by the tap maps the same primary key
+    and attributes as this config, as its records are sent verbatim
+    """
+
+    shaped = schema.get(PAYLOAD_SCHEMA_KEY)
+    shaped = shaped if isinstance(shaped, dict) else {}
+    expected = {
+        'primary_key': stream_config.get('primary_key'),
+        'field_mappings': stream_config.get('field_mappings') or {}
+    }
+    mismatched = [key for key, val in expected.items() if shaped.get(key) != val]
+    if mismatched:
+        raise TargetPendoException(
+            f"PAYLOADS SHAPED BY THE TAP FOR {stream} DO NOT MATCH THE TARGET CONFIG'S {mismatched}{NL}"
+            + f"SHAPED: {shaped}{NL}"
+            + f"CONFIG: {expected}"
+        )
+
+
+def transform_record(tap_record=None, primary_key=None, field_mappings=None):
+    """Maps a tap record to the Pendo Bulk POST Request Structure:
+    {pkey: 'key', 'values': {targ_attr_1: 'val1', targ_attr_2: 'val2'...}}
+    """
+
+    record = flatten(tap_record)
+    if field_mappings:
+        # check for matching attribute names
+        for targ_attr, tap_attr in field_mappings.items():
+            if tap_attr not in record:
+                # e.g. the tap's STREAMS or --project_columns config drifted from this config
+                raise TargetPendoException(
+                    f"RECORD HAS NO {tap_attr} FOR PENDO ATTRIBUTE {targ_attr}: {sorted(record)}"
+                )
+            fields_match = bool(targ_attr == tap_attr)
+            # if tap-target attr names are identical,
+            # modify attr name to prevent both from
+            # being deleted after passing val
+            if fields_match:
+                tap_attr_tmp = tap_attr + '_tmp'
+                record[tap_attr_tmp] = record[tap_attr]
+                tap_attr = tap_attr_tmp
+            record[targ_attr] = record[tap_attr]
+            # checking for correct dtype mapping
+            targ_attr_string = isinstance(record[targ_attr], str)
+            tap_attr_int = isinstance(record[tap_attr], int)
+            if targ_attr_string and tap_attr_int:
+                record[targ_attr] = str(record[tap_attr])
+            del record[tap_attr]
+    # preparing request body for Client-defined structure
+    val_keys = set(record.keys()) - set(primary_key)
+    # creates the set of values for that account/user
+    values = {key: record[key] for key in val_keys}
+    record['values'] = values
+    for key in val_keys:
+        del record[key]
+    return record
+
+
+def oldest_unbatched(streams=None):
+    """Returns the ordinal of the oldest received record, of any stream, not yet in a built batch"""
+
+    floors = [stream_dict.unbatched() for stream_dict in streams.values()]
+    floors = [floor for floor in floors if floor is not None]
+    return min(floors) if floors else None
+
+
+def hand_over(batch_lims=None, stream_dict=None):
+    """Hands the stream's assembled batch to the dispatcher and starts a new one,
+    blocking while too many handed-over batches are unsent
+    """
+
+    StreamProps.dispatcher.acquire()
+    StreamProps.dispatcher.call(dispatch_batch, stream_dict.batch, batch_lims, stream_dict)
+    stream_dict.batch = Batch(primary_key=stream_dict.primary_key[0])
+    stream_dict.batch_floor = None
+
+
+def batch_records(staged=None, batch_lims=None, stream_dict=None):
+    """Adds (ordinal, record) pairs to the stream's batch, handing over full batches"""
+
+    for ordinal, record in staged:
+        if StreamProps.change_index is not None:
+            # None when Pendo already has every value of the record
+            record = StreamProps.change_index.diff(
+                stream_dict.stream, stream_dict.kind, record, stream_dict.primary_key[0]
+            )
+            if record is None:
+                continue
+        if not stream_dict.batch:
+            stream_dict.batch_floor = ordinal
+        stream_dict.batch.append(record)
+        # check current batch against batch constraints w/ each append
+        batch_status = check_batch(
+            stream_dict.batch, batch_lims, stream_dict
+        )
+        batch_full = batch_status.get('byte_limit') or batch_status.get('record_limit')
+        if batch_full:
+            hand_over(batch_lims, stream_dict)
+            LOGGER.info(
+                f"BUILDING NEXT BATCH FOR {stream_dict.stream}"
+            )
+
+
+def finish_stream(batch_lims=None, stream_dict=None):
+    """Hands over the stream's last records and schedules its completion"""
+
+    coalescer = stream_dict.coalescer
+    if coalescer is not None:
+        batch_records(coalescer.drain(), batch_lims, stream_dict)
+        coalescer.log_stats(stream_dict.stream)
+    # the last records may have been skipped, leaving nothing to build
+    if stream_dict.batch:
+        hand_over(batch_lims, stream_dict)
+    stream_dict.done = StreamProps.dispatcher.submit(complete_stream(batch_lims, stream_dict))
+    return stream_dict.done
+
+
+def persist_records(incoming_stream=None, config=None, batch_lims=None):
+    """Persists serialized Singer messages read line by line from a tap"""
+
+    return persist_messages(parse_lines(incoming_stream), config, batch_lims)
+
+
+def persist_messages(messages=None, config=None, batch_lims=None):
+    """Batches and sends Singer messages, given as dicts, to Pendo.
+    Streams may interleave; each gets its own StreamProps and batch
+    """
+
+    streams, versions, validators, finishing = {}, {}, {}, []
+    state = None
+    for obj in expand_record_batches(messages):
+        if obj.get('type') != 'RECORD':
+            LOGGER.info(
+                f"LINE: {obj}"
+            )
+        elif LOGGER.isEnabledFor(logging.DEBUG):
+            # per record, so only formatted w/ --verbose
+            LOGGER.debug(
+                f"LINE: {obj}"
+            )
         try:
             msg_type = obj.get('type')
         except KeyError as err:
@@ -450,10 +839,11 @@ def persist_records(incoming_stream=None, config=None, batch_lims=None):
                 has_version
             ])
             if meets_all:
-                current_stream = stream_dict.stream = obj.get('stream')
-                current_version = stream_dict.version = obj.get('version')
+                current_version = versions[obj.get('stream')] = obj.get('version')
+                if obj.get('stream') in streams:
+                    streams[obj.get('stream')].version = current_version
                 LOGGER.info(
-                    f"CURRENT STREAM: {current_stream}{NL}" +
+                    f"STREAM: {obj.get('stream')}{NL}" +
                     f"CURRENT VERSION: {current_version}"
                 )
             elif not has_stream:
@@ -466,29 +856,28 @@ def persist_records(incoming_stream=None, config=None, batch_lims=None):
                 )
         elif msg_type == 'VOLUME':
             has_count = bool(obj.get('count'))
-            stream_match = bool(obj.get('stream') == current_stream)
+            stream_dict = streams.get(obj.get('stream'))
             meets_all = all([
                 has_count,
-                stream_match
+                stream_dict is not None
             ])
             if meets_all:
                 total_records = stream_dict.total_records = obj.get('count')
-                total_batches = stream_dict.total_batches = ceil(total_records / max_records)
-                StreamProps.int_key = config.get('integration_key')
+                # estimate, batch_lims.max_records changes under adaptive sizing
+                total_batches = stream_dict.total_batches = ceil(total_records / batch_lims.max_records)
                 LOGGER.info(
                     f"{total_records} TOTAL RECORDS{NL}" +
-                    f"{total_batches} TOTAL BATCHES IN STREAM {current_stream}"
+                    f"{total_batches} TOTAL BATCHES IN STREAM {stream_dict.stream}"
                 )
         elif msg_type == 'RECORD':
             has_record = bool(obj.get('record'))
             has_stream = bool(obj.get('stream'))
-            stream_match = bool(obj.get('stream') == current_stream)
-            version_match = bool(obj.get('version') == current_version)
-            schema_match = bool(obj.get('stream') in schemas)
+            stream_dict = streams.get(obj.get('stream'))
+            schema_match = bool(stream_dict is not None)
+            version_match = bool(obj.get('version') == versions.get(obj.get('stream')))
             meets_all = all([
                 has_record,
                 has_stream,
-                stream_match,
                 version_match,
                 schema_match
             ])
@@ -501,95 +890,57 @@ def persist_records(incoming_stream=None, config=None, batch_lims=None):
                     raise Exception(
                         f"THE MESSAGE {obj} IS MISSING REQUIRED KEY 'STREAM'"
                     )
-                if not stream_match:
+                if not schema_match:
                     raise Exception(
-                        f"EXCEPTION FROM COMMINGLED STREAMS{NL}"
-                        + f"Stream IN RECORD LINE: {obj.get('stream')}{NL}"
-                        + f"CURRENT STREAM: {current_stream}"
+                        f"A RECORD FOR STREAM {obj.get('stream')}{NL}" +
+                        "ENCOUNTERED BEFORE CORRESPONDING SCHEMA"
                     )
                 if not version_match:
                     raise Exception(
-                        f"EXCEPTION FROM COMMINGLED Streams{NL}"
+                        f"EXCEPTION FROM MISMATCHED VERSIONS{NL}"
                         + f"VERSION IN RECORD LINE: {obj.get('version')}{NL}"
-                        + f"CURRENT VERSION: {current_version}"
-                    )
-                if not schema_match:
-                    raise Exception(
-                        f"A RECORD FOR STREAM {obj.get('stream')}{NL}" +
-                        "ENCOUNTERED BEFORE CORRESPONDING SCHEMA"
+                        + f"CURRENT VERSION OF {obj.get('stream')}: {versions.get(obj.get('stream'))}"
                     )
             elif meets_all:
                 record_count = stream_dict.add_record()
+                RECORDS_READ.inc(stream=stream_dict.stream)
                 validators[obj['stream']].validate(obj['record'])
-                LOGGER.info(
-                    f"RECORD {record_count} OF {total_records}{NL}" +
-                    f"for STREAM {current_stream}: VERSION {current_version}"
-                )
-                # TODO: write in-line documentation for this section and clean-up
-                # TODO: create separate function for key mappings/swap
-                record = flatten(obj.get('record'))
-                if field_mappings:
-                    # check for matching attribute names
-                    for targ_attr, tap_attr in field_mappings.items():
-                        fields_match = bool(targ_attr == tap_attr)
-                        # if tap-target attr names are identical,
-                        # modify attr name to prevent both from
-                        # being deleted after passing val
-                        if fields_match:
-                            tap_attr_tmp = tap_attr + '_tmp'
-                            record[tap_attr_tmp] = record[tap_attr]
-                            tap_attr = tap_attr_tmp
-                        record[targ_attr] = record[tap_attr]
-                        # checking for correct dtype mapping
-                        targ_attr_string = isinstance(record[targ_attr], str)
-                        tap_attr_int = isinstance(record[tap_attr], int)
-                        if targ_attr_string and tap_attr_int:
-                            record[targ_attr] = str(record[tap_attr])
-                        del record[tap_attr]
-                # preparing request body for Client-defined structure
-                # Pendo Bulk POST Request Structure:
-                # {pkey: 'key', 'values': {targ_attr_1: 'val1', targ_attr_2: 'val2'...}}
-                val_keys = set(record.keys()) - set(primary_key)
-                # creates the set of values for that account/user
-                values = {key: record[key] for key in val_keys}
-                record['values'] = values
-                for key in val_keys:
-                    del record[key]
-                batch.append(record)
-                batch_bytes = sum(sys.getsizeof(record) for record in batch)
-                batch_records = len(batch)
-                # check current batch against batch constraints w/ each append
-                batch_status = check_batch(
-                    batch, batch_lims, stream_dict
-                )
-                limiters = list(batch_status.values())
-                batch_done = any(limiters)
-                if batch_done:
-                    batches_built = stream_dict.add_pending(batch)
-                    batch = []  # we clear batch again after append to pending
-                    LOGGER.info(
-                        f"BATCH BUILD {batches_built} OF {total_batches} COMPLETE{NL}" +
-                        f"BYTES: {batch_bytes}, RECORDS: {batch_records}"
+                if LOGGER.isEnabledFor(logging.DEBUG):
+                    LOGGER.debug(
+                        f"RECORD {record_count} OF {stream_dict.total_records}{NL}" +
+                        f"for STREAM {stream_dict.stream}: VERSION {stream_dict.version}"
                     )
-                    done_batching = batch_status.get('last_record')
-                    if done_batching:
-                        asyncio.run(handle_requests(batch_lims, stream_dict))
-                        asyncio.run(finish_requests(session=None, stream_dict=stream_dict))
-                        stream_dict = StreamProps()
-                    else:
-                        LOGGER.info(
-                            f"BUILDING BATCH {batches_built + 1}"
-                        )
+                if stream_dict.shaped:
+                    # tap shaped the record in SQL, so it is sent verbatim
+                    record = obj.get('record')
+                else:
+                    record = transform_record(obj.get('record'), stream_dict.primary_key, stream_dict.field_mappings)
+                StreamProps.records_received += 1
+                ordinal = StreamProps.records_received
+                # records leave the coalescer once their key is evicted
+                # from its window or the stream's last record is received
+                coalescer = stream_dict.coalescer
+                staged = coalescer.add(record, ordinal) if coalescer is not None else [(ordinal, record)]
+                batch_records(staged, batch_lims, stream_dict)
+                if record_count == stream_dict.total_records:
+                    finishing.append(finish_stream(batch_lims, stream_dict))
+                    del streams[stream_dict.stream]
+                if staged or record_count == stream_dict.total_records:
+                    # states whose records are now all in built batches
+                    # wait on those batches' acknowledgements
+                    StreamProps.dispatcher.call(bind_states, oldest_unbatched(streams))
             else:
                 LOGGER.critical("UNSUPPORTED STREAM")
             state = None
         elif msg_type == 'STATE':
             has_value = bool(obj.get('value'))
             if has_value:
-                state = stream_dict.state = obj.get('value')
-                emit_state(state)
+                state = obj.get('value')
+                # emitted once every record received before it is acknowledged
+                StreamProps.dispatcher.call(hold_state, state, StreamProps.records_received)
+                StreamProps.dispatcher.call(bind_states, oldest_unbatched(streams))
                 LOGGER.info(
-                    f"SETTING STATE TO {state}"
+                    f"HOLDING STATE {state}"
                 )
         elif msg_type == 'SCHEMA':
             has_stream = bool(obj.get('stream'))
@@ -599,12 +950,26 @@ def persist_records(incoming_stream=None, config=None, batch_lims=None):
                 has_schema
             ])
             if meets_all:
-                current_stream = stream_dict.stream = obj.get('stream')
-                current_schema = schemas[current_stream] = obj.get('schema')
+                current_stream = obj.get('stream')
+                current_schema = obj.get('schema')
+                stream_dict = streams.get(current_stream)
+                if stream_dict is None:
+                    stream_dict = streams[current_stream] = StreamProps()
+                    stream_dict.stream = current_stream
+                    stream_dict.version = versions.get(current_stream)
                 primary_key = stream_dict.primary_key = [config.get(current_stream).get('primary_key')]
-                field_mappings = stream_dict.field_mappings = config.get(current_stream).get('field_mappings')
+                stream_dict.field_mappings = config.get(current_stream).get('field_mappings')
+                stream_dict.kind = Endpoints(current_stream).kind
+                if not stream_dict.batch:
+                    # indexes records by primary key as the batch is assembled
+                    stream_dict.batch = Batch(primary_key=primary_key[0])
+                if StreamProps.coalesce_window is not None and stream_dict.coalescer is None:
+                    stream_dict.coalescer = coalesce.Coalescer(primary_key[0], StreamProps.coalesce_window)
+                stream_dict.shaped = bool(current_schema.get(PAYLOAD_SCHEMA_KEY))
+                if stream_dict.shaped:
+                    check_payload_schema(current_stream, current_schema, config.get(current_stream))
                 LOGGER.info(
-                    f"CURRENT SCHEMA: {current_schema}"
+                    f"CURRENT SCHEMA FOR {current_stream}: {current_schema}"
                 )
             elif not has_stream:
                 raise Exception(
@@ -619,6 +984,19 @@ def persist_records(incoming_stream=None, config=None, batch_lims=None):
             raise Exception(
                 f"UNKNOWN MESSAGE TYPE {obj.get('type')} IN MESSAGE {obj}"
             )
+    for stream_dict in list(streams.values()):
+        if stream_dict.record_count:
+            # expected without a VOLUME, e.g. for a shard of a stream
+            log = LOGGER.warning if stream_dict.total_records else LOGGER.info
+            log(
+                f"INPUT ENDED AFTER {stream_dict.record_count} OF "
+                + f"{stream_dict.total_records} RECORDS FOR {stream_dict.stream}, SENDING THOSE RECEIVED"
+            )
+            finishing.append(finish_stream(batch_lims, stream_dict))
+            del streams[stream_dict.stream]
+    StreamProps.dispatcher.call(bind_states, oldest_unbatched(streams))
+    for done in finishing:
+        done.result()
     return state
 
 
@@ -632,7 +1010,30 @@ def handle_args():
     parser.add_argument('--batch_records', type=int, help='Constraint: max # of records per batch')
     parser.add_argument('--request_delay', type=float, help='Time(sec,float) to sleep btw requests')
     parser.add_argument('--rate_limit', type=int, help='Constraint: max # of requests per second')
+    parser.add_argument('--pendo_url', help='Base URL of the Pendo API, e.g. a local mock server')
+    parser.add_argument('--rate_budget', help='SQLite file sharing the rate limit w/ other processes on the host')
     parser.add_argument('--attempts', type=int, help='Constraint: max # of requests upon failure')
+    parser.add_argument('--max_outstanding', type=int, help='Constraint: max # of batches waiting to be sent')
+    parser.add_argument('--adaptive_batching', help='Adapt records per batch to Pendo latency', action='store_true')
+    parser.add_argument('--latency_target', type=float, help='Adaptive batching: p95 request latency (sec) to stay under')
+    parser.add_argument('--min_batch_records', type=int, help='Adaptive batching: min # of records per batch')
+    parser.add_argument('--max_batch_records', type=int, help='Adaptive batching: max # of records per batch')
+    parser.add_argument('--hedge', help='Duplicate requests in flight past the hedge percentile', action='store_true')
+    parser.add_argument('--hedge_percentile', type=float, default=95, help='Hedging: latency percentile to hedge after')
+    parser.add_argument('--hedge_rate', type=float, default=0.1, help='Hedging: max share of requests hedged')
+    parser.add_argument('--change_index', help='SQLite file of sent values, skips unchanged records')
+    parser.add_argument('--coalesce_window', type=int, help='Max # of keys held to merge duplicates, 0 for whole run')
+    parser.add_argument('--spool_dir', help='Directory for the write-ahead spool of built batches')
+    parser.add_argument('--spool_memory_batches', type=int, help='Max # of spooled batches held in memory')
+    parser.add_argument('--dead_letter', default=retry.DEAD_LETTER_FILE,
+                        help='NDJSON file for records that exhausted their attempts')
+    parser.add_argument('--replay_dead_letter', help='NDJSON dead-letter file to send again before syncing')
+    parser.add_argument('--shards', type=int, help='# of worker processes to send on, split by primary key')
+    parser.add_argument('--work_dir', help='Shared directory batches are handed to --worker processes through')
+    parser.add_argument('--worker', help='Send batches claimed from --work_dir instead of reading input', action='store_true')
+    parser.add_argument('--lease_ttl', type=float, help='Work dir: sec a claimed batch may go unrenewed')
+    parser.add_argument('--metrics_port', type=int, help='Local port to serve Prometheus /metrics on, shard N on port + N')
+    parser.add_argument('--metrics_file', help='File to write Prometheus metrics to at exit, shard N to FILE.shard-N')
     parser.add_argument('-v', '--verbose', help='Produce debug-level logging', action='store_true')
     parser.add_argument('-q', '--quiet', help='Suppress warning-level logging', action='store_true')
     args = parser.parse_args()
@@ -650,7 +1051,110 @@ def handle_args():
         )
     defaults = DefaultArgs()
     batch_lims = BatchArgs(args, defaults)
-    return {'config': config_args, 'batch_lims': batch_lims}
+    return {'config': config_args, 'batch_lims': batch_lims, 'args': args}
+
+
+def configure_streams(config=None, args=None, batch_lims=None):
+    """Sets the properties shared by every stream of the sync"""
+
+    # Listing all streams in target_config.json streams
+    StreamProps.all_streams = list(set(list(config.keys())) - set({'integration_key'}))
+    if args.change_index:
+        StreamProps.change_index = change_index.ChangeIndex(args.change_index)
+    StreamProps.coalesce_window = args.coalesce_window
+    StreamProps.int_key = config.get('integration_key')
+    if args.pendo_url:
+        Endpoints.base = args.pendo_url.rstrip('/')
+    StreamProps.rate_limit = batch_lims.rate_limit
+    StreamProps.rate_budget = args.rate_budget
+    StreamProps.dispatcher = dispatch.Dispatcher(httpx.AsyncClient, batch_lims.max_outstanding)
+    StreamProps.dead_letter = retry.DeadLetter(args.dead_letter)
+    if args.metrics_port and telemetry.REGISTRY.server is None:
+        telemetry.REGISTRY.serve(args.metrics_port)
+        LOGGER.info(f"SERVING METRICS @ http://127.0.0.1:{args.metrics_port}/metrics")
+    StreamProps.metrics_file = args.metrics_file
+    if args.hedge:
+        StreamProps.hedger = hedging.Hedger(args.hedge_percentile, args.hedge_rate)
+    if args.adaptive_batching:
+        StreamProps.sizer = sizing.BatchSizer(
+            batch_lims, batch_lims.min_batch_records, batch_lims.max_batch_records, batch_lims.latency_target
+        )
+    if args.spool_dir:
+        StreamProps.spool = spool.BatchSpool(args.spool_dir, args.spool_memory_batches)
+        StreamProps.last_seq = StreamProps.spool.last_seq
+    # replayed batches belong to states a previous run never emitted
+    StreamProps.watermark = watermark.StateWatermark(StreamProps.last_seq)
+    if args.work_dir and not args.worker:
+        work_dir = workqueue.WorkDir(args.work_dir, args.lease_ttl or workqueue.LEASE_TTL)
+        # batches left by a previous coordinator are replayed from its spool
+        work_dir.reset()
+        StreamProps.work_queue = workqueue.WorkQueue(work_dir)
+    if StreamProps.spool is not None:
+        for stream, unacked in StreamProps.spool.unacked().items():
+            LOGGER.info(
+                f"REPLAYING {len(unacked)} SPOOLED BATCHES FOR {stream}"
+            )
+            replay_batches(stream, unacked, config, batch_lims)
+    if args.replay_dead_letter:
+        for stream, records in retry.read_dead_letter(args.replay_dead_letter).items():
+            max_records = batch_lims.max_records
+            batches = [records[start:start + max_records] for start in range(0, len(records), max_records)]
+            replay_batches(stream, batches, config, batch_lims, build=True)
+
+
+def replay_batches(stream=None, batches=None, config=None, batch_lims=None, build=False):
+    """Sends batches left over by a previous run before syncing,
+    building them first when they hold records rather than built batches
+    """
+
+    if stream not in config:
+        LOGGER.warning(
+            f"SKIPPING {len(batches)} BATCHES FOR UNCONFIGURED STREAM {stream}"
+        )
+        return
+    stream_dict = StreamProps()
+    stream_dict.stream = stream
+    stream_dict.primary_key = [config.get(stream).get('primary_key')]
+    if build:
+        for batch in batches:
+            build_batch(batch, stream_dict)
+    else:
+        stream_dict.pending_requests = batches
+        BATCHES_UNACKED.inc(len(batches), stream=stream)
+    StreamProps.dispatcher.run(handle_requests(batch_lims, stream_dict))
+    if stream_dict.retries is not None:
+        stream_dict.retries.log_stats()
+
+
+def close_streams():
+    """Closes the dispatcher and the files shared by every stream"""
+
+    if StreamProps.work_queue is not None:
+        # lets the workers exit once every batch is acknowledged
+        StreamProps.dispatcher.run(StreamProps.work_queue.close())
+    if StreamProps.dispatcher is not None:
+        StreamProps.dispatcher.close()
+    for shared in (StreamProps.spool, StreamProps.change_index, StreamProps.dead_letter):
+        if shared is not None:
+            shared.close()
+    for request_limiter in StreamProps.limiters.values():
+        if isinstance(request_limiter.bucket, limiter.SharedTokenBucket):
+            request_limiter.bucket.close()
+    telemetry.REGISTRY.log_summary(LOGGER)
+    if StreamProps.metrics_file:
+        telemetry.REGISTRY.write(StreamProps.metrics_file)
+    telemetry.REGISTRY.close()
+
+
+def check_delivered():
+    """Raises if a built batch was never resolved, as no STATE past it was emitted"""
+
+    watermark = StreamProps.watermark
+    unresolved = StreamProps.last_seq - watermark.contiguous - len(watermark.acked)
+    if unresolved > 0:
+        raise TargetPendoException(
+            f"{unresolved} BATCHES WERE NEVER RESOLVED, STATES PAST BATCH #{watermark.contiguous} NOT EMITTED"
+        )
 
 
 def check_recursion(r_max=R_MAX):
@@ -669,12 +1173,24 @@ def check_recursion(r_max=R_MAX):
 
 def main_impl():
     check_recursion()
-    config = handle_args().get('config')
-    batch_lims = handle_args().get('batch_lims')
-    # Listing all streams in target_config.json streams
-    StreamProps.all_streams = list(set(list(config.keys())) - set({'integration_key'}))
-    incoming_stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    target_args = handle_args()
+    config = target_args.get('config')
+    batch_lims = target_args.get('batch_lims')
+    args = target_args.get('args')
+    if args.worker:
+        if not args.work_dir:
+            raise TargetPendoException("--worker REQUIRES --work_dir")
+        workqueue.run_worker(config, args, batch_lims)
+        return
+    incoming_stream = compression.open_input(sys.stdin.buffer)
+    if args.shards and args.shards > 1:
+        # each worker configures its own streams, dispatcher and client
+        sharding.run_sharded(incoming_stream, config, args, batch_lims, args.shards)
+        return
+    configure_streams(config, args, batch_lims)
     persist_records(incoming_stream, config, batch_lims)
+    close_streams()
+    check_delivered()
 
 
 def main():
@@ -685,7 +1201,7 @@ def main():
     except TargetPendoException as exc:
         for line in str(exc).splitlines():
             LOGGER.critical(line)
-        sys.exit()
+        sys.exit(1)
     except Exception as exc:
         LOGGER.critical(exc)
         raise exc
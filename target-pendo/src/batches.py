@@ -0,0 +1,40 @@
+"""Batches of Pendo request bodies built from a stream's records."""
+
+
+class Batch(list):
+    """List of request bodies sent to Pendo in a single POST
+    * seq: sequence number of the batch, unique across all streams of a run
+    * stream: name of the stream the records belong to
+    * primary_key: Pendo key the positions index is built on
+    * positions: primary key value -> positions of its records in the batch
+    """
+
+    def __init__(self, records=(), seq=None, stream=None, primary_key=None):
+        super().__init__()
+        self.seq = seq
+        self.stream = stream
+        self.primary_key = primary_key
+        self.positions = {}
+        for record in records:
+            self.append(record)
+
+    def append(self, record):
+        if self.primary_key is not None:
+            self.positions.setdefault(record.get(self.primary_key), []).append(len(self))
+        super().append(record)
+
+    def index_on(self, primary_key=None):
+        """(Re)builds the positions index, for batches read back or regrouped without one"""
+
+        self.primary_key = primary_key
+        self.positions = {}
+        for pos, record in enumerate(self):
+            self.positions.setdefault(record.get(primary_key), []).append(pos)
+        return self.positions
+
+    def positions_of(self, key=None, primary_key=None):
+        """Returns the positions of the records with the given primary key value"""
+
+        if primary_key != self.primary_key:
+            self.index_on(primary_key)
+        return self.positions.get(key, [])
@@ -0,0 +1,111 @@
+"""On-disk index of the values last sent to Pendo, used to skip unchanged records.
+
+A digest of every attribute value Pendo acknowledged is kept per
+(kind, primary key, attribute) in a local SQLite file. Records whose values
+all match the index are skipped; records with some changed attributes are
+sent with only those attributes. The index is updated only after Pendo has
+accepted the batch containing the record. Records are diffed on the
+reading thread and committed in worker threads, off the dispatch loop, so
+the connection is guarded by a lock.
+"""
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+VALUES_KEY = 'values'
+
+
+def value_digest(val=None):
+    """Stable digest of a single attribute value"""
+
+    encoded = json.dumps(val, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+class ChangeIndex:
+    """ * path: SQLite file holding digests of acknowledged attribute values
+        * stats: per-stream Counter of records seen, skipped and partially sent
+        """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS sent_values ('
+            'kind TEXT NOT NULL, pkey TEXT NOT NULL, attr TEXT NOT NULL, digest TEXT NOT NULL, '
+            'PRIMARY KEY (kind, pkey, attr)) WITHOUT ROWID'
+        )
+        self.conn.commit()
+        self.stats = {}
+        LOGGER.info(f"OPENED CHANGE INDEX @ {path}")
+
+    def sent_digests(self, kind=None, pkey=None):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT attr, digest FROM sent_values WHERE kind = ? AND pkey = ?',
+                (kind, str(pkey))
+            )
+            return dict(rows)
+
+    def diff(self, stream=None, kind=None, record=None, primary_key=None):
+        """Returns the record reduced to its changed values, or None if unchanged"""
+
+        stats = self.stats.setdefault(stream, Counter())
+        stats['seen'] += 1
+        values = record.get(VALUES_KEY) or {}
+        sent = self.sent_digests(kind, record.get(primary_key))
+        if not sent:
+            return record
+        changed = {
+            attr: val for attr, val in values.items()
+            if sent.get(attr) != value_digest(val)
+        }
+        if not changed:
+            stats['skipped'] += 1
+            return None
+        if len(changed) < len(values):
+            stats['partial'] += 1
+            return {primary_key: record.get(primary_key), VALUES_KEY: changed}
+        return record
+
+    def commit(self, kind=None, records=None, primary_key=None, failed_ids=()):
+        """Stores digests for the records Pendo accepted"""
+
+        failed_ids = set(failed_ids)
+        rows = [
+            (kind, str(record.get(primary_key)), attr, value_digest(val))
+            for record in records if record.get(primary_key) not in failed_ids
+            for attr, val in (record.get(VALUES_KEY) or {}).items()
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO sent_values (kind, pkey, attr, digest) VALUES (?, ?, ?, ?)',
+                rows
+            )
+        return len(rows)
+
+    def skip_rate(self, stream=None):
+        stats = self.stats.get(stream, Counter())
+        if not stats['seen']:
+            return 0.0
+        return round((stats['skipped'] / stats['seen']) * 100, 2)
+
+    def log_stats(self, stream=None):
+        stats = self.stats.get(stream, Counter())
+        LOGGER.info(
+            f"CHANGE INDEX FOR {stream}: {stats['seen']} RECORDS SEEN{NL}"
+            + f"{stats['skipped']} UNCHANGED RECORDS SKIPPED ({self.skip_rate(stream)}%){NL}"
+            + f"{stats['partial']} RECORDS SENT WITH CHANGED ATTRIBUTES ONLY"
+        )
+        return stats
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,65 @@
+"""Coalesces records that share a primary key before they are batched.
+
+Pendo applies metadata updates last-write-wins, so only the latest value of
+each attribute per primary key needs to be sent. Records are held in
+first-seen order; a later record for a held key merges its values into the
+held record. Records leave the coalescer when the window of held keys is
+full (oldest first) or when the stream's last record has been received.
+Each held record keeps the ordinal of its first-seen record, so callers can
+tell which received records are still waiting to be batched.
+"""
+from collections import OrderedDict
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+VALUES_KEY = 'values'
+
+
+class Coalescer:
+    """ * primary_key: Pendo key of the stream's records, e.g. 'accountId'
+        * window: max # of distinct keys held, 0 or None holds the whole run
+        """
+
+    def __init__(self, primary_key=None, window=None):
+        self.primary_key = primary_key
+        self.window = window or None
+        self.held = OrderedDict()
+        self.received = 0
+        self.emitted = 0
+
+    def add(self, record=None, ordinal=None):
+        """Holds the record, returning the (ordinal, record) pairs evicted to make room"""
+
+        self.received += 1
+        key = record.get(self.primary_key)
+        held = self.held.get(key)
+        if held is not None:
+            held[1][VALUES_KEY].update(record.get(VALUES_KEY) or {})
+            return []
+        self.held[key] = (ordinal, record)
+        if self.window and len(self.held) > self.window:
+            _, evicted = self.held.popitem(last=False)
+            self.emitted += 1
+            return [evicted]
+        return []
+
+    def drain(self):
+        """Returns every held (ordinal, record) pair, oldest first"""
+
+        drained = list(self.held.values())
+        self.held.clear()
+        self.emitted += len(drained)
+        return drained
+
+    def oldest(self):
+        """Returns the ordinal of the oldest held record, if any"""
+
+        oldest = next(iter(self.held.values()), None)
+        return oldest[0] if oldest is not None else None
+
+    def log_stats(self, stream=None):
+        LOGGER.info(
+            f"COALESCED {self.received} RECORDS TO {self.emitted} FOR {stream}{NL}"
+            + f"{self.received - self.emitted} DUPLICATE KEY UPDATES MERGED"
+        )
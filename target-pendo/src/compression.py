@@ -0,0 +1,88 @@
+"""Auto-detection and decoding of compressed tap output on stdin.
+
+tap-redshift --compress writes one gzip member or zstd frame, flushed at
+every STATE message. Input is decoded incrementally with read1() so lines
+are handed to the target as soon as their block arrives rather than when
+a full read buffer fills up.
+"""
+import io
+import time
+import zlib
+from target_pendo.logger import SyncLogger
+from target_pendo.exceptions import TargetPendoException
+
+try:
+    import zstandard
+except ImportError:  # zstd framing is optional, gzip is always available
+    zstandard = None
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+CHUNK_BYTES = 65536
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+GZIP_WBITS = 31  # zlib window bits for a gzip header and trailer
+
+
+def detect_method(raw=None):
+    """Peeks at the head of a buffered binary stream for a compression magic number"""
+
+    head = raw.peek(len(ZSTD_MAGIC))
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    elif head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def get_decompressor(method=None):
+    if method == 'gzip':
+        return zlib.decompressobj(GZIP_WBITS)
+    elif method == 'zstd':
+        if zstandard is None:
+            raise TargetPendoException(
+                "ZSTD COMPRESSED INPUT REQUIRES THE 'zstandard' PACKAGE"
+            )
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise TargetPendoException(
+        f"COMPRESSION METHOD {method} IS NOT SUPPORTED"
+    )
+
+
+def decompressed_lines(raw=None, method=None):
+    """Yields decoded lines from a compressed binary stream"""
+
+    decompressor = get_decompressor(method)
+    bytes_in, bytes_out, decompress_time = 0, 0, 0.0
+    pending = b''
+    while True:
+        chunk = raw.read1(CHUNK_BYTES)
+        if not chunk:
+            break
+        start = time.perf_counter()
+        data = decompressor.decompress(chunk)
+        decompress_time += time.perf_counter() - start
+        bytes_in += len(chunk)
+        bytes_out += len(data)
+        lines = (pending + data).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8')
+    if pending.strip():
+        yield pending.decode('utf-8')
+    ratio = round(bytes_out / bytes_in, 2) if bytes_in else None
+    LOGGER.info(
+        f"{method.upper()} DECOMPRESSED {bytes_in} BYTES TO {bytes_out} BYTES{NL}"
+        + f"COMPRESSION RATIO: {ratio}{NL}"
+        + f"TIME SPENT DECOMPRESSING: {round(decompress_time, 3)} SECONDS"
+    )
+
+
+def open_input(raw=None):
+    """Returns an iterable of lines from raw, decompressing if it is compressed"""
+
+    method = detect_method(raw)
+    if method is None:
+        return io.TextIOWrapper(raw, encoding='utf-8')
+    LOGGER.info(f"DETECTED {method.upper()} COMPRESSED INPUT")
+    return decompressed_lines(raw, method)
@@ -0,0 +1,88 @@
+"""Background event loop that batches are sent to Pendo on.
+
+Messages are read on the main thread while every stream's batches are sent,
+retried and acknowledged on a single event loop in a dispatch thread, so
+interleaved streams keep both Pendo endpoints busy. Everything that touches
+the spool, the state watermark or request stats runs on that loop, and
+work handed over with call() starts in the order it was handed over.
+
+With max_outstanding, acquire() blocks the reading thread while that many
+handed-over batches have yet to be sent, so a slow Pendo pauses reading
+instead of letting built batches pile up in memory.
+"""
+import asyncio
+import threading
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+POLL_SECONDS = 1.0  # how often a blocked acquire() checks for a failed callback
+
+
+class Dispatcher:
+    """ * loop: event loop run by the dispatch thread
+        * session: client shared by every request sent on the loop
+        * error: first exception raised by a call() callback, re-raised on the next call
+        * slots: batches that may be handed over before acquire() blocks, if bounded
+        """
+
+    def __init__(self, session_factory=None, max_outstanding=None):
+        self.slots = threading.BoundedSemaphore(max_outstanding) if max_outstanding else None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='pendo-dispatch', daemon=True)
+        self.thread.start()
+        self.error = None
+        self.session = self.run(self.open(session_factory)) if session_factory else None
+
+    async def open(self, session_factory=None):
+        return session_factory()
+
+    def submit(self, coro=None):
+        """Schedules the coroutine on the loop, returning a concurrent Future"""
+
+        self.check()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro=None):
+        """Runs the coroutine on the loop, blocking until it completes"""
+
+        return self.submit(coro).result()
+
+    def call(self, func=None, *args):
+        """Runs func(*args) on the loop, after everything handed over before it"""
+
+        self.check()
+        self.loop.call_soon_threadsafe(self.guarded, func, *args)
+
+    def acquire(self):
+        """Blocks until a batch may be handed over, raising if a callback failed meanwhile"""
+
+        if self.slots is None:
+            return
+        while not self.slots.acquire(timeout=POLL_SECONDS):
+            self.check()
+
+    def release(self, _future=None):
+        """Frees the slot of a handed-over batch, e.g. as a done callback of its send"""
+
+        if self.slots is not None:
+            self.slots.release()
+
+    def guarded(self, func=None, *args):
+        try:
+            func(*args)
+        except Exception as exc:
+            LOGGER.critical(f"DISPATCH FAILED IN {func.__name__}: {exc!r}")
+            if self.error is None:
+                self.error = exc
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.session is not None:
+            self.run(self.session.aclose())
+            self.session = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -0,0 +1,50 @@
+"""Group commit of appended files, fsynced off the dispatch event loop.
+
+Writers record each write with wrote() and await sync() before relying on
+it. The fsync runs in a worker thread, and one fsync covers every write
+made before it started, so concurrent sends share a single fsync instead
+of each stalling the loop on its own.
+"""
+import os
+import asyncio
+
+
+class GroupSync:
+    """ * file: open file whose writes are synced
+        * written: # of writes recorded
+        * synced: # of writes covered by a completed fsync
+        """
+
+    def __init__(self, file=None):
+        self.file = file
+        self.written = 0
+        self.synced = 0
+        self.syncing = None
+
+    def wrote(self):
+        self.written += 1
+
+    async def sync(self):
+        """Returns once every write recorded before the call is on disk"""
+
+        target = self.written
+        while self.synced < target:
+            if self.syncing is None:
+                self.syncing = asyncio.ensure_future(self.fsync())
+            # shielded, so a cancelled waiter does not cancel the fsync shared w/ others
+            await asyncio.shield(self.syncing)
+
+    async def fsync(self):
+        covered = self.written
+        try:
+            await asyncio.to_thread(os.fsync, self.file.fileno())
+            self.synced = covered
+        finally:
+            self.syncing = None
+
+    def sync_now(self):
+        """Blocking fsync, for use once the event loop has stopped"""
+
+        if self.synced < self.written:
+            os.fsync(self.file.fileno())
+            self.synced = self.written
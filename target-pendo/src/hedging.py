@@ -0,0 +1,90 @@
+"""Hedged requests, so a run does not wait on its single slowest POST.
+
+Metadata value updates are idempotent, so once a request has been in
+flight longer than a rolling percentile of recent latencies, a duplicate
+is sent and the first 2xx response is used. The share of
+requests hedged is capped, and duplicates draw from the same rate budget
+as every other request.
+"""
+import time
+import asyncio
+from collections import deque
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+WINDOW = 200  # recent latencies the percentile is computed over
+MIN_SAMPLES = 20  # latencies observed before any request is hedged
+
+
+class Hedger:
+    """ * percentile: latency percentile after which a duplicate request is sent
+        * max_rate: max share of requests hedged
+        * latencies: rolling window of recent request latencies
+        """
+
+    def __init__(self, percentile=95, max_rate=0.1):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.latencies = deque(maxlen=WINDOW)
+        self.sent = 0
+        self.hedged = 0
+        self.hedges_won = 0
+
+    def delay(self):
+        """Returns the seconds after which a request is hedged, None while warming up"""
+
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def allow(self):
+        return self.hedged < self.sent * self.max_rate
+
+    async def send(self, request=None, throttle=None):
+        """Awaits request(), sending a duplicate after the hedge delay.
+        throttle is awaited before the duplicate is sent
+        """
+
+        self.sent += 1
+        started = time.monotonic()
+        first = asyncio.ensure_future(request())
+        delay = self.delay()
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or not self.allow():
+            response = await first
+            self.latencies.append(time.monotonic() - started)
+            return response
+        self.hedged += 1
+        LOGGER.info(
+            f"REQUEST IN FLIGHT OVER {round(delay, 3)}s (P{self.percentile}), SENDING HEDGE"
+        )
+        if throttle is not None:
+            await throttle()
+        second = asyncio.ensure_future(request())
+        pending = {first, second}
+        try:
+            last = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    last = finished
+                    # a 429, 408 or 5xx may still be beaten by the other request's 2xx
+                    if finished.exception() is None and finished.result().status_code // 100 == 2:
+                        if finished is second:
+                            self.hedges_won += 1
+                        self.latencies.append(time.monotonic() - started)
+                        return finished.result()
+            # neither succeeded, so the last one to finish is returned or raised
+            self.latencies.append(time.monotonic() - started)
+            return last.result()
+        finally:
+            for loser in pending:
+                loser.cancel()
+
+    def log_stats(self):
+        LOGGER.info(
+            f"HEDGED {self.hedged} OF {self.sent} REQUESTS, {self.hedges_won} HEDGES ANSWERED FIRST{NL}"
+            + f"CURRENT HEDGE DELAY: {self.delay()}s"
+        )
@@ -0,0 +1,165 @@
+"""Limits on requests to Pendo, shared by first sends and retries.
+
+Replaces the ratelimit decorator, which counted calls to the coroutine
+function rather than requests, and a semaphore created anew for every
+request. A RequestLimiter caps the requests in flight and draws a token
+from a TokenBucket before each one starts.
+
+Processes sending with the same integration key can share one budget
+through a SharedTokenBucket. Its tokens are kept in a SQLite file that
+every process updates inside a write transaction, so their combined
+request rate stays at the limit instead of each process getting its own.
+Its tokens are taken in a worker thread, as the transaction may wait on
+another process's lock, and a lock held past BUSY_TIMEOUT is retried
+after BUSY_RETRY rather than stalling the event loop.
+"""
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+MAX_CONCURRENCY = 10  # max # of requests in flight
+BUSY_TIMEOUT = 0.5  # seconds a shared bucket waits on another process's write lock
+BUSY_RETRY = 0.05  # seconds before taking from a shared bucket that stayed locked
+
+
+class TokenBucket:
+    """ * rate: tokens added per second
+        * capacity: max # of tokens held, i.e. the largest burst of requests
+        """
+
+    def __init__(self, rate=None, capacity=None):
+        self.rate = rate
+        # a budget under 1 request/sec, e.g. a shard's slice, still needs whole tokens
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Takes a token, returning 0 or the seconds to wait before trying again"""
+
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class SharedTokenBucket:
+    """ * path: SQLite file shared by every process drawing on the budget
+        * key: budget the tokens are drawn from, e.g. per integration key and kind
+        * rate: tokens added per second
+        * capacity: max # of tokens held, i.e. the largest burst of requests
+        """
+
+    def __init__(self, path=None, key=None, rate=None, capacity=None):
+        self.path = path
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        # autocommit, so each take() runs in its own explicit transaction
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()  # takes run in worker threads, one transaction at a time
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID'
+        )
+        LOGGER.info(f"SHARING RATE BUDGET {key} @ {path}")
+
+    def take(self):
+        """Takes a token, returning 0 or the seconds to wait before trying again"""
+
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, so concurrent
+            # processes cannot both read the same token count
+            try:
+                self.conn.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError as exc:
+                LOGGER.debug(f"SHARED RATE BUDGET {self.key} BUSY, RETRYING: {exc}")
+                return BUSY_RETRY
+            return self.take_locked()
+
+    def take_locked(self):
+        # wall clock, as monotonic clocks are not comparable across processes
+        now = time.time()
+        try:
+            row = self.conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (self.key,)).fetchone()
+            tokens, updated = row if row else (self.capacity, now)
+            tokens = min(self.capacity, tokens + max(now - updated, 0) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self.conn.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                (self.key, tokens, now)
+            )
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def close(self):
+        self.conn.close()
+
+
+def budget_key(int_key=None, kind=None):
+    """Names a shared budget without storing the integration key itself"""
+
+    digest = hashlib.sha256((int_key or '').encode('utf-8')).hexdigest()[:16]
+    return f'{digest}:{kind}'
+
+
+class RequestLimiter:
+    """ * concurrency: max # of requests in flight
+        * bucket: token bucket limiting the rate requests are started at, if any
+        """
+
+    def __init__(self, concurrency=MAX_CONCURRENCY, bucket=None):
+        self.concurrency = concurrency
+        self.bucket = bucket
+        self.semaphore = None
+        self.loop = None
+        self.throttled = 0.0  # seconds spent waiting on the bucket
+
+    async def take(self):
+        if isinstance(self.bucket, SharedTokenBucket):
+            # SQLite may wait on other processes, so the take runs off the event loop
+            return await asyncio.to_thread(self.bucket.take)
+        return self.bucket.take()
+
+    def slots(self):
+        # created on the dispatch loop requests run on, as asyncio
+        # primitives can only be used on the loop they bind to
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.semaphore
+
+    async def throttle(self):
+        """Waits for a token, without taking a slot"""
+
+        if self.bucket is None:
+            return
+        wait = await self.take()
+        while wait:
+            self.throttled += wait
+            await asyncio.sleep(wait)
+            wait = await self.take()
+
+    async def __aenter__(self):
+        await self.slots().acquire()
+        await self.throttle()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
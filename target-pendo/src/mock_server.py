@@ -0,0 +1,222 @@
+"""Local stand-in for the Pendo API, for load and fault testing.
+
+Serves the two endpoints the pipeline calls, so every concurrency, batching
+and retry feature can be exercised without reaching app.pendo.io:
+
+    POST /api/v1/metadata/{kind}/{group}/value   answers like Pendo, with
+                                                 total/updated/failed/errors
+    POST /api/v1/aggregation                     returns generated UUID rows
+    GET  /stats                                  request/record counters and
+                                                 value update latency percentiles,
+                                                 estimated from fixed buckets
+
+Point the pipeline at it with --pendo_url, e.g.:
+
+    pendo-mock --port 8089 --latency 0.2 --latency_dist lognormal \\
+        --rate_429 0.02 --rate_5xx 0.01 --record_failure_rate 0.001 --rate_limit 20
+    target-pendo -c target_config.json --pendo_url http://127.0.0.1:8089
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pendo_telemetry as telemetry
+from target_pendo.limiter import TokenBucket
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+VALUE_PATH = re.compile(r'^/api/v1/metadata/(account|visitor)/(agent|custom)/value/?$')
+AGGREGATION_PATH = '/api/v1/aggregation'
+KEY_HEADER = 'X-Pendo-Integration-Key'
+
+
+class Faults:
+    """ * latency: median seconds before a response is sent
+        * latency_dist: 'fixed', 'uniform' (0 to 2x latency) or 'lognormal'
+        * latency_sigma: spread of the lognormal distribution, i.e. its tail
+        * rate_408/rate_429/rate_5xx: share of requests answered w/ that status
+        * record_failure_rate: share of records reported failed in 200 responses
+        * bucket: token bucket past which requests are answered w/ 429, if any
+        """
+
+    def __init__(self, args=None):
+        self.latency = args.latency
+        self.latency_dist = args.latency_dist
+        self.latency_sigma = args.latency_sigma
+        self.rate_408 = args.rate_408
+        self.rate_429 = args.rate_429
+        self.rate_5xx = args.rate_5xx
+        self.record_failure_rate = args.record_failure_rate
+        self.aggregation_rows = args.aggregation_rows
+        self.bucket = TokenBucket(args.rate_limit) if args.rate_limit else None
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        # sec spent answering each value update, in fixed buckets so memory stays flat
+        self.latencies = telemetry.Histogram('mock_value_latency_seconds', 'Value update response time')
+
+    def delay(self):
+        if self.latency_dist == 'uniform':
+            return random.uniform(0, 2 * self.latency)
+        elif self.latency_dist == 'lognormal':
+            return random.lognormvariate(0, self.latency_sigma) * self.latency
+        return self.latency
+
+    def status(self):
+        """Draws the status a request is answered with, ahead of its body"""
+
+        with self.lock:
+            if self.bucket is not None and self.bucket.take():
+                return 429
+        draw = random.random()
+        for status, rate in ((408, self.rate_408), (429, self.rate_429), (503, self.rate_5xx)):
+            if draw < rate:
+                return status
+            draw -= rate
+        return 200
+
+    def count(self, **counts):
+        with self.lock:
+            self.stats.update(counts)
+
+    def observe(self, latency=None):
+        self.latencies.observe(latency)
+
+    def summary(self):
+        """Counters, plus percentiles of value update latency"""
+
+        with self.lock:
+            summary = dict(self.stats)
+        for pct in telemetry.QUANTILES:
+            latency = self.latencies.quantile(pct)
+            if latency is not None:
+                summary[f'latency_p{pct}'] = latency
+        return summary
+
+
+def value_result(records=None, primary_key=None, failure_rate=0.0):
+    """Pendo's response body for a metadata value update"""
+
+    errors = [
+        {'id': record.get(primary_key), 'error': 'mock failure'}
+        for record in records if random.random() < failure_rate
+    ]
+    return {
+        'total': len(records),
+        'updated': len(records) - len(errors),
+        'failed': len(errors),
+        'missing': [],
+        'errors': errors
+    }
+
+
+def aggregation_result(body=None, rows=None):
+    """Rows of UUIDs for the field the aggregation pipeline selects"""
+
+    pipeline = (body.get('request') or {}).get('pipeline') or []
+    selected = [step['select'] for step in pipeline if 'select' in step]
+    fields = list(selected[-1]) if selected else ['id']
+    return {'results': [{field: str(uuid.uuid4()) for field in fields} for _ in range(rows)]}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    faults = None
+    protocol_version = 'HTTP/1.1'  # keeps connections alive like the real API
+
+    def log_message(self, fmt, *args):
+        LOGGER.debug(fmt % args)
+
+    def reply(self, status=None, body=None, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'null')
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.reply(200, self.faults.summary())
+        else:
+            self.reply(404, {'error': f'no route for GET {self.path}'})
+
+    def do_POST(self):
+        faults = self.faults
+        started = time.monotonic()
+        body = self.read_body()
+        if not self.headers.get(KEY_HEADER):
+            self.reply(401, {'error': f'missing {KEY_HEADER} header'})
+            return
+        time.sleep(faults.delay())
+        status = faults.status()
+        faults.count(requests=1, **{f'status_{status}': 1})
+        if status == 429:
+            self.reply(status, {'error': 'too many requests'}, {'Retry-After': '1'})
+        elif status != 200:
+            self.reply(status, {'error': 'mock fault'})
+        elif VALUE_PATH.match(self.path):
+            primary_key = 'accountId' if VALUE_PATH.match(self.path).group(1) == 'account' else 'visitorId'
+            result = value_result(body or [], primary_key, faults.record_failure_rate)
+            faults.count(records=result['total'], records_failed=result['failed'])
+            self.reply(200, result)
+            faults.observe(time.monotonic() - started)
+        elif self.path.rstrip('/') == AGGREGATION_PATH:
+            self.reply(200, aggregation_result(body or {}, faults.aggregation_rows))
+        else:
+            self.reply(404, {'error': f'no route for POST {self.path}'})
+
+
+def handle_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local mock of the Pendo API')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8089, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0.05, help='Median response latency (sec)')
+    parser.add_argument('--latency_dist', default='fixed', choices=['fixed', 'uniform', 'lognormal'],
+                        help='Distribution response latencies are drawn from')
+    parser.add_argument('--latency_sigma', type=float, default=0.5, help='Lognormal latency: spread of the tail')
+    parser.add_argument('--rate_408', type=float, default=0.0, help='Share of requests answered w/ 408')
+    parser.add_argument('--rate_429', type=float, default=0.0, help='Share of requests answered w/ 429')
+    parser.add_argument('--rate_5xx', type=float, default=0.0, help='Share of requests answered w/ 503')
+    parser.add_argument('--record_failure_rate', type=float, default=0.0,
+                        help='Share of records reported failed in successful responses')
+    parser.add_argument('--rate_limit', type=float, help='Requests per second past which 429 is returned')
+    parser.add_argument('--aggregation_rows', type=int, default=100, help='# of rows returned by /aggregation')
+    return parser.parse_args(argv)
+
+
+def serve(args=None):
+    """Returns a server for the mock, started on a daemon thread"""
+
+    handler = type('MockHandler', (MockHandler,), {'faults': Faults(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='pendo-mock', daemon=True).start()
+    LOGGER.info(f"PENDO MOCK LISTENING @ http://{args.host}:{server.server_port}")
+    return server
+
+
+def main():
+    server = serve(handle_args(sys.argv[1:]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        LOGGER.info(f"PENDO MOCK STATS: {server.RequestHandlerClass.faults.summary()}")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    """Main entry point"""
+    main()
@@ -0,0 +1,146 @@
+"""Runs tap-redshift and target-pendo in a single process.
+
+Messages generated by the tap are handed to the target as dicts through a
+bounded queue, skipping the JSON serialization, the pipe copy and the JSON
+parsing that the piped invocation pays for every record:
+
+    redshift-pendo -c target_config.json [target options] -- \\
+        -c tap_config.json --catalog catalog.json [tap options]
+
+Everything after '--' is passed to tap-redshift as its own arguments.
+"""
+import sys
+import json
+import queue
+import datetime
+import importlib
+import threading
+from decimal import Decimal
+import simplejson
+import target_pendo
+from target_pendo.logger import SyncLogger
+from target_pendo.exceptions import TargetPendoException
+
+LOGGER = SyncLogger(__name__).logger
+QUEUE_SIZE = 10000  # Max # of messages buffered between tap and target
+TAP_DONE = object()  # Sentinel put on the queue once the tap is exhausted
+
+
+def split_argv(argv=None):
+    """Splits CLI args into (target args, tap args) on the first '--'"""
+
+    if '--' not in argv:
+        raise TargetPendoException(
+            "MISSING '--' SEPARATOR BEFORE TAP-REDSHIFT ARGS"
+        )
+    idx = argv.index('--')
+    return argv[:idx], argv[idx + 1:]
+
+
+def plain_value(val=None):
+    """Coerces a tap value to the type it would have after a JSON round-trip,
+    so in-process output stays identical to the piped mode
+    """
+
+    if isinstance(val, Decimal):
+        as_str = str(val)
+        if as_str.lstrip('-').isdigit():
+            return int(as_str)
+        return float(as_str)
+    elif isinstance(val, (datetime.datetime, datetime.date)):
+        return val.isoformat()
+    elif isinstance(val, simplejson.RawJSON):
+        # values built by Redshift in --shape_payload json mode
+        return json.loads(val.encoded)
+    elif isinstance(val, dict):
+        return {key: plain_value(elem) for key, elem in val.items()}
+    elif isinstance(val, (list, tuple)):
+        return [plain_value(elem) for elem in val]
+    return val
+
+
+def to_wire(message=None):
+    """Returns the dict the target would have parsed from the message's line"""
+
+    obj = message.asdict()
+    if obj.get('type') == 'RECORD':
+        obj['record'] = {key: plain_value(val) for key, val in obj['record'].items()}
+    elif obj.get('type') == 'RECORD_BATCH':
+        obj['rows'] = [[plain_value(val) for val in row] for row in obj['rows']]
+    return obj
+
+
+class TapThread(threading.Thread):
+    """Runs the tap's generate_messages and feeds the bounded queue"""
+
+    def __init__(self, tap=None, messages=None):
+        super().__init__(name='tap-redshift', daemon=True)
+        self.tap = tap
+        self.messages = messages
+        self.error = None
+
+    def run(self):
+        try:
+            for message in self.tap_messages():
+                if message is not None:
+                    self.messages.put(to_wire(message))
+        except BaseException as exc:
+            self.error = exc
+        finally:
+            self.messages.put(TAP_DONE)
+
+    def tap_messages(self):
+        tap = self.tap
+        connection = tap.connect.open_connection(tap.CONFIG)
+        state = tap.sync.build_state(tap.STATE, tap.CATALOG)
+        LOGGER.info("STARTING IN-PROCESS REDSHIFT SYNC")
+        return tap.messages.generate_messages(connection, tap.SCHEMA, tap.CATALOG, state)
+
+
+def drain(messages=None, tap_thread=None):
+    """Yields message dicts from the queue until the tap is done"""
+
+    while True:
+        obj = messages.get()
+        if obj is TAP_DONE:
+            break
+        yield obj
+    if tap_thread.error is not None:
+        raise tap_thread.error
+    LOGGER.info("COMPLETED IN-PROCESS SYNC")
+
+
+def main_impl():
+    target_pendo.check_recursion()
+    target_argv, tap_argv = split_argv(sys.argv[1:])
+    # both packages parse sys.argv, so hand each its own half
+    sys.argv = ['target-pendo'] + target_argv
+    target_args = target_pendo.handle_args()
+    config = target_args.get('config')
+    batch_lims = target_args.get('batch_lims')
+    sys.argv = ['tap-redshift'] + tap_argv
+    tap = importlib.import_module('tap_redshift')
+    target_pendo.configure_streams(config, target_args.get('args'), batch_lims)
+    messages = queue.Queue(maxsize=QUEUE_SIZE)
+    tap_thread = TapThread(tap, messages)
+    tap_thread.start()
+    target_pendo.persist_messages(drain(messages, tap_thread), config, batch_lims)
+    target_pendo.close_streams()
+    target_pendo.check_delivered()
+
+
+def main():
+    try:
+        main_impl()
+    except TargetPendoException as exc:
+        for line in str(exc).splitlines():
+            LOGGER.critical(line)
+        sys.exit(1)
+    except Exception as exc:
+        LOGGER.critical(exc)
+        raise exc
+
+
+if __name__ == '__main__':
+    """Main entry point"""
+    main()
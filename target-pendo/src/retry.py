@@ -0,0 +1,184 @@
+"""Per-record retries of records Pendo fails, and the dead-letter file.
+
+Pendo reports the records it failed in a batch by id in the response's
+'errors'. Failed records from every batch of a stream are pooled and
+regrouped into new batches, which are retried concurrently in rounds with
+jittered exponential backoff. Records still failing after max_attempts are
+appended to an NDJSON dead-letter file, which --replay_dead_letter sends
+again in a later run. A batch is resolved once each of its records has
+been accepted or dead-lettered, and the dead-letter file is fsynced off
+the event loop before it is acknowledged.
+"""
+import os
+import json
+import random
+from datetime import datetime, timezone
+from collections import Counter
+from target_pendo.batches import Batch
+from target_pendo.group_sync import GroupSync
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+RETRY_BASE = 1.0  # seconds, backoff ceiling before the first retry round
+RETRY_CAP = 60.0  # seconds, max backoff ceiling
+DEAD_LETTER_FILE = 'dead_letter.ndjson'
+
+
+def retry_delay(retry_round=0):
+    """Full-jitter exponential backoff before a retry round"""
+
+    return random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** retry_round))
+
+
+class RetryBatch(Batch):
+    """Batch of failed records regrouped for a retry
+    * origins: seq of the batch each record was first sent in
+    * attempts: # of attempts already made for each record
+    """
+
+    def __init__(self, records=(), origins=(), attempts=(), stream=None):
+        super().__init__(records, None, stream)
+        self.origins = list(origins)
+        self.attempts = list(attempts)
+
+
+class DeadLetter:
+    """ * path: NDJSON file records that exhausted their attempts are appended to
+        * written: per-stream Counter of dead-lettered records
+        """
+
+    def __init__(self, path=DEAD_LETTER_FILE):
+        self.path = path
+        self.file = None
+        self.syncer = None
+        self.written = Counter()
+
+    def write(self, stream=None, record=None, attempts=None, error=None):
+        if self.file is None:
+            self.file = open(self.path, 'a')
+            self.syncer = GroupSync(self.file)
+        line = json.dumps({
+            'stream': stream,
+            'record': record,
+            'attempts': attempts,
+            'error': error,
+            'failed_at': datetime.now(timezone.utc).isoformat()
+        }, default=str)
+        self.file.write(line + NL)
+        self.file.flush()
+        self.syncer.wrote()
+        self.written[stream] += 1
+
+    async def flush(self):
+        """Returns once every written record is on disk, to be awaited before
+        the batches holding them are acknowledged
+        """
+        if self.syncer is not None:
+            await self.syncer.sync()
+
+    def close(self):
+        if self.file is not None:
+            self.syncer.sync_now()
+            self.file.close()
+            self.file = None
+
+
+def read_dead_letter(path=None):
+    """Moves a dead-letter file aside and returns its records by stream,
+    so records failing again are written to a fresh file
+    """
+
+    if not os.path.exists(path):
+        LOGGER.warning(f"NO DEAD-LETTER FILE AT {path}, NOTHING TO REPLAY")
+        return {}
+    # a unique suffix, so an earlier replay's file is never overwritten
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    replaying = f'{path}.replayed-{stamp}-{os.getpid()}'
+    os.replace(path, replaying)
+    by_stream = {}
+    with open(replaying) as dead:
+        for line in dead:
+            if line.strip():
+                entry = json.loads(line)
+                by_stream.setdefault(entry['stream'], []).append(entry['record'])
+    LOGGER.info(
+        f"REPLAYING {sum(len(records) for records in by_stream.values())} DEAD-LETTERED RECORDS{NL}"
+        + f"MOVED {path} TO {replaying}"
+    )
+    return by_stream
+
+
+class RetryQueue:
+    """ * stream: stream the failed records belong to
+        * max_attempts: # of attempts per record, the first send included
+        * max_records: max # of records per retry batch
+        * dead_letter: DeadLetter records go to after their last attempt
+        * outstanding: # of unresolved records per first-sent batch seq
+        """
+
+    def __init__(self, stream=None, max_attempts=None, max_records=None, dead_letter=None):
+        self.stream = stream
+        self.max_attempts = max_attempts
+        self.max_records = max_records
+        self.dead_letter = dead_letter or DeadLetter()
+        self.waiting = []  # (record, origin seq, attempts made, last error)
+        self.outstanding = Counter()
+        self.rounds = 0
+        self.retried = 0
+        self.recovered = 0
+
+    def settle(self, batch=None, failures=None):
+        """Records the outcome of a sent batch, given the positions of its failed
+        records mapped to their errors. Returns the seqs of first-sent batches
+        whose records are now all resolved
+        """
+
+        if isinstance(batch, RetryBatch):
+            origins, attempts = batch.origins, batch.attempts
+        else:
+            origins, attempts = [batch.seq] * len(batch), [0] * len(batch)
+            self.outstanding[batch.seq] += len(batch)
+        resolved = []
+        for pos, record in enumerate(batch):
+            origin, made = origins[pos], attempts[pos] + 1
+            if pos in failures:
+                if made < self.max_attempts:
+                    self.waiting.append((record, origin, made, failures[pos]))
+                    continue
+                LOGGER.error(
+                    f"RECORD FAILED {made} ATTEMPTS, DEAD-LETTERING: {record}{NL}"
+                    + f"ERROR: {failures[pos]}"
+                )
+                self.dead_letter.write(self.stream, record, made, failures[pos])
+            elif made > 1:
+                self.recovered += 1
+            self.outstanding[origin] -= 1
+            if self.outstanding[origin] <= 0:
+                del self.outstanding[origin]
+                resolved.append(origin)
+        return resolved
+
+    def regroup(self):
+        """Moves the waiting records into new batches for the next retry round"""
+
+        waiting, self.waiting = self.waiting, []
+        self.rounds += 1
+        self.retried += len(waiting)
+        batches = []
+        for start in range(0, len(waiting), self.max_records):
+            chunk = waiting[start:start + self.max_records]
+            batches.append(RetryBatch(
+                [entry[0] for entry in chunk],
+                [entry[1] for entry in chunk],
+                [entry[2] for entry in chunk],
+                self.stream
+            ))
+        return batches
+
+    def log_stats(self):
+        LOGGER.info(
+            f"RETRIES FOR {self.stream}: {self.retried} RECORD RETRIES IN {self.rounds} ROUNDS{NL}"
+            + f"{self.recovered} RECORDS RECOVERED, "
+            + f"{self.dead_letter.written[self.stream]} DEAD-LETTERED TO {self.dead_letter.path}"
+        )
@@ -0,0 +1,304 @@
+"""Sharded sender: spreads the transform, batch and send work over processes.
+
+With --shards N, the target process only reads lines, hashes each record's
+primary key and routes the line to one of N worker processes, so all
+updates for a key go through the same worker in order. Each worker runs
+persist_messages with its own dispatcher and HTTP client. Each gets 1/N of
+the rate limit, unless they all draw on a shared --rate_budget. SCHEMA and
+ACTIVATE_VERSION messages go to every worker. VOLUME messages are dropped,
+because shard sizes are not known in advance, and each worker finishes its
+streams once its input ends.
+
+RECORD lines are not decoded by the reader. Their type, stream and primary
+key are scanned out of the raw line and the line is forwarded as is, so
+JSON decoding happens in the workers. RECORD_BATCH rows are decoded, since
+they are split between workers.
+
+Every STATE is replaced by a numbered barrier that is sent to every worker.
+A worker emits the barrier back once the records it received before the
+barrier are acknowledged. The parent emits the real STATE once every
+worker has emitted its barrier.
+"""
+import re
+import json
+import zlib
+import queue
+import argparse
+import multiprocessing
+from collections import Counter
+import target_pendo
+from target_pendo.logger import SyncLogger
+from target_pendo.exceptions import TargetPendoException
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+CHUNK_LINES = 500  # lines sent to a worker per queue put
+INBOX_CHUNKS = 64  # max # of chunks queued for a worker before the reader blocks
+BARRIER_KEY = 'shard_barrier'
+POLL_SECONDS = 1.0
+STRING = r'"(?:[^"\\]|\\.)*"'
+TYPE_FIELD = re.compile(r'"type"\s*:\s*("\w+")')
+STREAM_FIELD = re.compile(r'"stream"\s*:\s*(' + STRING + ')')
+
+
+def scan(pattern=None, line=None):
+    """Returns the JSON value of pattern's first match in the raw line, or None"""
+
+    match = pattern.search(line)
+    return None if match is None else token_value(match.group(1))
+
+
+def token_value(token=None):
+    if token[0] == '"' and '\\' not in token:
+        return token[1:-1]
+    return json.loads(token)  # escaped strings and numbers
+
+
+class ShardRouter:
+    """ * config: target config, giving each stream's primary key and field mappings
+        * shards: # of worker processes
+        """
+
+    def __init__(self, config=None, shards=None):
+        self.config = config
+        self.shards = shards
+        self.keys = {}  # stream -> record field holding the Pendo primary key
+        self.patterns = {}  # stream -> regex scanning the key field out of a raw line
+        self.shaped = set()  # streams whose records the tap already shaped
+        self.missing = Counter()  # records w/o a primary key, per stream
+
+    def observe_schema(self, stream=None, schema=None):
+        """Shaped records carry the Pendo primary key itself, not the tap column"""
+
+        if (schema or {}).get(target_pendo.PAYLOAD_SCHEMA_KEY):
+            self.shaped.add(stream)
+        else:
+            self.shaped.discard(stream)
+        self.keys.pop(stream, None)
+        self.patterns.pop(stream, None)
+
+    def key_field(self, stream=None):
+        if stream not in self.keys:
+            stream_config = self.config.get(stream) or {}
+            primary_key = stream_config.get('primary_key')
+            mappings = stream_config.get('field_mappings') or {}
+            if stream in self.shaped:
+                self.keys[stream] = primary_key
+            else:
+                self.keys[stream] = mappings.get(primary_key, primary_key)
+        return self.keys[stream]
+
+    def key_pattern(self, stream=None):
+        if stream not in self.patterns:
+            self.patterns[stream] = re.compile(
+                '"' + re.escape(self.key_field(stream)) + r'"\s*:\s*(' + STRING + r'|[^\s,}\]]+)'
+            )
+        return self.patterns[stream]
+
+    def shard_of(self, stream=None, record=None):
+        return self.shard_of_key(stream, record.get(self.key_field(stream)))
+
+    def shard_of_key(self, stream=None, key=None):
+        if key is None:
+            self.missing[stream] += 1
+            if self.missing[stream] == 1:
+                LOGGER.warning(
+                    f"RECORD OF {stream} W/O PRIMARY KEY FIELD {self.key_field(stream)}, "
+                    + "SENDING SUCH RECORDS THROUGH SHARD 0"
+                )
+            return 0
+        # crc32 rather than hash(), which differs between processes
+        return zlib.crc32(str(key).encode('utf-8')) % self.shards
+
+
+class StateBarriers:
+    """ * states: barrier # -> STATE value waiting on the workers
+        * acked: highest barrier # each worker has emitted back
+        """
+
+    def __init__(self, shards=None):
+        self.states = {}
+        self.last = 0
+        self.acked = [0] * shards
+
+    def add(self, state=None):
+        self.last += 1
+        self.states[self.last] = state
+        return self.last
+
+    def ack(self, shard=None, barrier=None):
+        """Records a worker's barrier, returning the latest STATE every worker has passed"""
+
+        self.acked[shard] = max(self.acked[shard], barrier)
+        passed = [num for num in self.states if num <= min(self.acked)]
+        if not passed:
+            return None
+        state = self.states[max(passed)]
+        for num in passed:
+            del self.states[num]
+        return state
+
+
+def shard_lines(inbox=None):
+    """Yields the lines routed to a worker until the reader closes its inbox"""
+
+    while True:
+        chunk = inbox.get()
+        if chunk is None:
+            return
+        yield from chunk
+
+
+def run_shard(shard=None, shards=None, config=None, args=None, batch_lims=None, inbox=None, results=None):
+    """Worker process: persists the lines routed to it"""
+
+    StreamProps = target_pendo.StreamProps
+    if not args.rate_budget:
+        # a shared budget already holds the shards to the rate limit together
+        batch_lims.rate_limit = batch_lims.rate_limit / shards
+    if args.spool_dir:
+        args.spool_dir = f'{args.spool_dir}/shard-{shard}'
+    if shard:
+        args.replay_dead_letter = None
+    if args.metrics_port:
+        # each shard serves its own metrics, on the ports after --metrics_port
+        args.metrics_port += shard
+    if args.metrics_file:
+        args.metrics_file = f'{args.metrics_file}.shard-{shard}'
+    StreamProps.state_sink = lambda state: results.put((shard, 'state', state.get(BARRIER_KEY)))
+    target_pendo.configure_streams(config, args, batch_lims)
+    target_pendo.persist_records(shard_lines(inbox), config, batch_lims)
+    target_pendo.close_streams()
+    # exiting w/o 'done' fails the coordinator too
+    target_pendo.check_delivered()
+    results.put((shard, 'done', StreamProps.run_totals))
+
+
+class ShardedSender:
+    """ * shards: # of worker processes
+        * inboxes: queue of line chunks per worker
+        * results: queue of (shard, kind, value) sent back by the workers
+        """
+
+    def __init__(self, config=None, args=None, batch_lims=None, shards=None):
+        ctx = multiprocessing.get_context('spawn')
+        self.shards = shards
+        self.router = ShardRouter(config, shards)
+        self.barriers = StateBarriers(shards)
+        self.inboxes = [ctx.Queue(maxsize=INBOX_CHUNKS) for _ in range(shards)]
+        self.results = ctx.Queue()
+        self.buffers = [[] for _ in range(shards)]
+        self.totals = {}
+        self.finished = set()
+        self.workers = [
+            ctx.Process(
+                target=run_shard,
+                args=(shard, shards, config, argparse.Namespace(**vars(args)), batch_lims,
+                      self.inboxes[shard], self.results),
+                name=f'target-pendo-shard-{shard}'
+            ) for shard in range(shards)
+        ]
+        for worker in self.workers:
+            worker.start()
+        LOGGER.info(f"STARTED {shards} SHARD WORKERS")
+
+    def send(self, shard=None, line=None):
+        self.buffers[shard].append(line)
+        if len(self.buffers[shard]) >= CHUNK_LINES:
+            self.flush(shard)
+
+    def flush(self, shard=None):
+        if self.buffers[shard]:
+            self.inboxes[shard].put(self.buffers[shard])
+            self.buffers[shard] = []
+
+    def broadcast(self, line=None):
+        # flushing first keeps each worker's records in order with the message
+        for shard in range(self.shards):
+            self.send(shard, line)
+            self.flush(shard)
+
+    def route(self, line=None):
+        msg_type = scan(TYPE_FIELD, line)
+        if msg_type == 'RECORD':
+            stream = scan(STREAM_FIELD, line)
+            key = self.router.key_pattern(stream).search(line) if stream is not None else None
+            # a record w/o the key field is decoded below, to warn and route it to shard 0
+            if key is not None:
+                self.send(self.router.shard_of_key(stream, token_value(key.group(1))), line)
+                return
+        elif msg_type == 'ACTIVATE_VERSION':
+            self.broadcast(line)
+            return
+        obj = json.loads(line)
+        msg_type = obj.get('type')
+        if msg_type == 'RECORD':
+            self.send(self.router.shard_of(obj.get('stream'), obj.get('record') or {}), line)
+        elif msg_type == 'RECORD_BATCH':
+            rows = [[] for _ in range(self.shards)]
+            for row in obj.get('rows'):
+                rows[self.router.shard_of(obj.get('stream'), dict(zip(obj.get('columns'), row)))].append(row)
+            for shard, shard_rows in enumerate(rows):
+                if shard_rows:
+                    self.send(shard, json.dumps(dict(obj, rows=shard_rows)))
+        elif msg_type == 'STATE':
+            barrier = self.barriers.add(obj.get('value'))
+            self.broadcast(json.dumps({'type': 'STATE', 'value': {BARRIER_KEY: barrier}}))
+        elif msg_type == 'SCHEMA':
+            self.router.observe_schema(obj.get('stream'), obj.get('schema'))
+            self.broadcast(line)
+        elif msg_type == 'VOLUME':
+            LOGGER.info(f"{obj.get('count')} TOTAL RECORDS IN STREAM {obj.get('stream')}")
+        else:
+            self.broadcast(line)
+
+    def collect(self, timeout=0):
+        """Handles results from the workers, waiting up to timeout for the first"""
+
+        while True:
+            try:
+                shard, kind, value = self.results.get(timeout=timeout) if timeout else self.results.get_nowait()
+            except queue.Empty:
+                return
+            timeout = 0
+            if kind == 'state':
+                target_pendo.emit_state(self.barriers.ack(shard, value))
+            elif kind == 'done':
+                self.finished.add(shard)
+                for stream, stream_totals in value.items():
+                    self.totals.setdefault(stream, Counter()).update(stream_totals)
+
+    def close(self):
+        """Closes every inbox and waits for the workers' results"""
+
+        for shard in range(self.shards):
+            self.flush(shard)
+            self.inboxes[shard].put(None)
+        while len(self.finished) < self.shards:
+            self.collect(POLL_SECONDS)
+            for shard, worker in enumerate(self.workers):
+                if shard not in self.finished and not worker.is_alive() and worker.exitcode:
+                    self.collect()
+                    if shard not in self.finished:
+                        raise TargetPendoException(
+                            f"SHARD WORKER {shard} EXITED W/ CODE {worker.exitcode}"
+                        )
+        for worker in self.workers:
+            worker.join()
+        for stream, stream_totals in self.totals.items():
+            LOGGER.info(
+                f"{stream_totals['updated']} OF {stream_totals['total']} RECORDS SUCCEEDED FOR {stream}"
+                + f" ACROSS {self.shards} SHARDS"
+            )
+
+
+def run_sharded(incoming_stream=None, config=None, args=None, batch_lims=None, shards=None):
+    """Routes serialized Singer messages to shard workers, emitting merged STATE"""
+
+    sender = ShardedSender(config, args, batch_lims, shards)
+    for line in incoming_stream:
+        if line.strip():
+            sender.route(line)
+        sender.collect()
+    sender.close()
+    return sender.totals
@@ -0,0 +1,72 @@
+"""Adapts the # of records per batch to the latency Pendo is showing.
+
+Pendo answers bulk updates taking longer than five minutes with a 408, and
+its per-record latency varies through the day. After every window of
+responses at the current size, the size grows while the p95 latency stays
+under the target and shrinks when it does not. A 408, or a single response
+over twice the target, halves the size right away. The size stays within
+the configured bounds and is written to the batch constraints, so batches
+built and retry rounds regrouped from then on use it.
+"""
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+WINDOW = 20  # responses observed at a size before it is adjusted
+GROWTH = 1.25
+DECAY = 0.75
+TIMEOUT_STATUS = 408
+
+
+def percentile(values=None, pct=95):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class BatchSizer:
+    """ * batch_lims: batch constraints whose max_records is adjusted
+        * min_records, max_records: bounds on the # of records per batch
+        * target: p95 request latency (sec) to stay under
+        * latencies: latencies observed at the current size
+        """
+
+    def __init__(self, batch_lims=None, min_records=None, max_records=None, target=None):
+        self.batch_lims = batch_lims
+        self.min_records = min_records
+        self.max_records = max_records
+        self.target = target
+        self.size = min(max(batch_lims.max_records, min_records), max_records)
+        self.batch_lims.max_records = self.size
+        self.latencies = []
+        self.changes = 0
+
+    def observe(self, latency=None, status=None):
+        """Records a response, adjusting the size once it warrants it"""
+
+        if status == TIMEOUT_STATUS or (latency is not None and latency > self.target * 2):
+            return self.resize(self.size * 0.5, f"STATUS {status}, LATENCY {latency}s")
+        if latency is None:
+            return self.size
+        self.latencies.append(latency)
+        if len(self.latencies) < WINDOW:
+            return self.size
+        p95 = percentile(self.latencies)
+        factor = GROWTH if p95 < self.target else DECAY
+        return self.resize(self.size * factor, f"P95 LATENCY {round(p95, 3)}s")
+
+    def resize(self, size=None, reason=None):
+        size = min(max(int(size), self.min_records), self.max_records)
+        self.latencies = []
+        if size != self.size:
+            LOGGER.info(
+                f"BATCH SIZE {self.size} -> {size} RECORDS ({reason}, TARGET {self.target}s)"
+            )
+            self.size = self.batch_lims.max_records = size
+            self.changes += 1
+        return self.size
+
+    def log_stats(self):
+        LOGGER.info(
+            f"BATCH SIZE SETTLED ON {self.size} RECORDS AFTER {self.changes} ADJUSTMENTS{NL}"
+            + f"BOUNDS: {self.min_records}-{self.max_records}, P95 TARGET: {self.target}s"
+        )
@@ -0,0 +1,247 @@
+"""Durable write-ahead spool of built batches.
+
+Every built batch is appended to a segment file before it is sent, and an
+ack entry is appended once Pendo accepts it. Segments are append-only and
+memory-mapped for reading, so batches evicted from memory while the sender
+falls behind are read back from disk when their turn comes. On restart,
+batches without an ack are replayed instead of re-extracting from Redshift.
+
+Appends are fsynced off the event loop with a group commit: a batch is
+synced with flush() before it is sent, and every append made before that
+fsync started is covered by it. Acks are left to the page cache until
+close(), as a lost ack only resends an idempotent batch.
+
+Entry layout: header (magic, kind, seq, payload length, payload crc32)
+followed by the JSON payload {'stream': ..., 'records': [...]} for batches
+and no payload for acks. A torn entry at the tail of a segment ends it.
+"""
+import os
+import json
+import mmap
+import zlib
+import struct
+from target_pendo.batches import Batch
+from target_pendo.group_sync import GroupSync
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+MAGIC = b'PSPL'
+HEADER = struct.Struct('<4sBQII')
+BATCH_ENTRY = 1
+ACK_ENTRY = 2
+SEGMENT_BYTES = 64 * 1024 * 1024
+SEGMENT_FMT = 'segment-{:08d}.spool'
+
+
+class SpooledBatch:
+    """Placeholder for a batch that lives only in the spool"""
+
+    def __init__(self, seq=None, stream=None, size=0):
+        self.seq = seq
+        self.stream = stream
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+class Segment:
+    def __init__(self, directory=None, segment_id=None):
+        self.segment_id = segment_id
+        self.path = os.path.join(directory, SEGMENT_FMT.format(segment_id))
+        self.file = open(self.path, 'ab+')
+        self.size = self.file.seek(0, os.SEEK_END)
+        self.mapped = None
+        self.unacked = set()
+        self.syncer = GroupSync(self.file)
+
+    def append(self, kind=None, seq=None, payload=b''):
+        offset = self.size
+        header = HEADER.pack(MAGIC, kind, seq, len(payload), zlib.crc32(payload))
+        self.file.write(header + payload)
+        self.file.flush()
+        self.syncer.wrote()
+        self.size += HEADER.size + len(payload)
+        return offset + HEADER.size
+
+    def view(self, end=None):
+        """Returns a read-only map covering at least the first end bytes"""
+        if self.mapped is None or len(self.mapped) < end:
+            if self.mapped is not None:
+                self.mapped.close()
+            self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mapped
+
+    def read(self, offset=None, length=None):
+        return self.view(offset + length)[offset:offset + length]
+
+    def entries(self):
+        """Yields (kind, seq, payload offset, payload length) up to the first torn entry"""
+        if not self.size:
+            return
+        view = self.view(self.size)
+        offset = 0
+        while offset + HEADER.size <= self.size:
+            magic, kind, seq, length, crc = HEADER.unpack_from(view, offset)
+            start = offset + HEADER.size
+            if magic != MAGIC or start + length > self.size or zlib.crc32(view[start:start + length]) != crc:
+                LOGGER.warning(
+                    f"TRUNCATING TORN SPOOL ENTRY @ {self.path}:{offset}"
+                )
+                self.truncate(offset)
+                return
+            yield kind, seq, start, length
+            offset = start + length
+
+    def truncate(self, offset=None):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self.file.truncate(offset)
+        self.size = offset
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class BatchSpool:
+    """ * directory: where segment files are kept
+        * memory_batches: max # of built batches kept in memory, the rest are read from disk
+        * segment_bytes: size after which a new segment is started
+        """
+
+    def __init__(self, directory=None, memory_batches=None, segment_bytes=SEGMENT_BYTES, sync=True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.memory_batches = memory_batches
+        self.segment_bytes = segment_bytes
+        self.sync = sync
+        self.segments = {}
+        self.index = {}  # seq -> (segment_id, offset, length, stream, size)
+        self.resident = set()  # seqs of spooled batches also held in memory
+        self.last_seq = 0
+        self.recover()
+        next_id = max(self.segments) + 1 if self.segments else 1
+        self.active = self.segments[next_id] = Segment(directory, next_id)
+
+    def recover(self):
+        """Indexes unacknowledged batches left by a previous run"""
+        acked = set()
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith('.spool'))
+        for name in names:
+            segment_id = int(name.split('-')[1].split('.')[0])
+            segment = self.segments[segment_id] = Segment(self.directory, segment_id)
+            for kind, seq, offset, length in segment.entries():
+                self.last_seq = max(self.last_seq, seq)
+                if kind == ACK_ENTRY:
+                    acked.add(seq)
+                elif kind == BATCH_ENTRY:
+                    head = json.loads(segment.read(offset, length))
+                    self.index[seq] = (segment_id, offset, length, head['stream'], len(head['records']))
+                    segment.unacked.add(seq)
+        for seq in acked:
+            self.forget(seq)
+        self.collect_all()
+        if self.index:
+            LOGGER.info(
+                f"RECOVERED {len(self.index)} UNACKNOWLEDGED BATCHES FROM SPOOL @ {self.directory}"
+            )
+
+    def roll(self):
+        if self.active.size >= self.segment_bytes:
+            next_id = self.active.segment_id + 1
+            self.active = self.segments[next_id] = Segment(self.directory, next_id)
+        return self.active
+
+    def append(self, batch=None):
+        """Writes the batch ahead of sending it, returning what to keep pending:
+        the batch itself, or a SpooledBatch once memory_batches are held
+        """
+        payload = json.dumps({'stream': batch.stream, 'records': batch}).encode('utf-8')
+        segment = self.roll()
+        offset = segment.append(BATCH_ENTRY, batch.seq, payload)
+        segment.unacked.add(batch.seq)
+        self.index[batch.seq] = (segment.segment_id, offset, len(payload), batch.stream, len(batch))
+        self.last_seq = max(self.last_seq, batch.seq)
+        if self.memory_batches is not None and len(self.resident) >= self.memory_batches:
+            return SpooledBatch(batch.seq, batch.stream, len(batch))
+        self.resident.add(batch.seq)
+        return batch
+
+    def load(self, seq=None):
+        segment_id, offset, length, stream, _ = self.index[seq]
+        body = json.loads(self.segments[segment_id].read(offset, length))
+        return Batch(body['records'], seq, stream)
+
+    async def flush(self, seq=None):
+        """Returns once the batch's entry is on disk, to be awaited before sending it.
+        Its segment holds an unacked batch until then, so it is never removed mid-fsync
+        """
+        if not self.sync or seq not in self.index:
+            return
+        await self.segments[self.index[seq][0]].syncer.sync()
+
+    def resolve(self, item=None):
+        """Returns the batch for a pending item, reading it back from disk if evicted"""
+        if isinstance(item, SpooledBatch):
+            return self.load(item.seq)
+        return item
+
+    def ack(self, seq=None):
+        """Records that every record of the batch was accepted or dead-lettered"""
+        if seq not in self.index:
+            return
+        self.active.append(ACK_ENTRY, seq)
+        self.resident.discard(seq)
+        self.forget(seq)
+        self.collect_all()
+
+    def forget(self, seq=None):
+        entry = self.index.pop(seq, None)
+        if entry is None:
+            return None
+        segment_id = entry[0]
+        self.segments[segment_id].unacked.discard(seq)
+        return segment_id
+
+    def collect(self, segment_id=None):
+        """Removes a segment once every batch in it is acknowledged.
+        Acks for its batches may live in later segments, so only segments
+        older than every segment holding unacked batches are removed.
+        """
+        segment = self.segments.get(segment_id)
+        if segment is None or segment is getattr(self, 'active', None) or segment.unacked:
+            return
+        oldest_unacked = min(
+            (sid for sid, seg in self.segments.items() if seg.unacked), default=None
+        )
+        if oldest_unacked is not None and segment_id > oldest_unacked:
+            return
+        segment.remove()
+        del self.segments[segment_id]
+
+    def collect_all(self):
+        for segment_id in sorted(self.segments):
+            self.collect(segment_id)
+
+    def unacked(self):
+        """Returns placeholders for unacknowledged batches, by stream, in seq order"""
+        by_stream = {}
+        for seq in sorted(self.index):
+            _, _, _, stream, size = self.index[seq]
+            by_stream.setdefault(stream, []).append(SpooledBatch(seq, stream, size))
+        return by_stream
+
+    def close(self):
+        for segment in self.segments.values():
+            if self.sync:
+                segment.syncer.sync_now()
+            segment.close()
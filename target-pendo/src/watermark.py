@@ -0,0 +1,70 @@
+"""Holds back STATE messages until Pendo has accepted the data before them.
+
+A STATE received after the Nth record is bound to the sequence number of
+the last batch built once none of the first N records is still waiting to be
+batched (in the partial batch or the coalescer). It is released once every
+batch up to that sequence number has been acknowledged, tracked as the
+highest contiguous acked sequence so requests may complete out of order.
+Only the latest released STATE needs to be emitted.
+"""
+from collections import deque
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+
+
+class StateWatermark:
+    """ * contiguous: every batch seq up to and including it has been acknowledged
+        * acked: acknowledged seqs above the contiguous watermark
+        * held: (record ordinal, state) of states not yet bound, in arrival order
+        * bound: (batch seq, state) of states waiting on acknowledgements
+        """
+
+    def __init__(self, contiguous=0):
+        self.contiguous = contiguous
+        self.acked = set()
+        self.held = deque()
+        self.bound = deque()
+
+    def hold(self, state=None, ordinal=None):
+        """Holds a STATE received after the given # of records"""
+
+        self.held.append((ordinal, state))
+        LOGGER.debug(
+            f"HOLDING STATE AFTER RECORD {ordinal}: {state}"
+        )
+
+    def bind(self, unbatched=None, last_seq=None):
+        """Binds held states whose records are all in built batches to last_seq.
+        unbatched is the ordinal of the oldest record not yet batched, if any
+        """
+
+        while self.held and (unbatched is None or unbatched > self.held[0][0]):
+            _, state = self.held.popleft()
+            self.bound.append((last_seq, state))
+        return self.release()
+
+    def ack(self, seq=None):
+        """Marks the batch acknowledged, returning the state it releases, if any"""
+
+        if seq is None or seq <= self.contiguous:
+            return None
+        self.acked.add(seq)
+        while self.contiguous + 1 in self.acked:
+            self.contiguous += 1
+            self.acked.discard(self.contiguous)
+        return self.release()
+
+    def release(self):
+        """Pops every state whose batches are acknowledged, returning the latest"""
+
+        released = None
+        while self.bound and self.bound[0][0] <= self.contiguous:
+            released = self.bound.popleft()[1]
+        if released is not None:
+            LOGGER.info(
+                f"BATCHES ACKNOWLEDGED THROUGH #{self.contiguous}{NL}"
+                + f"{len(self.held) + len(self.bound)} STATES STILL HELD"
+            )
+        return released
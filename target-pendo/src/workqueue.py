@@ -0,0 +1,304 @@
+"""Work directory shared by a coordinator and target-pendo worker processes.
+
+With --work_dir, target-pendo reads the tap's output as a coordinator. It
+builds batches as usual, but writes each one to the work directory instead
+of sending it. Processes started with --work_dir and --worker claim batch
+files, post them to Pendo, and write an ack file for each one. They can run
+on any host that mounts the directory. The coordinator folds acks into the
+STATE watermark, so STATE is emitted only once every batch before it is
+acknowledged. No broker is needed, only atomic rename on the shared
+filesystem:
+
+    ready/batch-<seq>.json            published by the coordinator
+    leased/batch-<seq>.json.<worker>  claimed by renaming from ready/
+    acks/batch-<seq>.ack              written by the worker once resolved
+    closed                            written once every batch is acked
+
+A worker renews its leases by touching them while it sends. The
+coordinator moves leases that have not been renewed within the lease TTL
+back to ready/. A batch from a stalled worker may then be sent twice;
+Pendo value updates are idempotent, and only the first ack counts.
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+from collections import Counter
+import target_pendo
+from target_pendo.batches import Batch
+from target_pendo.logger import SyncLogger
+
+LOGGER = SyncLogger(__name__).logger
+NL = "\n"  # Newline constant for easier multiline logging
+LEASE_TTL = 60.0  # sec a lease may go unrenewed before its batch is reclaimed
+POLL_SECONDS = 0.5
+CLAIM_BATCHES = 10  # max # of batches a worker claims at once
+BATCH_FMT = 'batch-{:012d}.json'
+ACK_FMT = 'batch-{:012d}.ack'
+CLOSED_FILE = 'closed'
+LEASE_SEP = '.json.'  # separates the batch file name from the worker in a lease name
+
+
+def worker_name():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def write_atomic(path=None, body=None):
+    """Writes the file under a temporary name, then renames it into place"""
+
+    tmp = f'{path}.tmp-{worker_name()}'
+    with open(tmp, 'w') as tmp_file:
+        json.dump(body, tmp_file)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.rename(tmp, path)
+
+
+def seq_of(name=None):
+    return int(name.split('-')[1].split('.')[0])
+
+
+class Lease:
+    """Batch file claimed by a worker
+    * path: the file's path under leased/
+    * seq: sequence number of the batch
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.seq = seq_of(os.path.basename(path))
+
+    def load(self):
+        with open(self.path) as batch_file:
+            body = json.load(batch_file)
+        return Batch(body['records'], body['seq'], body['stream'], body['primary_key'])
+
+    def renew(self):
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            LOGGER.warning(f"LEASE ON BATCH #{self.seq} WAS RECLAIMED")
+
+
+class WorkDir:
+    """ * directory: shared directory batches, leases and acks are kept in
+        * lease_ttl: sec a lease may go unrenewed before its batch is reclaimed
+        """
+
+    def __init__(self, directory=None, lease_ttl=LEASE_TTL):
+        self.directory = directory
+        self.lease_ttl = lease_ttl
+        self.ready = os.path.join(directory, 'ready')
+        self.leased = os.path.join(directory, 'leased')
+        self.acks = os.path.join(directory, 'acks')
+        for path in (self.ready, self.leased, self.acks):
+            os.makedirs(path, exist_ok=True)
+
+    def closed(self):
+        return os.path.exists(os.path.join(self.directory, CLOSED_FILE))
+
+    def claim(self, worker=None, limit=CLAIM_BATCHES):
+        """Claims up to limit of the oldest ready batches, returning their leases"""
+
+        leases = []
+        for name in sorted(os.listdir(self.ready)):
+            if len(leases) >= limit:
+                break
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.leased, f'{name}.{worker}')
+            try:
+                # only one worker's rename of a ready batch can succeed
+                os.rename(os.path.join(self.ready, name), path)
+                # rename keeps the publish time, which would expire the lease at once
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            leases.append(Lease(path))
+        return leases
+
+    def complete(self, lease=None, totals=None):
+        """Writes the batch's ack, then gives up its lease"""
+
+        write_atomic(os.path.join(self.acks, ACK_FMT.format(lease.seq)), {
+            'seq': lease.seq,
+            'worker': worker_name(),
+            'totals': dict(totals or {})
+        })
+        try:
+            os.remove(lease.path)
+        except FileNotFoundError:
+            LOGGER.warning(f"BATCH #{lease.seq} WAS RECLAIMED BEFORE ITS ACK")
+
+    # coordinator side
+
+    def reset(self):
+        """Clears batches, leases and acks left by a previous coordinator"""
+
+        stale = 0
+        for path in (self.ready, self.leased, self.acks):
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+                stale += 1
+        if self.closed():
+            os.remove(os.path.join(self.directory, CLOSED_FILE))
+        if stale:
+            LOGGER.warning(f"CLEARED {stale} STALE FILES FROM WORK DIR @ {self.directory}")
+
+    def publish(self, batch=None, primary_key=None):
+        write_atomic(os.path.join(self.ready, BATCH_FMT.format(batch.seq)), {
+            'seq': batch.seq,
+            'stream': batch.stream,
+            'primary_key': primary_key,
+            'records': batch
+        })
+
+    def take_acks(self):
+        """Removes and returns every ack written since the last call"""
+
+        acks = []
+        for name in sorted(os.listdir(self.acks)):
+            if not name.endswith('.ack'):
+                continue
+            path = os.path.join(self.acks, name)
+            with open(path) as ack_file:
+                acks.append(json.load(ack_file))
+            os.remove(path)
+        return acks
+
+    def reclaim(self):
+        """Moves batches whose leases have expired back to ready/"""
+
+        expired = time.time() - self.lease_ttl
+        for name in os.listdir(self.leased):
+            path = os.path.join(self.leased, name)
+            try:
+                if os.stat(path).st_mtime >= expired:
+                    continue
+                # worker names may hold dots, e.g. a host.example.com hostname
+                ready_name = name[:name.index(LEASE_SEP)] + '.json'
+                os.rename(path, os.path.join(self.ready, ready_name))
+            except FileNotFoundError:
+                continue
+            LOGGER.warning(f"LEASE EXPIRED ON {name}, BATCH RETURNED TO READY")
+
+    def discard(self, seq=None):
+        """Removes a batch that is already acked but was reclaimed after its ack"""
+
+        name = BATCH_FMT.format(seq)
+        try:
+            os.remove(os.path.join(self.ready, name))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        with open(os.path.join(self.directory, CLOSED_FILE), 'w'):
+            pass
+
+
+class WorkQueue:
+    """Coordinator's view of the work directory, run on the dispatch loop
+    * waiting: seq -> future resolved with the batch's totals once acked
+    """
+
+    def __init__(self, work_dir=None):
+        self.work_dir = work_dir
+        self.waiting = {}
+        self.poller = None
+        self.acked = 0
+        self.duplicates = 0
+
+    async def deliver(self, batch=None, primary_key=None):
+        """Publishes the batch, returning its totals once a worker acks it"""
+
+        if self.poller is None:
+            self.poller = asyncio.ensure_future(self.poll())
+        future = self.waiting[batch.seq] = asyncio.get_running_loop().create_future()
+        self.work_dir.publish(batch, primary_key)
+        return await future
+
+    async def poll(self):
+        while True:
+            for ack in self.work_dir.take_acks():
+                future = self.waiting.pop(ack['seq'], None)
+                if future is None:
+                    # sent again by a second worker after its lease expired
+                    self.duplicates += 1
+                    continue
+                self.work_dir.discard(ack['seq'])
+                self.acked += 1
+                future.set_result(Counter(ack['totals']))
+            self.work_dir.reclaim()
+            await asyncio.sleep(POLL_SECONDS)
+
+    async def close(self):
+        if self.poller is not None:
+            self.poller.cancel()
+        self.work_dir.close()
+        LOGGER.info(
+            f"WORKERS ACKNOWLEDGED {self.acked} BATCHES, {self.duplicates} DUPLICATE ACKS"
+        )
+
+
+# worker side
+
+async def send_lease(work_dir=None, lease=None, batch_lims=None):
+    StreamProps = target_pendo.StreamProps
+    batch = lease.load()
+    stream_dict = StreamProps()
+    stream_dict.stream = batch.stream
+    stream_dict.primary_key = [batch.primary_key]
+    stream_dict.pending_requests = [batch]
+    target_pendo.BATCHES_UNACKED.inc(stream=stream_dict.stream)
+    # sends the batch and retries its failed records until each is resolved
+    await target_pendo.handle_requests(batch_lims, stream_dict)
+    work_dir.complete(lease, stream_dict.stream_totals)
+    return stream_dict.stream_totals
+
+
+async def send_leases(work_dir=None, leases=None, batch_lims=None):
+    async def renew():
+        while True:
+            await asyncio.sleep(work_dir.lease_ttl / 3)
+            for lease in leases:
+                lease.renew()
+
+    renewing = asyncio.ensure_future(renew())
+    try:
+        return await asyncio.gather(*(send_lease(work_dir, lease, batch_lims) for lease in leases))
+    finally:
+        renewing.cancel()
+
+
+def worker_path(path=None, worker=None):
+    root, ext = os.path.splitext(path)
+    return f'{root}-{worker}{ext}'
+
+
+def run_worker(config=None, args=None, batch_lims=None):
+    """Claims and sends batches from the work directory until the coordinator closes it"""
+
+    work_dir = WorkDir(args.work_dir, args.lease_ttl or LEASE_TTL)
+    worker = worker_name()
+    # workers share the directory, so each keeps its own dead letters,
+    # and the leases stand in for a spool
+    args.dead_letter = worker_path(args.dead_letter, worker)
+    args.spool_dir = None
+    target_pendo.configure_streams(config, args, batch_lims)
+    LOGGER.info(f"WORKER {worker} WATCHING {args.work_dir}")
+    totals = Counter()
+    while True:
+        leases = work_dir.claim(worker, CLAIM_BATCHES)
+        if not leases:
+            if work_dir.closed():
+                break
+            time.sleep(POLL_SECONDS)
+            continue
+        for lease_totals in target_pendo.StreamProps.dispatcher.run(send_leases(work_dir, leases, batch_lims)):
+            totals.update(lease_totals)
+    target_pendo.close_streams()
+    LOGGER.info(
+        f"WORKER {worker} DONE: {totals['updated']} OF {totals['total']} RECORDS SUCCEEDED"
+    )
+    return totals